@@ -1,5 +1,6 @@
 """Api endpoints"""
 
+from fastapi import Depends
 from fastapi.routing import APIRouter
 
 from .usercrud import router as usercrud_router
@@ -17,26 +18,37 @@ from .description import router_v2_admin as description_admin_router
 from .userinfo import router as userinfo_router
 
 from .tak_missionpackage import ephemeral_router as ephemeral_takmissionpackage_router
+from .readiness import require_tak_ready
+
+# Routes that talk to TAK or need its defaults (mesh key) wait for the background initialisation
+TAK_READY = [Depends(require_tak_ready)]
 
 all_routers = APIRouter()
 all_routers.include_router(testing_router, prefix="/users", tags=["users"])  # REMOVE ME
-all_routers.include_router(usercrud_router, prefix="/users", tags=["users"])
-all_routers.include_router(clientinfo_router, prefix="/clients", tags=["clients"])
+all_routers.include_router(usercrud_router, prefix="/users", tags=["users"], dependencies=TAK_READY)
+all_routers.include_router(clientinfo_router, prefix="/clients", tags=["clients"], dependencies=TAK_READY)
 all_routers.include_router(admininfo_router, prefix="/admins", tags=["admins"])
 all_routers.include_router(healthcheck_router, prefix="/healthcheck", tags=["healthcheck"])
 all_routers.include_router(description_router, prefix="/description", tags=["description"])
 all_routers.include_router(instructions_router, prefix="/instructions", tags=["instructions"])
-all_routers.include_router(takdatapackage_router, prefix="/tak-datapackages", tags=["tak-datapackages"])
-all_routers.include_router(takmissionpackage_router, prefix="/tak-missionpackages", tags=["tak-missionpackages"])
+all_routers.include_router(
+    takdatapackage_router, prefix="/tak-datapackages", tags=["tak-datapackages"], dependencies=TAK_READY
+)
+all_routers.include_router(
+    takmissionpackage_router, prefix="/tak-missionpackages", tags=["tak-missionpackages"], dependencies=TAK_READY
+)
 
 
 all_routers_v2 = APIRouter()
 all_routers_v2.include_router(description_router_v2, prefix="/description", tags=["description"])
 all_routers_v2.include_router(description_admin_router, prefix="/admin/description", tags=["description"])
-all_routers_v2.include_router(userinfo_router, prefix="/clients", tags=["clients"])
+all_routers_v2.include_router(userinfo_router, prefix="/clients", tags=["clients"], dependencies=TAK_READY)
 
 
 all_routers_ephemeral_v1 = APIRouter()
 all_routers_ephemeral_v1.include_router(
-    ephemeral_takmissionpackage_router, prefix="/tak-missionpackages", tags=["ephemeral-tak-missionpackages"]
+    ephemeral_takmissionpackage_router,
+    prefix="/tak-missionpackages",
+    tags=["ephemeral-tak-missionpackages"],
+    dependencies=TAK_READY,
 )
@@ -5,9 +5,8 @@ import logging
 from fastapi import APIRouter, Depends
 from libpvarki.middleware import MTLSHeader
 from libpvarki.schemas.product import UserInstructionFragment
-from jinja2 import Environment, FileSystemLoader
 
-from ..config import TEMPLATES_PATH
+from ..takutils.tak_pkg_templates import TEMPLATE_ENV
 
 LOGGER = logging.getLogger(__name__)
 
@@ -18,6 +17,6 @@ router = APIRouter(dependencies=[Depends(MTLSHeader(auto_error=True))])
 async def admin_instruction_fragment() -> UserInstructionFragment:
     """Return user instructions, we use POST because the integration layer might not keep
     track of callsigns and certs by UUID and will probably need both for the instructions"""
-    template = Environment(loader=FileSystemLoader(TEMPLATES_PATH), autoescape=True).get_template("admininfo.html")
+    template = TEMPLATE_ENV.get_template("rmapi/admininfo.html")
     result = UserInstructionFragment(html=template.render())
     return result
@@ -8,6 +8,8 @@ from fastapi import APIRouter, Depends, Request
 from libpvarki.middleware import MTLSHeader
 from libpvarki.schemas.product import ProductHealthCheckResponse
 
+from takrmapi.takutils.tak_init_runner import TAK_INIT
+
 LOGGER = logging.getLogger(__name__)
 
 mtls_router = APIRouter(dependencies=[Depends(MTLSHeader(auto_error=True))])
@@ -22,6 +24,11 @@ async def get_healthcheck_delivery_status(
     ready_to_serve: bool = False
     reason: Optional[str] = None
 
+    if TAK_INIT.started and not TAK_INIT.ready:
+        reason = "TAK initialisation in progress ({})".format(TAK_INIT.phase)
+        LOGGER.info("{} : {}".format(request.url, reason))
+        return ProductHealthCheckResponse(healthy=False, extra=reason)
+
     # TODO do some actual logic to check if we have something to serve...
     # FIXME: If using this, at least use pathlib...
     dir_files = os.listdir("/opt/tak/data/certs/files")
@@ -0,0 +1,199 @@
+"""Responses for delivering TAK package archives"""
+
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import base64
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import urllib.parse
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from takrmapi.takutils.tak_pkg_cache import content_etag
+from takrmapi.takutils.tak_pkg_executor import PKG_EXECUTOR
+from takrmapi.takutils.tak_pkg_zipstream import ZIP_CHUNK_SIZE, TAKZipBytesStream, TAKZipStream
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_FILE_ETAGS: Dict[Path, Tuple[Tuple[int, int], str]] = {}
+_FILE_ETAGS_LOCK = threading.Lock()
+
+
+def content_disposition(filename: str) -> Dict[str, str]:
+    """Return Content-Disposition header for attachment (same quoting as starlette FileResponse)"""
+    quoted = urllib.parse.quote(filename)
+    if quoted != filename:
+        return {"Content-Disposition": f"attachment; filename*=utf-8''{quoted}"}
+    return {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+
+def package_zip_response(zstream: TAKZipStream, filename: Optional[str] = None) -> StreamingResponse:
+    """Stream the package archive to client, archive is deflated in the packaging executor while sending"""
+    return StreamingResponse(
+        _iter_in_executor(zstream.iter_chunks()),
+        media_type="application/zip",
+        headers=content_disposition(filename or zstream.filename),
+    )
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Check If-None-Match style header against entity tag, weak comparison"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (candidate.strip().removeprefix("W/") for candidate in header.split(","))
+
+
+def file_etag(path: Path) -> Tuple[os.stat_result, str]:
+    """Return stat and content hash entity tag of the file, the file is hashed once per (mtime, size). Blocking IO."""
+    stat = path.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _FILE_ETAGS_LOCK:
+        cached = _FILE_ETAGS.get(path)
+    if cached is not None and cached[0] == version:
+        return stat, cached[1]
+    digest = hashlib.sha256()
+    with path.open("rb") as filehandle:
+        for chunk in iter(lambda: filehandle.read(ZIP_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    # Same format as content_etag
+    etag = '"{}"'.format(digest.hexdigest()[:32])
+    with _FILE_ETAGS_LOCK:
+        _FILE_ETAGS[path] = (version, etag)
+    return stat, etag
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Return (start, end) inclusive of single byte range, None if the whole content should be sent.
+
+    Raises ValueError if the range can not be satisfied. Multiple and malformed ranges are ignored as RFC 9110 allows.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range, last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or size == 0:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def conditional_response(
+    request: Request,
+    data: bytes,
+    etag: Optional[str] = None,
+    media_type: str = "application/zip",
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """Serve content with ETag, answer If-None-Match with 304 and single byte Range requests with 206"""
+    etag = etag or content_etag(data)
+    headers = {**(headers or {}), "ETag": etag, "Accept-Ranges": "bytes"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), len(data))
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(data)}"})
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return Response(data[start : end + 1], status_code=206, media_type=media_type, headers=headers)
+    return Response(data, media_type=media_type, headers=headers)
+
+
+async def package_download_response(
+    request: Request, zstream: TAKZipStream, filename: Optional[str] = None
+) -> Response:
+    """Return package archive with ETag and Range support.
+
+    Builds that go to the package cache are assembled before responding, so the cache gets them even if the
+    client goes away and the first response already has the ETag that the retries and resumed transfers use.
+    Only archives up to the cache entry limit (zstream.complete_max_bytes) are cached, so that is also the most a
+    response holds in memory. Bigger builds, and builds that are not cached, are streamed without ETag.
+    """
+    headers = content_disposition(filename or zstream.filename)
+    if isinstance(zstream, TAKZipBytesStream):
+        return conditional_response(request, zstream.data, etag=zstream.etag, headers=headers)
+    if not zstream.on_complete:
+        return package_zip_response(zstream, filename=filename)
+
+    chunks = zstream.iter_chunks()
+    buffered: List[bytes] = []
+    size = 0
+    while True:
+        chunk = await PKG_EXECUTOR.run(next, chunks, None)
+        if chunk is None:
+            return conditional_response(request, b"".join(buffered), headers=headers)
+        buffered.append(chunk)
+        size += len(chunk)
+        if zstream.complete_max_bytes is not None and size > zstream.complete_max_bytes:
+            return StreamingResponse(
+                _iter_in_executor(itertools.chain(buffered, chunks)), media_type="application/zip", headers=headers
+            )
+
+
+def _json_str(value: str) -> bytes:
+    """Encode string as JSON the same way as FastAPI JSONResponse"""
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def iter_base64(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Base64 encode chunked data, input is re-aligned to 3 byte groups so the encoded pieces can be concatenated"""
+    remainder = b""
+    for chunk in chunks:
+        data = remainder + chunk
+        cut = len(data) - len(data) % 3
+        remainder = data[cut:]
+        if cut:
+            yield base64.b64encode(data[:cut])
+    if remainder:
+        yield base64.b64encode(remainder)
+
+
+def iter_client_zips_json(zips: Sequence[Tuple[str, str, TAKZipStream]]) -> Iterator[bytes]:
+    """Yield ClientInstructionResponse JSON for (title, filename, archive) tuples, archives are encoded on the fly"""
+    yield b'{"data":{"tak_zips":['
+    for idx, (title, filename, zstream) in enumerate(zips):
+        if idx:
+            yield b","
+        yield b'{"title":' + _json_str(title) + b',"filename":' + _json_str(filename)
+        yield b',"data":"data:application/zip;base64,'
+        yield from iter_base64(zstream.iter_chunks())
+        yield b'"}'
+    yield b"]}}"
+
+
+async def _iter_in_executor(iterator: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """Advance blocking iterator in the packaging executor"""
+    while True:
+        chunk = await PKG_EXECUTOR.run(next, iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def client_zips_json_response(zips: Sequence[Tuple[str, str, TAKZipStream]]) -> StreamingResponse:
+    """Stream the archives as base64 data urls in JSON.
+
+    Archives that are not cached are encoded chunk by chunk. Cacheable archives are also collected for the package
+    cache while they stream, up to the cache entry limit (TAK_PKG_CACHE_MAX_ENTRY_BYTES) per archive.
+    """
+    return StreamingResponse(
+        _iter_in_executor(iter_client_zips_json(zips)),
+        media_type="application/json",
+    )
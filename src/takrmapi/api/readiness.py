@@ -0,0 +1,17 @@
+"""Dependency for the routes that need TAK to be initialised"""
+
+from fastapi import HTTPException
+
+from takrmapi import config
+from takrmapi.takutils.tak_init_runner import TAK_INIT
+
+
+async def require_tak_ready() -> None:
+    """Wait for the TAK initialisation, 503 if it does not complete within TAK_INIT_READY_TIMEOUT"""
+    if await TAK_INIT.wait_ready(config.TAK_INIT_READY_TIMEOUT):
+        return
+    raise HTTPException(
+        status_code=503,
+        detail="TAK initialisation in progress ({})".format(TAK_INIT.phase),
+        headers={"Retry-After": str(max(int(config.TAK_INIT_BACKOFF_MAX), 1))},
+    )
@@ -1,6 +1,6 @@
 """Schemas for userinfo.py, including client instructions and mission ZIP files."""
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field, Extra
 
 
@@ -50,3 +50,30 @@ class TAKAdminPackageListResponse(BaseModel):  # pylint: disable=too-few-public-
         """Pydantic configs"""
 
         extra = Extra.forbid
+
+
+class UserBatchResult(BaseModel):  # pylint: disable=too-few-public-methods
+    """Provisioning outcome of single user in batch."""
+
+    uuid: str = Field(description="User UUID.")
+    callsign: str = Field(description="User callsign.")
+    success: bool = Field(description="User was provisioned and enabled in TAK.")
+    failed_stage: Optional[str] = Field(default=None, description="Stage that failed: keygen, sign or enable.")
+    error: Optional[str] = Field(default=None, description="Error message of the failed stage.")
+
+    class Config:  # pylint: disable=too-few-public-methods
+        """Pydantic configs"""
+
+        extra = Extra.forbid
+
+
+class UserBatchResponse(BaseModel):  # pylint: disable=too-few-public-methods
+    """Response schema for batch user provisioning."""
+
+    success: bool = Field(description="All users were provisioned.")
+    results: List[UserBatchResult] = Field(description="Per user results in request order.")
+
+    class Config:  # pylint: disable=too-few-public-methods
+        """Pydantic configs"""
+
+        extra = Extra.forbid
@@ -4,7 +4,7 @@ from typing import cast
 from pathlib import Path
 import logging
 
-from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import FileResponse, Response
 from libpvarki.middleware.mtlsheader import MTLSHeader, DNDict
 from libpvarki.schemas.product import UserCRUDRequest
@@ -12,8 +12,10 @@ from libpvarki.schemas.product import UserCRUDRequest
 from takrmapi.takutils import tak_helpers
 from takrmapi.takutils.tak_pkg_helpers import TAKDataPackage, TAKPackageZip
 from takrmapi.takutils.tak_admin_helpers import TAKAdminHelper
+from takrmapi.takutils.tak_pkg_executor import PKG_EXECUTOR
 
 from .schemas import TAKAdminPackageListResponse
+from .package_responses import conditional_response, etag_matches, file_etag, package_download_response
 
 LOGGER = logging.getLogger(__name__)
 
@@ -21,7 +23,7 @@ router = APIRouter(dependencies=[Depends(MTLSHeader(auto_error=True))])
 
 
 @router.get("/client-package/{package_path:path}")
-async def return_clientpackage_zip(package_path: Path, request: Request, background_tasks: BackgroundTasks) -> Response:
+async def return_clientpackage_zip(package_path: Path, request: Request) -> Response:
     """Return zip package from folder contents under requested path, use folder name as package name"""
     payload = cast(DNDict, request.state.mtlsdn)
     callsign: str = payload["CN"]
@@ -34,12 +36,12 @@ async def return_clientpackage_zip(package_path: Path, request: Request, backgro
     if not client_package.path_found:
         raise HTTPException(status_code=404, detail="Requested datapackage not found in given path")
 
-    await pkg_helper.create_zip_bundles(datapackages=[client_package])
+    if not client_package.is_folder:
+        raise HTTPException(status_code=400, detail="Requested datapackage is not a folder")
 
-    # Remove/clear temp in background
-    background_tasks.add_task(pkg_helper.helpers.remove_tmp_dir, client_package.zip_tmp_folder)
+    await pkg_helper.create_zip_streams(datapackages=[client_package])
 
-    return FileResponse(client_package.zip_path)
+    return await package_download_response(request, client_package.zip_stream)
 
 
 @router.get("/client-file/{file_path:path}")
@@ -63,13 +65,17 @@ async def return_clientpackage_file(file_path: Path, request: Request) -> Respon
     if client_file.package_name.endswith(".tpl"):
         tak_missionpkg = TAKPackageZip(user)
         await tak_missionpkg.render_tak_manifest_template(client_file)
-        return Response(client_file.template_str.encode(encoding="utf-8"), media_type="text/plain")
+        return conditional_response(request, client_file.template_str.encode(encoding="utf-8"), media_type="text/plain")
 
-    return FileResponse(client_file.package_single_file_path)
+    file_path = client_file.package_single_file_path
+    stat, etag = await PKG_EXECUTOR.run(file_etag, file_path)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return FileResponse(file_path, headers={"ETag": etag}, stat_result=stat)
 
 
 @router.get("/environment-package/{package_path:path}")
-async def return_envpackage_zip(package_path: Path, request: Request, background_tasks: BackgroundTasks) -> Response:
+async def return_envpackage_zip(package_path: Path, request: Request) -> Response:
     """Return zip package from folder contents under requested path, use folder name as package name"""
     payload = cast(DNDict, request.state.mtlsdn)
     callsign: str = payload["CN"]
@@ -82,12 +88,12 @@ async def return_envpackage_zip(package_path: Path, request: Request, background
     if not client_package.path_found:
         raise HTTPException(status_code=404, detail="Requested datapackage not found in given path")
 
-    await pkg_helper.create_zip_bundles(datapackages=[client_package])
+    if not client_package.is_folder:
+        raise HTTPException(status_code=400, detail="Requested datapackage is not a folder")
 
-    # Remove/clear temp in background
-    background_tasks.add_task(pkg_helper.helpers.remove_tmp_dir, client_package.zip_tmp_folder)
+    await pkg_helper.create_zip_streams(datapackages=[client_package])
 
-    return FileResponse(client_package.zip_path)
+    return await package_download_response(request, client_package.zip_stream)
 
 
 @router.get("/package-list")
@@ -2,24 +2,22 @@
 
 from pathlib import Path
 import logging
-import base64
-import binascii
 import urllib.parse
 import time
-import os
-import json
 import secrets
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response
 from libpvarki.middleware.mtlsheader import MTLSHeader
 from libpvarki.schemas.product import UserCRUDRequest
 
 from takrmapi import config
 from takrmapi.takutils import tak_helpers
 from takrmapi.takutils.tak_pkg_helpers import TAKDataPackage, TAKPackageZip
+from takrmapi.takutils.tak_pkg_catalog import TEMPLATE_CATALOG
+from takrmapi.takutils.tak_ephemeral_token import issue_token, verify_token
+
+from .package_responses import package_download_response
 
 LOGGER = logging.getLogger(__name__)
 
@@ -28,55 +26,35 @@ router = APIRouter(dependencies=[Depends(MTLSHeader(auto_error=True))])
 ephemeral_router = APIRouter()
 
 
-def hash_from_str(hash_from: str) -> str:
-    """Return checksum string from given string"""
-    ct_digest = hashes.Hash(hashes.SHA256())
-    ct_digest.update(hash_from.encode("ascii"))
-    ct_dig = ct_digest.finalize()
-    try:
-        ct_dig_str = binascii.hexlify(ct_dig).decode()
-    except binascii.Error as e:
-        LOGGER.info("Unable to convert digest bin to string. Possible malformed query.")
-        LOGGER.debug(e)
-        return "err"
-
-    return ct_dig_str
-
-
 @router.post("/client-zip/{variant}.zip")
-async def return_tak_zip(user: UserCRUDRequest, variant: str, background_tasks: BackgroundTasks) -> FileResponse:
+async def return_tak_zip(user: UserCRUDRequest, variant: str, request: Request) -> Response:
     """Return TAK client zip file proxied from rm api"""
 
     localuser = tak_helpers.UserCRUD(user)
     if not localuser:
         raise HTTPException(status_code=404, detail="User data not found")
 
-    target_pkg = await create_mission_package(localuser, variant, background_tasks)
+    target_pkg = await create_mission_package(localuser, variant)
 
-    return FileResponse(
-        path=target_pkg.zip_path,
-        media_type="application/zip",
-        filename=f"{localuser.callsign}_{variant}.zip",
+    return await package_download_response(
+        request, target_pkg.zip_stream, filename=f"{localuser.callsign}_{variant}.zip"
     )
 
 
-async def create_mission_package(
-    localuser: tak_helpers.UserCRUD, variant: str, background_tasks: BackgroundTasks
-) -> TAKDataPackage:
+async def create_mission_package(localuser: tak_helpers.UserCRUD, variant: str) -> TAKDataPackage:
     """Create mission package from template"""
     walk_dir = Path(config.TAK_MISSIONPKG_TEMPLATES_FOLDER) / "default" / variant
 
-    if not walk_dir.is_dir():
+    if not TEMPLATE_CATALOG.is_dir(walk_dir):
         raise HTTPException(status_code=404, detail=f"Variant '{variant}' not found")
 
     tak_missionpkg = TAKPackageZip(localuser)
     target_pkg = TAKDataPackage(template_path=walk_dir, template_type="mission")
-    await tak_missionpkg.create_zip_bundles(datapackages=[target_pkg])
-
-    if not target_pkg.zip_path or not target_pkg.zip_path.is_file():
-        raise HTTPException(status_code=500, detail="Failed to generate ZIP")
-
-    background_tasks.add_task(tak_missionpkg.helpers.remove_tmp_dir, target_pkg.zip_tmp_folder)
+    try:
+        await tak_missionpkg.create_zip_streams(datapackages=[target_pkg])
+    except ValueError as exc:
+        LOGGER.exception("Unable to assemble mission package '{}'".format(variant))
+        raise HTTPException(status_code=500, detail="Failed to generate ZIP") from exc
 
     return target_pkg
 
@@ -107,7 +85,7 @@ async def return_ephemeral_dl_link(user: UserCRUDRequest, variant: str) -> dict[
 
 
 @ephemeral_router.get("/ephemeral/{ephemeral_str}/{zipfile_name}.zip")
-async def return_ephemeral_tak_zip(ephemeral_str: str, background_tasks: BackgroundTasks) -> FileResponse:
+async def return_ephemeral_tak_zip(ephemeral_str: str, request: Request) -> Response:
     """Return the TAK client zip file using an ephemeral link"""
     LOGGER.info("Got ephemeral url fragment: %s", ephemeral_str)
 
@@ -119,11 +97,11 @@ async def return_ephemeral_tak_zip(ephemeral_str: str, background_tasks: Backgro
     if not localuser:
         raise HTTPException(status_code=404, detail="User data not found")
 
-    target_pkg = await create_mission_package(localuser, variant, background_tasks)
+    target_pkg = await create_mission_package(localuser, variant)
 
-    return FileResponse(
-        path=target_pkg.zip_path,
-        media_type="application/zip",
+    return await package_download_response(
+        request,
+        target_pkg.zip_stream,
         filename=f"{localuser.callsign}_{config.read_deployment_name()}_{variant}.zip",
     )
 
@@ -132,72 +110,22 @@ def generate_encrypted_ephemeral_url_fragment(
     user_callsign: str, user_uuid: str, variant: str, request_time: float
 ) -> str:
     """Return encrypted ephemeral url"""
-    plaintext_str: str = json.dumps({"callsign": user_callsign, "uuid": user_uuid, "variant": variant})
-    iv = os.urandom(12)
-    encryptor = Cipher(algorithms.AES(TAKDataPackage.get_ephemeral_byteskey()), modes.GCM(iv)).encryptor()
-    user_payload: bytes = encryptor.update(plaintext_str.encode("ascii")) + encryptor.finalize()
-    user_payload_b64: str = base64.b64encode(user_payload).decode("ascii")
-    iv_b64: str = base64.b64encode(iv).decode("ascii")
-    payload_digest: str = hash_from_str(user_payload_b64 + iv_b64 + str(request_time))
-    encode: str = base64.b64encode(
-        json.dumps(
-            {
-                "payload_b64": user_payload_b64,
-                "iv_b64": iv_b64,
-                "request_time": request_time,
-                "digest": payload_digest,
-            }
-        ).encode("ascii")
-    ).decode("ascii")
-
-    return encode
+    return issue_token(
+        TAKDataPackage.get_ephemeral_byteskey(), user_callsign, user_uuid, variant, issued=int(request_time)
+    )
 
 
 def parse_encrypted_ephemeral_url_fragment(ephemeral_str: str) -> tuple[str, str, str]:
-    """Parse and decrypt ephemeral url and return callsign, user uuid and variant.
+    """Verify and decrypt ephemeral url and return callsign, user uuid and variant.
 
-    Verify that the ephemeral link is not expired and that the checksum matches.
+    Expired, malformed and tampered links are all reported as not found.
     """
     try:
-        e_decoded = base64.b64decode(ephemeral_str.encode("ascii")).decode("ascii")
-    except binascii.Error as exc:
-        LOGGER.info("Unable to decode base64 to string. Possible malformed query.")
-        LOGGER.debug(exc)
-        raise HTTPException(status_code=404, detail="User data not found") from exc
-
-    ephemeral_json = json.loads(e_decoded)
-    if ephemeral_json["request_time"] + 300 < int(time.time()):
-        LOGGER.info("Ephemeral link has expired.")
-        raise HTTPException(status_code=404, detail="User data not found")
-
-    # TODO: probably should be a keyed hash to catch attempts to pass an incorrect link early
-    payload_digest: str = hash_from_str(
-        ephemeral_json["payload_b64"] + ephemeral_json["iv_b64"] + str(ephemeral_json["request_time"])
-    )
-    if payload_digest != ephemeral_json["digest"]:
-        LOGGER.info(
-            "Checksum mismatch. Calculated: {}, but got from response: {}".format(
-                payload_digest, ephemeral_json["digest"]
-            )
-        )
-        raise HTTPException(status_code=404, detail="User data not found")
-
-    iv: bytes = base64.b64decode(ephemeral_json["iv_b64"].encode("ascii"))
-    user_payload: bytes = base64.b64decode(ephemeral_json["payload_b64"].encode("ascii"))
-
-    decryptor = Cipher(algorithms.AES(TAKDataPackage.get_ephemeral_byteskey()), modes.GCM(iv)).encryptor()
-    decrypted_payload = decryptor.update(user_payload) + decryptor.finalize()
-
-    try:
-        decrypted_json = json.loads(decrypted_payload.decode("ascii"))
-    except (json.JSONDecodeError, UnicodeDecodeError) as exc:
-        LOGGER.exception("Decryption failure. It could be someone is trying something nasty.")
+        payload = verify_token(TAKDataPackage.get_ephemeral_byteskey(), ephemeral_str)
+    except ValueError as exc:
+        LOGGER.info("Rejected ephemeral link: {}".format(exc))
         raise HTTPException(status_code=404, detail="User data not found") from exc
 
-    variant = decrypted_json["variant"]
-    callsign = decrypted_json["callsign"]
-    user_uuid = decrypted_json["uuid"]
-
-    LOGGER.debug("Got the following data in ephemeral user payload: {}".format(decrypted_json))
+    LOGGER.debug("Got the following data in ephemeral user payload: {}".format(payload))
 
-    return callsign, user_uuid, variant
+    return payload.callsign, payload.user_uuid, payload.variant
@@ -1,5 +1,6 @@
 """ "User actions"""
 
+from typing import List
 import logging
 from fastapi import APIRouter, Depends
 from libpvarki.middleware import MTLSHeader
@@ -7,6 +8,13 @@ from libpvarki.schemas.product import UserCRUDRequest
 from libpvarki.schemas.generic import OperationResultResponse
 
 from takrmapi.takutils import tak_helpers
+from takrmapi.takutils.tak_pkg_cache import PACKAGE_CACHE
+from takrmapi.takutils.tak_pkg_executor import PKG_EXECUTOR
+from takrmapi.takutils.tak_pkg_pkcs12 import USER_PKCS12_CACHE
+from takrmapi.takutils.tak_pkg_prewarm import PACKAGE_PREWARMER
+from takrmapi.takutils.tak_user_batch import USER_PROVISIONER
+
+from .schemas import UserBatchResponse, UserBatchResult
 
 LOGGER = logging.getLogger(__name__)
 
@@ -20,12 +28,45 @@ async def user_created(user: UserCRUDRequest) -> OperationResultResponse:
     """New device cert was created"""
     tak_usercrud = tak_helpers.UserCRUD(user)
     LOGGER.info("Adding new user '{}' to TAK".format(user.callsign))
-    await tak_usercrud.add_new_user()
+    added = await tak_usercrud.add_new_user()
+    await PKG_EXECUTOR.run(PACKAGE_CACHE.invalidate_user, user.uuid)
+    USER_PKCS12_CACHE.invalidate_user(user.uuid)
+    # Only users TAK knows about get their packages prewarmed, like in the batch
+    if added:
+        PACKAGE_PREWARMER.schedule(user)
+    else:
+        LOGGER.warning("Adding user '{}' to TAK failed, not prewarming packages".format(user.callsign))
 
     result = OperationResultResponse(success=True)
     return result
 
 
+@router.post("/created/batch")
+async def users_created_batch(users: List[UserCRUDRequest]) -> UserBatchResponse:
+    """Many new device certs were created, stages run concurrently across the users"""
+    LOGGER.info("Adding {} new users to TAK".format(len(users)))
+    results = await USER_PROVISIONER.provision(users)
+    for user, result in zip(users, results):
+        await PKG_EXECUTOR.run(PACKAGE_CACHE.invalidate_user, user.uuid)
+        USER_PKCS12_CACHE.invalidate_user(user.uuid)
+        if result.success:
+            PACKAGE_PREWARMER.schedule(user)
+
+    return UserBatchResponse(
+        success=all(result.success for result in results),
+        results=[
+            UserBatchResult(
+                uuid=result.uuid,
+                callsign=result.callsign,
+                success=result.success,
+                failed_stage=result.failed_stage,
+                error=result.error,
+            )
+            for result in results
+        ],
+    )
+
+
 # While delete would be semantically better it takes no body and definitely forces the
 # integration layer to keep track of UUIDs
 @router.post("/revoked")
@@ -34,6 +75,9 @@ async def user_revoked(user: UserCRUDRequest) -> OperationResultResponse:
     tak_usercrud = tak_helpers.UserCRUD(user)
     LOGGER.info("Removing user '{}' from TAK".format(user.callsign))
     await tak_usercrud.revoke_user()
+    PACKAGE_PREWARMER.cancel(user.uuid)
+    await PKG_EXECUTOR.run(PACKAGE_CACHE.invalidate_user, user.uuid)
+    USER_PKCS12_CACHE.invalidate_user(user.uuid)
     result = OperationResultResponse(success=True)
     return result
 
@@ -63,5 +107,8 @@ async def user_updated(user: UserCRUDRequest) -> OperationResultResponse:
     """Device callsign updated"""
     tak_usercrud = tak_helpers.UserCRUD(user)
     await tak_usercrud.update_user()
+    PACKAGE_PREWARMER.cancel(user.uuid)
+    await PKG_EXECUTOR.run(PACKAGE_CACHE.invalidate_user, user.uuid)
+    USER_PKCS12_CACHE.invalidate_user(user.uuid)
     result = OperationResultResponse(success=True)
     return result
@@ -1,13 +1,14 @@
 """Endpoints for information for the end-user"""
 
 import logging
-import base64
-from fastapi import APIRouter, Depends, BackgroundTasks
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from libpvarki.middleware import MTLSHeader
 from libpvarki.schemas.product import UserCRUDRequest
 from takrmapi.takutils import tak_helpers
-from takrmapi.takutils.tak_pkg_helpers import TAKDataPackage, TAKPackageZip
-from .schemas import TakZipFile, ClientInstructionData, ClientInstructionResponse
+from takrmapi.takutils.tak_pkg_helpers import TAKPackageZip
+from .schemas import ClientInstructionResponse
+from .package_responses import client_zips_json_response
 
 from ..config import TAK_MISSIONPKG_ENABLED_PACKAGES
 
@@ -18,31 +19,17 @@ router = APIRouter(dependencies=[Depends(MTLSHeader(auto_error=True))])
 
 
 @router.post("/data", response_model=ClientInstructionResponse)
-async def client_instruction_fragment(
-    user: UserCRUDRequest, background_tasks: BackgroundTasks
-) -> ClientInstructionResponse:
+async def client_instruction_fragment(user: UserCRUDRequest) -> StreamingResponse:
     """Return zip package containing client config and certificates"""
     localuser = tak_helpers.UserCRUD(user)
     tak_missionpkg = TAKPackageZip(localuser)
 
-    mp_list: list[TAKDataPackage] = []
-    for m in TAK_MISSIONPKG_ENABLED_PACKAGES:
-        mp_list.append(TAKDataPackage(template_path=m, template_type="mission"))
+    mp_list = await tak_missionpkg.create_mission_packages(TAK_MISSIONPKG_ENABLED_PACKAGES)
 
-    await tak_missionpkg.create_zip_bundles(datapackages=mp_list)
-
-    tak_zips = []
-    for mpkg in mp_list:
-        contents = mpkg.zip_path.read_bytes()
-        tak_zips.append(
-            TakZipFile(
-                title=mpkg.zip_path.name,
-                filename=f"{localuser.callsign}_{mpkg.zip_path.name}",
-                data=f"data:application/zip;base64,{base64.b64encode(contents).decode('ascii')}",
-            )
-        )
-
-        # Remove/clear temp in background
-        background_tasks.add_task(tak_missionpkg.helpers.remove_tmp_dir, mpkg.zip_tmp_folder)
-
-    return ClientInstructionResponse(data=ClientInstructionData(tak_zips=tak_zips))
+    # The archives are deflated and base64 encoded while the response is sent
+    return client_zips_json_response(
+        [
+            (mpkg.zip_stream.filename, f"{localuser.callsign}_{mpkg.zip_stream.filename}", mpkg.zip_stream)
+            for mpkg in mp_list
+        ]
+    )
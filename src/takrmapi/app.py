@@ -1,18 +1,22 @@
 """ "factory for the fastpi app"""
 
 import asyncio
-import random
 from typing import AsyncGenerator
 import logging
 from contextlib import asynccontextmanager
-import filelock
 
 from fastapi import FastAPI
 from libpvarki.logging import init_logging
 
 from takrmapi import __version__
-from takrmapi import config
-from takrmapi.takutils import tak_init
+from takrmapi.takutils.tak_http_pool import HTTP_SESSIONS
+from takrmapi.takutils.tak_init_runner import TAK_INIT
+from takrmapi.takutils.tak_keypair_pool import KEYPAIR_POOL
+from takrmapi.takutils.tak_keypair_ready import KEYPAIR_READY
+from takrmapi.takutils.tak_pkg_catalog import TEMPLATE_CATALOG
+from takrmapi.takutils.tak_pkg_executor import PKG_EXECUTOR
+from takrmapi.takutils.tak_pkg_prewarm import PACKAGE_PREWARMER
+from takrmapi.takutils.tak_scripts import SCRIPT_QUEUE
 from .config import LOG_LEVEL
 from .api import all_routers, all_routers_v2, all_routers_ephemeral_v1
 
@@ -24,32 +28,33 @@ LOGGER = logging.getLogger(__name__)
 async def app_lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     """Handle lifespan management things"""
     # init
+    await HTTP_SESSIONS.open()
 
-    lockpath = config.TAK_CERTS_FOLDER / "takrmapi_init.lock"
-    # Random sleep to the lock file access to avoid race conditions
-    await asyncio.sleep(random.random() / 2)  # nosec
-    lock = filelock.FileLock(lockpath)
+    # TAK setup runs in background, routes needing TAK wait for it
+    TAK_INIT.start()
 
-    try:
-        lock.acquire(timeout=0.0)
-        await tak_init.setup_tak_mgmt_conn()
-        await tak_init.setup_tak_defaults()
-    except filelock.Timeout:
-        LOGGER.warning("Someone has already locked {}, leaving this init to them".format(lockpath))
-    finally:
-        lock.release()
-
-    # Wait for the init to be completed
-    while lock.is_locked:
-        LOGGER.warning("tak_init has not yet completed. Waiting for {} to be relased.".format(lockpath))
-        await asyncio.sleep(2)
-
-    await tak_init.get_tak_defaults()
+    # Index the package templates once, the watcher keeps the index current
+    await asyncio.get_running_loop().run_in_executor(None, TEMPLATE_CATALOG.scan)
+    catalog_watcher = asyncio.create_task(TEMPLATE_CATALOG.watch())
+    keypair_watcher = asyncio.create_task(KEYPAIR_READY.watch())
+    KEYPAIR_POOL.start()
 
     _ = app
     # App runs
     yield
     # Cleanup
+    for watcher in (catalog_watcher, keypair_watcher):
+        watcher.cancel()
+        try:
+            await watcher
+        except asyncio.CancelledError:
+            pass
+    await TAK_INIT.shutdown()
+    await PACKAGE_PREWARMER.shutdown()
+    await SCRIPT_QUEUE.shutdown()
+    await KEYPAIR_POOL.shutdown()
+    PKG_EXECUTOR.shutdown()
+    await HTTP_SESSIONS.close()
 
 
 def get_app_no_init() -> FastAPI:
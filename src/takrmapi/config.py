@@ -52,6 +52,8 @@ TAK_CERTS_FOLDER: Path = cfg("TAK_CERTS_FOLDER", cast=Path, default=Path("/opt/t
 RMAPI_PERSISTENT_FOLDER: Path = cfg("RMAPI_PERSISTENT_FOLDER", cast=Path, default=Path("/data/persistent"))
 
 PRODUCT_HTTPS_EPHEMERAL_PORT: int = cfg("PRODUCT_HTTPS_EPHEMERAL_PORT", cast=int, default=4627)
+# Seconds the ephemeral package download links are valid
+TAK_EPHEMERAL_LINK_TTL: float = cfg("TAK_EPHEMERAL_LINK_TTL", cast=float, default=300.0)
 
 # TAK vite asset graphical addons
 VITE_ASSET_SET: str = cfg("VITE_ASSET_SET", cast=str, default="not_used_by_default")
@@ -74,6 +76,60 @@ TAK_MISSIONPKG_ENABLED_PACKAGES: list[Path] = [
     Path("tak-tracker"),
 ]
 
+# Static (non-template) package files up to this size are kept pre-compressed in memory for splicing into archives
+TAK_PKG_SKELETON_MAX_ENTRY_SIZE: int = cfg("TAK_PKG_SKELETON_MAX_ENTRY_SIZE", cast=int, default=8 * 1024 * 1024)
+
+# Generated mission package cache, LRU bounded by total size and entries expire after TTL seconds. 0 size disables.
+TAK_PKG_CACHE_MAX_BYTES: int = cfg("TAK_PKG_CACHE_MAX_BYTES", cast=int, default=64 * 1024 * 1024)
+TAK_PKG_CACHE_TTL: float = cfg("TAK_PKG_CACHE_TTL", cast=float, default=600.0)
+# Archives up to this size are cached and assembled before responding (first download gets ETag and Range),
+# bigger ones are streamed without caching. This is the memory a single package response can hold.
+TAK_PKG_CACHE_MAX_ENTRY_BYTES: int = cfg("TAK_PKG_CACHE_MAX_ENTRY_BYTES", cast=int, default=4 * 1024 * 1024)
+# Cached packages can also be written under RMAPI_PERSISTENT_FOLDER so all the workers can serve them. Off by
+# default because the archives contain the user PKCS12 (password is the callsign)
+TAK_PKG_CACHE_SHARED: bool = cfg("TAK_PKG_CACHE_SHARED", cast=bool, default=False)
+# Batch user provisioning, number of users in each stage at the same time
+TAK_BATCH_KEYGEN_CONCURRENCY: int = cfg("TAK_BATCH_KEYGEN_CONCURRENCY", cast=int, default=4)
+TAK_BATCH_SIGN_CONCURRENCY: int = cfg("TAK_BATCH_SIGN_CONCURRENCY", cast=int, default=8)
+TAK_BATCH_ENABLE_CONCURRENCY: int = cfg("TAK_BATCH_ENABLE_CONCURRENCY", cast=int, default=2)
+
+# Mission packages of new users are built into the cache in background, at most this many users at a time. 0 disables.
+# Needs TAK_PKG_CACHE_SHARED, otherwise only the worker that got the users/created hook would have the packages
+TAK_PKG_PREWARM_CONCURRENCY: int = cfg("TAK_PKG_PREWARM_CONCURRENCY", cast=int, default=1)
+
+# Profile files and bundles uploaded to TAK at the same time during startup sync
+TAK_PROFILE_UPLOAD_CONCURRENCY: int = cfg("TAK_PROFILE_UPLOAD_CONCURRENCY", cast=int, default=4)
+
+# Seconds between template file stat checks of the in-memory template catalog (until the inotify watcher is live)
+TAK_TEMPLATE_CATALOG_RECHECK: float = cfg("TAK_TEMPLATE_CATALOG_RECHECK", cast=float, default=10.0)
+
+# Compiled package templates kept in memory, bytecode is also cached on disk under RMAPI_PERSISTENT_FOLDER
+TAK_TEMPLATE_CACHE_SIZE: int = cfg("TAK_TEMPLATE_CACHE_SIZE", cast=int, default=400)
+TAK_TEMPLATE_BYTECODE_CACHE: bool = cfg("TAK_TEMPLATE_BYTECODE_CACHE", cast=bool, default=True)
+
+# CA chain bundled into the packages as PKCS12, source files are re-checked for changes at this interval
+TAK_CA_FULLCHAIN: Path = cfg("TAK_CA_FULLCHAIN", cast=Path, default=Path("/le_certs/rasenmaeher/fullchain.pem"))
+TAK_CA_BUNDLE_RECHECK: float = cfg("TAK_CA_BUNDLE_RECHECK", cast=float, default=10.0)
+# Number of user PKCS12 files kept in memory, 0 disables the cache
+TAK_USER_P12_CACHE_SIZE: int = cfg("TAK_USER_P12_CACHE_SIZE", cast=int, default=256)
+
+# Blocking package building steps run in dedicated pool, at most MAX_CONCURRENCY of them at the same time.
+# CPU heavy steps (PKCS12) use a process pool when PROCESSES > 0
+TAK_PKG_EXECUTOR_THREADS: int = cfg("TAK_PKG_EXECUTOR_THREADS", cast=int, default=4)
+TAK_PKG_EXECUTOR_PROCESSES: int = cfg("TAK_PKG_EXECUTOR_PROCESSES", cast=int, default=0)
+TAK_PKG_EXECUTOR_MAX_CONCURRENCY: int = cfg("TAK_PKG_EXECUTOR_MAX_CONCURRENCY", cast=int, default=4)
+
+# Package archive compression. Members with these extensions or smaller than MIN_SIZE are stored as is.
+# Compressor is "auto", "zlib", "zlib-ng" or "isal", auto picks the fastest installed one
+TAK_PKG_DEFLATE_LEVEL: int = cfg("TAK_PKG_DEFLATE_LEVEL", cast=int, default=6)
+TAK_PKG_DEFLATE_MIN_SIZE: int = cfg("TAK_PKG_DEFLATE_MIN_SIZE", cast=int, default=128)
+TAK_PKG_STORE_EXTENSIONS: str = cfg(
+    "TAK_PKG_STORE_EXTENSIONS",
+    cast=str,
+    default="png,jpg,jpeg,gif,webp,zip,apk,kmz,gz,xz,bz2,zst,mbtiles,gpkg,sqlite,p12,pfx",
+)
+TAK_PKG_COMPRESSOR: str = cfg("TAK_PKG_COMPRESSOR", cast=str, default="auto")
+
 # TAK datapackage defaults. Default files and zip-folders are defined here and will be added to "Default-ATAK" profile
 TAK_DATAPACKAGE_ADDON_FOLDER: str = cfg("TAK_DATAPACKAGE_ADDON_FOLDER", cast=str, default="default")
 TAK_DATAPACKAGE_TEMPLATES_FOLDER: Path = cfg(
@@ -97,6 +153,37 @@ TAK_DATAPACKAGE_ADDON_FOLDER_ZIP_PACKAGES: list[Path] = [
 
 TAK_MESSAGING_API_HOST: str = cfg("TAK_MESSAGING_API_HOST", cast=str, default="https://127.0.0.1")  # We are in sidecar
 TAK_MESSAGING_API_PORT: int = cfg("TAK_MESSAGING_API_PORT", cast=int, default=8443)
+# Keep-alive connection pool to TAK API (per worker) and per request timeouts in seconds, also used for RASENMAEHER
+TAK_HTTP_POOL_SIZE: int = cfg("TAK_HTTP_POOL_SIZE", cast=int, default=16)
+TAK_HTTP_KEEPALIVE: float = cfg("TAK_HTTP_KEEPALIVE", cast=float, default=30.0)
+TAK_HTTP_TIMEOUT: float = cfg("TAK_HTTP_TIMEOUT", cast=float, default=30.0)
+TAK_HTTP_CONNECT_TIMEOUT: float = cfg("TAK_HTTP_CONNECT_TIMEOUT", cast=float, default=10.0)
+# Seconds between checks whether the mTLS client cert/key files were replaced
+TAK_MTLS_RECHECK: float = cfg("TAK_MTLS_RECHECK", cast=float, default=5.0)
+
+# TAK user management scripts. Calls arriving within COALESCE_WINDOW seconds run in single shell invocation,
+# at most MAX_BATCH cert names each. TIMEOUT is per script run (single cert name)
+TAK_SCRIPTS_FOLDER: Path = cfg("TAK_SCRIPTS_FOLDER", cast=Path, default=Path("/opt/scripts"))
+TAK_SCRIPTS_COALESCE_WINDOW: float = cfg("TAK_SCRIPTS_COALESCE_WINDOW", cast=float, default=0.05)
+TAK_SCRIPTS_MAX_BATCH: int = cfg("TAK_SCRIPTS_MAX_BATCH", cast=int, default=8)
+TAK_SCRIPTS_TIMEOUT: float = cfg("TAK_SCRIPTS_TIMEOUT", cast=float, default=5.0)
+
+# Pre-generated keypairs for new users, refilled up to HIGH when below LOW once no key has been taken for IDLE
+# seconds. HIGH 0 disables the pool
+TAK_KEYPOOL_LOW: int = cfg("TAK_KEYPOOL_LOW", cast=int, default=4)
+TAK_KEYPOOL_HIGH: int = cfg("TAK_KEYPOOL_HIGH", cast=int, default=0)
+TAK_KEYPOOL_IDLE: float = cfg("TAK_KEYPOOL_IDLE", cast=float, default=2.0)
+# Seconds between keypair file checks of the waiters when the inotify watcher is not running
+TAK_KEYPAIR_POLL_INTERVAL: float = cfg("TAK_KEYPAIR_POLL_INTERVAL", cast=float, default=0.5)
+
+# TAK initialisation runs in background, retries use exponential backoff with jitter between BASE and MAX seconds.
+# Routes needing TAK wait at most READY_TIMEOUT seconds for it before answering 503
+TAK_INIT_BACKOFF_BASE: float = cfg("TAK_INIT_BACKOFF_BASE", cast=float, default=0.5)
+TAK_INIT_BACKOFF_MAX: float = cfg("TAK_INIT_BACKOFF_MAX", cast=float, default=15.0)
+TAK_INIT_API_WAIT: float = cfg("TAK_INIT_API_WAIT", cast=float, default=300.0)
+TAK_INIT_READY_TIMEOUT: float = cfg("TAK_INIT_READY_TIMEOUT", cast=float, default=10.0)
+# The worker doing the init hands the results to the other workers over this socket
+TAK_INIT_SOCKET: Path = cfg("TAK_INIT_SOCKET", cast=Path, default=RMAPI_PERSISTENT_FOLDER / "takrmapi_init.sock")
 
 TAKCL_CORECONFIG_PATH: Path = cfg("TAKCL_CORECONFIG_PATH", cast=Path, default=Path("/opt/tak/data/CoreConfig.xml"))
 
@@ -3,6 +3,7 @@
 import asyncio
 import logging
 import json
+import time
 
 import click
 from libadvian.logging import init_logging
@@ -70,6 +71,112 @@ def dump_openapi(ctx: click.Context) -> None:
     ctx.exit(0)
 
 
+@cli_group.command(name="bench-templates")
+@click.option("--variant", default="atak", help="Mission package variant to render the templates from")
+@click.option("--rounds", default=1000, help="Number of renders per template")
+@click.pass_context
+def bench_templates(ctx: click.Context, variant: str, rounds: int) -> None:  # pylint: disable=too-many-locals
+    """
+    Compare per-render compile against the shared template environment
+    """
+    # pylint: disable=import-outside-toplevel
+    from jinja2 import Template
+    from libpvarki.schemas.product import UserCRUDRequest
+    from takrmapi.takutils.tak_helpers import UserCRUD
+    from takrmapi.takutils.tak_pkg_templates import TEMPLATE_ENV
+    from takrmapi.takutils.tak_pkg_vars import TAKDataPackagePathVars, UserTAKTemplateVars
+
+    user = UserCRUD(UserCRUDRequest(uuid="benchmark", callsign="BENCH01a", x509cert=""))
+    pkg_dir = TAKDataPackagePathVars.missionpkg_default_folder / variant
+    for template_file in (pkg_dir / "server.pref.tpl", pkg_dir / "MANIFEST" / "manifest.xml.tpl"):
+        if not template_file.exists():
+            click.echo(f"{template_file} not found, skipping")
+            continue
+        template_vars = UserTAKTemplateVars(user=user, template_file=template_file)
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            Template(template_file.read_text(encoding="utf-8")).render(v=template_vars)
+        compiled_each = (time.perf_counter() - start) / rounds
+
+        TEMPLATE_ENV.render_file(template_file, v=template_vars)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            TEMPLATE_ENV.render_file(template_file, v=template_vars)
+        shared = (time.perf_counter() - start) / rounds
+
+        click.echo(
+            f"{template_file.name}: compile per render {compiled_each * 1e6:.1f}us, "
+            f"shared environment {shared * 1e6:.1f}us ({compiled_each / shared:.1f}x)"
+        )
+    ctx.exit(0)
+
+
+@cli_group.command(name="bench-compression")
+@click.option("--rounds", default=3, help="Number of archive builds per policy")
+@click.pass_context
+def bench_compression(ctx: click.Context, rounds: int) -> None:  # pylint: disable=too-many-locals
+    """
+    Archive the shipped templates tree with each compression policy and backend
+    """
+    # pylint: disable=import-outside-toplevel
+    import dataclasses
+    from takrmapi import config
+    from takrmapi.takutils.tak_pkg_compression import DEFAULT_POLICY, TAKCompressionPolicy, available_compressors
+    from takrmapi.takutils.tak_pkg_zipstream import TAKZipStream
+
+    files = sorted(path for path in config.TEMPLATES_PATH.rglob("*") if path.is_file())
+    total = sum(path.stat().st_size for path in files)
+    click.echo(f"{len(files)} files, {total} bytes under {config.TEMPLATES_PATH}")
+    policies = {
+        "store": TAKCompressionPolicy(level=0),
+        "deflate-1": TAKCompressionPolicy(level=1),
+        "deflate-6": TAKCompressionPolicy(level=6),
+        "deflate-9": TAKCompressionPolicy(level=9),
+        "configured": DEFAULT_POLICY,
+    }
+    for compressor in available_compressors():
+        for policy_name, policy in policies.items():
+            policy = dataclasses.replace(policy, compressor=compressor)
+            size = 0
+            start = time.perf_counter()
+            for _ in range(rounds):
+                zstream = TAKZipStream(filename="bench.zip", policy=policy)
+                for path in files:
+                    zstream.add_file(path.relative_to(config.TEMPLATES_PATH).as_posix(), path)
+                size = len(zstream.read_all())
+            elapsed = (time.perf_counter() - start) / rounds
+            click.echo(f"{compressor.name:8} {policy_name:11} {size:10d} bytes {elapsed * 1000:8.1f}ms")
+    ctx.exit(0)
+
+
+@cli_group.command(name="bench-ephemeral")
+@click.option("--rounds", default=10000, help="Number of tokens to issue and verify")
+@click.pass_context
+def bench_ephemeral(ctx: click.Context, rounds: int) -> None:
+    """
+    Issue and verify ephemeral download tokens
+    """
+    # pylint: disable=import-outside-toplevel
+    import os
+    from takrmapi.takutils.tak_ephemeral_token import issue_token, verify_token
+
+    key = os.urandom(32)
+    start = time.perf_counter()
+    tokens = [
+        issue_token(key, f"NORPPA{idx}a", "12345678-1234-5678-1234-567812345678", "atak") for idx in range(rounds)
+    ]
+    issued = time.perf_counter() - start
+    start = time.perf_counter()
+    for token in tokens:
+        verify_token(key, token)
+    verified = time.perf_counter() - start
+    click.echo(f"token length {len(tokens[0])} chars")
+    click.echo(f"issue  {rounds / issued:10.0f}/s ({issued / rounds * 1e6:.1f}us)")
+    click.echo(f"verify {rounds / verified:10.0f}/s ({verified / rounds * 1e6:.1f}us)")
+    ctx.exit(0)
+
+
 def takrmapi_cli() -> None:
     """rmfpapi"""
     init_logging(logging.WARNING)
@@ -8,6 +8,7 @@ import logging
 from takrmapi import config
 from takrmapi.takutils.tak_helpers import UserCRUD
 from takrmapi.takutils.tak_pkg_vars import TAKDataPackagePathVars
+from takrmapi.takutils.tak_pkg_catalog import TEMPLATE_CATALOG
 
 LOGGER = logging.getLogger(__name__)
 
@@ -45,10 +46,10 @@ class TAKAdminHelper:
     def get_dir_content(self, dirpath: Path) -> Dict[str, Any]:
         """Get dir content"""
         dir_content: Dict[str, Any] = {}
-        for item in dirpath.iterdir():
-            if item.is_dir():
-                dir_content[item.name] = "dir"
+        for name, is_dir in sorted(TEMPLATE_CATALOG.list_dir(dirpath).items()):
+            if is_dir:
+                dir_content[name] = "dir"
             else:
-                dir_content[item.name] = "file"
+                dir_content[name] = "file"
 
         return dir_content
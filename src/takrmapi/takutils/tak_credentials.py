@@ -0,0 +1,150 @@
+"""In-memory store of the user credential files.
+
+PEM files are read and certificates parsed once per file version, the version being the stat identity of the
+file so rewrites by other workers are noticed with a single stat. Copies in TAK_CERTS_FOLDER are written only
+when their content changes, through a temporary file and rename so TAK never sees a half written cert.
+"""
+
+from pathlib import Path
+from typing import Dict, Tuple
+import datetime
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+
+LOGGER = logging.getLogger(__name__)
+FileSignature = Tuple[int, int, int]
+
+
+@dataclass(frozen=True)
+class TAKCredentialFile:
+    """Single version of PEM file"""
+
+    signature: FileSignature
+    pem: bytes
+    digest: str
+
+    @property
+    def text(self) -> str:
+        """PEM as string"""
+        return self.pem.decode("utf-8")
+
+
+@dataclass(frozen=True)
+class TAKCertificate:
+    """Parsed certificate"""
+
+    pem: bytes
+    cert: x509.Certificate
+    fingerprint: str
+    not_after: datetime.datetime
+
+    @property
+    def expired(self) -> bool:
+        """Certificate is past its validity"""
+        return self.not_after <= datetime.datetime.now(datetime.timezone.utc)
+
+
+def file_signature(path: Path) -> FileSignature:
+    """Changes whenever the file is replaced or rewritten, raises FileNotFoundError"""
+    stat = path.stat()
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def parse_certificate(pem: bytes) -> TAKCertificate:
+    """Parse PEM certificate, raises ValueError"""
+    cert = x509.load_pem_x509_certificate(pem)
+    _ = cert.subject, cert.issuer
+    return TAKCertificate(
+        pem=pem,
+        cert=cert,
+        fingerprint=cert.fingerprint(hashes.SHA256()).hex(),
+        not_after=cert.not_valid_after_utc,
+    )
+
+
+class TAKCredentialStore:
+    """Cached reads, parses and idempotent writes of credential files"""
+
+    def __init__(self) -> None:
+        self.reads = 0
+        self.parses = 0
+        self.writes = 0
+        self._files: Dict[Path, TAKCredentialFile] = {}
+        self._certs: Dict[Tuple[Path, FileSignature], TAKCertificate] = {}
+        self._lock = threading.Lock()
+
+    def load(self, path: Path) -> TAKCredentialFile:
+        """Return current content of the file, raises FileNotFoundError"""
+        signature = file_signature(path)
+        with self._lock:
+            cached = self._files.get(path)
+        if cached is not None and cached.signature == signature:
+            return cached
+        pem = path.read_bytes()
+        # Signature from before the read, a concurrent rewrite then only causes one extra read
+        loaded = TAKCredentialFile(signature=signature, pem=pem, digest=hashlib.sha256(pem).hexdigest())
+        with self._lock:
+            self._files[path] = loaded
+            self.reads += 1
+        return loaded
+
+    def certificate(self, path: Path) -> TAKCertificate:
+        """Return the parsed certificate of the file, raises FileNotFoundError or ValueError"""
+        loaded = self.load(path)
+        key = (path, loaded.signature)
+        with self._lock:
+            cached = self._certs.get(key)
+        if cached is not None:
+            return cached
+        parsed = parse_certificate(loaded.pem)
+        with self._lock:
+            for old_key in [old_key for old_key in self._certs if old_key[0] == path]:
+                del self._certs[old_key]
+            self._certs[key] = parsed
+            self.parses += 1
+        return parsed
+
+    def materialize(self, path: Path, content: str) -> bool:
+        """Make the file have the content, returns True if it had to be written"""
+        pem = content.encode("utf-8")
+        try:
+            if self.load(path).digest == hashlib.sha256(pem).hexdigest():
+                return False
+        except FileNotFoundError:
+            pass
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fdesc, tmpname = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fdesc, "wb") as tmpfile:
+                tmpfile.write(pem)
+            os.chmod(tmpname, 0o644)
+            os.replace(tmpname, path)
+        except BaseException:
+            Path(tmpname).unlink(missing_ok=True)
+            raise
+        with self._lock:
+            self.writes += 1
+        LOGGER.debug("Wrote {}".format(path))
+        return True
+
+    def forget(self, path: Path) -> None:
+        """Drop cached versions of the file"""
+        with self._lock:
+            self._files.pop(path, None)
+            for key in [key for key in self._certs if key[0] == path]:
+                del self._certs[key]
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Store counters"""
+        return {"files": len(self._files), "reads": self.reads, "parses": self.parses, "writes": self.writes}
+
+
+CREDENTIALS = TAKCredentialStore()
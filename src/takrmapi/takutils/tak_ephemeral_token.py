@@ -0,0 +1,105 @@
+"""Compact ephemeral download tokens.
+
+Token layout before URL-safe base64 (no padding):
+
+    version (1) | key id (1) | issue time (4, big endian unix seconds) | nonce (12) | AES-GCM ciphertext + tag
+
+The header is authenticated as associated data, so the issue time can be checked before decrypting and can not be
+tampered with. The payload is callsign, user uuid and variant separated by NUL.
+"""
+
+from typing import Optional
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import struct
+import time
+from dataclasses import dataclass
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from takrmapi import config
+
+LOGGER = logging.getLogger(__name__)
+
+TOKEN_VERSION = 1
+HEADER = struct.Struct(">BBI")
+NONCE_SIZE = 12
+TAG_SIZE = 16
+# Tolerated clock difference between workers for issue times in the future
+MAX_CLOCK_SKEW = 60
+
+
+@dataclass(frozen=True)
+class TAKEphemeralPayload:
+    """Content of the ephemeral token"""
+
+    callsign: str
+    user_uuid: str
+    variant: str
+    issued: int
+
+
+def key_id(key: bytes) -> int:
+    """Short identifier of the key, mismatching tokens are rejected without decrypt attempt"""
+    return hashlib.sha256(key).digest()[0]
+
+
+def _b64encode(data: bytes) -> str:
+    """URL-safe base64 without padding"""
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(token: str) -> bytes:
+    """Reverse of _b64encode"""
+    return base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+
+
+def issue_token(key: bytes, callsign: str, user_uuid: str, variant: str, issued: Optional[int] = None) -> str:
+    """Return token for downloading variant package of the user"""
+    fields = (callsign, user_uuid, variant)
+    if any("\0" in value for value in fields):
+        raise ValueError("Token fields can not contain NUL")
+    if issued is None:
+        issued = int(time.time())
+    header = HEADER.pack(TOKEN_VERSION, key_id(key), issued)
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = AESGCM(key).encrypt(nonce, "\0".join(fields).encode("utf-8"), header)
+    return _b64encode(header + nonce + ciphertext)
+
+
+def verify_token(
+    key: bytes, token: str, ttl: Optional[float] = None, now: Optional[float] = None
+) -> TAKEphemeralPayload:
+    """Check token and return the payload, raises ValueError for malformed, expired or forged tokens"""
+    try:
+        raw = _b64decode(token)
+    except (binascii.Error, ValueError) as exc:
+        raise ValueError("Token is not valid base64") from exc
+    if len(raw) < HEADER.size + NONCE_SIZE + TAG_SIZE:
+        raise ValueError("Token is too short")
+    version, token_key_id, issued = HEADER.unpack_from(raw)
+    if version != TOKEN_VERSION:
+        raise ValueError("Unsupported token version {}".format(version))
+    if token_key_id != key_id(key):
+        raise ValueError("Token was issued with another key")
+    if ttl is None:
+        ttl = config.TAK_EPHEMERAL_LINK_TTL
+    if now is None:
+        now = time.time()
+    if issued + ttl < now or issued > now + MAX_CLOCK_SKEW:
+        raise ValueError("Token has expired")
+
+    nonce = raw[HEADER.size : HEADER.size + NONCE_SIZE]
+    try:
+        plaintext = AESGCM(key).decrypt(nonce, raw[HEADER.size + NONCE_SIZE :], raw[: HEADER.size])
+    except InvalidTag as exc:
+        raise ValueError("Token authentication failed") from exc
+    fields = plaintext.decode("utf-8").split("\0")
+    if len(fields) != 3:
+        raise ValueError("Malformed token payload")
+    callsign, user_uuid, variant = fields
+    return TAKEphemeralPayload(callsign=callsign, user_uuid=user_uuid, variant=variant, issued=issued)
@@ -6,18 +6,18 @@ import asyncio
 import shutil
 import logging
 from pathlib import Path
-import ssl
-
-import aiohttp
-from OpenSSL import crypto  # FIXME: Move to python-cryptography for cert parsing
 
 from libpvarki.schemas.product import UserCRUDRequest
-from libpvarki.mtlshelp.session import get_session as libsession
 from libpvarki.mtlshelp.csr import async_create_keypair, async_create_client_csr
-from libpvarki.shell import call_cmd
 
 
 from takrmapi import config
+from takrmapi.takutils.tak_credentials import CREDENTIALS
+from takrmapi.takutils.tak_http_pool import request_timeout, rm_mtls_session
+from takrmapi.takutils.tak_keypair_pool import KEYPAIR_POOL
+from takrmapi.takutils.tak_keypair_ready import KEYPAIR_READY
+from takrmapi.takutils.tak_pkg_executor import PKG_EXECUTOR
+from takrmapi.takutils.tak_scripts import run_tak_script
 
 
 LOGGER = logging.getLogger(__name__)
@@ -62,28 +62,25 @@ class UserCRUD:
 
     async def wait_for_keypair(self) -> None:
         """Wait for keypair to be available"""
-        while not self.certpath.exists() or not self.keypath.exists():
-            LOGGER.debug("Waiting for {} / {}".format(self.certpath, self.keypath))
-            LOGGER.debug("userdata contents: {}".format(list(self.userdata.rglob("*"))))
-            await asyncio.sleep(0.5)
+        await KEYPAIR_READY.wait(self.userdata, (self.certpath, self.keypath))
 
     @property
     def certpem(self) -> str:
         """Local TAK-specific cert contents as PEM (or RASENMAEHER cert if local is not available)"""
-        LOGGER.debug("Checking if {} exists: {}".format(self.certpath, self.certpath.exists()))
-        if self.certpath.exists():
-            return self.certpath.read_text(encoding="utf-8")
-        LOGGER.debug("userdata contents: {}".format(list(self.userdata.rglob("*"))))
-        raise ValueError("Local cert {} not found".format(self.certpath))
+        try:
+            return CREDENTIALS.load(self.certpath).text
+        except FileNotFoundError:
+            LOGGER.debug("userdata contents: {}".format(list(self.userdata.rglob("*"))))
+            raise ValueError("Local cert {} not found".format(self.certpath)) from None
 
     @property
     def certkey(self) -> str:
         """Cert private key contents as PEM"""
-        LOGGER.debug("Checking if {} exists: {}".format(self.keypath, self.keypath.exists()))
-        if self.keypath.exists():
-            return self.keypath.read_text(encoding="utf-8")
-        LOGGER.debug("userdata contents: {}".format(list(self.userdata.rglob("*"))))
-        raise ValueError("Private key {} not found".format(self.keypath))
+        try:
+            return CREDENTIALS.load(self.keypath).text
+        except FileNotFoundError:
+            LOGGER.debug("userdata contents: {}".format(list(self.userdata.rglob("*"))))
+            raise ValueError("Private key {} not found".format(self.keypath)) from None
 
     @property
     def rm_base(self) -> str:
@@ -93,53 +90,64 @@ class UserCRUD:
 
     async def create_user_dir_and_files(self) -> None:
         """create the userdata path and make a new tak specific cert/keypair"""
+        csrpem = await self.create_keypair_and_csr()
+        await self.sign_csr(csrpem)
+
+    async def create_keypair_and_csr(self) -> str:
+        """create the userdata path, tak specific keypair and CSR for it, return the CSR PEM"""
         self.userdata.mkdir(parents=True, exist_ok=True)
         certcn = self.certcn
         privpath = self.userdata / f"{certcn}.key"
         pubpath = self.userdata / f"{certcn}.pub"
         csrpath = self.userdata / f"{certcn}.csr"
-        certpath = self.userdata / f"{certcn}.pem"
 
         LOGGER.info("Creating TAK specific keypair: {} -> {} ".format(certcn, privpath))
-        ckp = await async_create_keypair(privpath, pubpath)
+        ckp = await KEYPAIR_POOL.take(privpath, pubpath)
+        if ckp is None:
+            ckp = await async_create_keypair(privpath, pubpath)
         LOGGER.debug("async_create_keypair awaited {} exists: {}".format(privpath, privpath.exists()))
         csrpem = await async_create_client_csr(ckp, csrpath, {"CN": self.certcn})
         LOGGER.debug(
             "async_create_keypairasync_create_client_csr awaited {} exists: {}".format(csrpath, csrpath.exists())
         )
+        return csrpem
 
-        async with await self.helpers.tak_mtls_client() as session:
+    async def sign_csr(self, csrpem: str) -> None:
+        """Have RASENMAEHER sign the CSR and write the cert"""
+        async with rm_mtls_session() as session:
             url = f"{self.rm_base}api/v1/product/sign_csr/mtls"
             LOGGER.debug("POSTing to {}".format(url))
-            resp = await session.post(url, json={"csr": csrpem})
-            resp.raise_for_status()
-            payload = await resp.json()
-            certpath.write_text(payload["certificate"], encoding="utf-8")
-            LOGGER.info("signed cert written to {}".format(certpath))
+            async with session.post(url, json={"csr": csrpem}, timeout=request_timeout()) as resp:
+                resp.raise_for_status()
+                payload = await resp.json()
+            # Atomic replace, waiters in other workers are woken by inotify and must never see a partial PEM
+            await PKG_EXECUTOR.run(CREDENTIALS.materialize, self.certpath, payload["certificate"])
+            KEYPAIR_READY.notify(self.userdata)
+            LOGGER.info("signed cert written to {}".format(self.certpath))
 
     async def add_new_user(self) -> bool:
-        """Add new user to TAK with given certificate"""
+        """Add new user to TAK with given certificate, return True if TAK enabled the user"""
         await self.create_user_dir_and_files()
         await self.helpers.user_cert_write()
         if await self.helpers.user_cert_validate():
-            await self.helpers.add_user_to_tak_with_cert()
-            return True
+            return await self.helpers.add_user_to_tak_with_cert()
         return False
 
     async def revoke_user(self) -> bool:
         """Remove user from TAK"""
         if await self.helpers.user_cert_validate():
-            async with await self.helpers.tak_mtls_client() as session:
+            async with rm_mtls_session() as session:
                 url = f"{self.rm_base}api/v1/product/revoke/mtls"
                 LOGGER.debug("POSTing cert to {}".format(url))
-                resp = await session.post(url, json={"cert": self.certpem})
-                LOGGER.debug("Got response: {}".format(resp))
-                resp.raise_for_status()
-                payload = await resp.json()
+                async with session.post(url, json={"cert": self.certpem}, timeout=request_timeout()) as resp:
+                    LOGGER.debug("Got response: {}".format(resp))
+                    resp.raise_for_status()
+                    payload = await resp.json()
                 LOGGER.debug("Got payload: {}".format(payload))
             await self.helpers.delete_user_with_cert()
             if (config.TAK_CERTS_FOLDER / f"{self.user.callsign}.pem").is_file():
                 os.remove(config.TAK_CERTS_FOLDER / f"{self.user.callsign}.pem")
+            CREDENTIALS.forget(config.TAK_CERTS_FOLDER / f"{self.user.callsign}.pem")
             return True
         return False
 
@@ -192,23 +200,6 @@ class Helpers:
             shutil.rmtree(dirname)
             LOGGER.debug("Temp directory cleanup done.")
 
-    async def tak_mtls_client(self) -> aiohttp.ClientSession:
-        """Return session to connect TAK"""
-        priv_key = config.RMAPI_PERSISTENT_FOLDER / "private" / "mtlsclient.key"
-        pub_key = config.RMAPI_PERSISTENT_FOLDER / "public" / "mtlsclient.pem"
-        return libsession((pub_key, priv_key))
-
-    async def tak_mtls_client_sslcontext(self) -> ssl.SSLContext:
-        """Return sslcontext to connect TAK"""
-        sslcontext = ssl.create_default_context()
-        sslcontext.check_hostname = False
-        sslcontext.verify_mode = ssl.CERT_NONE
-        sslcontext.load_cert_chain(
-            config.RMAPI_PERSISTENT_FOLDER / "public" / "mtlsclient.pem",
-            config.RMAPI_PERSISTENT_FOLDER / "private" / "mtlsclient.key",
-        )
-        return sslcontext
-
     def tak_base_url(self) -> str:
         """Construct the base url"""
         return f"{config.TAK_MESSAGING_API_HOST}:{config.TAK_MESSAGING_API_PORT}"
@@ -219,12 +210,12 @@ class Helpers:
         return cert_file.exists()
 
     async def user_cert_write(self) -> None:
-        """Write users public cert to TAK certs folder"""
+        """Write users public cert to TAK certs folder, unchanged files are not rewritten"""
         await asyncio.wait_for(self.user.wait_for_keypair(), timeout=KEYPAIR_TIMEOUT)
         cert_file_name = config.TAK_CERTS_FOLDER / f"{self.user.callsign}.pem"
-        cert_file_name.write_text(self.user.certpem + "\n", encoding="utf-8")
+        CREDENTIALS.materialize(cert_file_name, self.user.certpem + "\n")
         cert_file_name2 = config.TAK_CERTS_FOLDER / f"{self.user.callsign}_rm.pem"
-        cert_file_name2.write_text(self.user.rm_certpem + "\n", encoding="utf-8")
+        CREDENTIALS.materialize(cert_file_name2, self.user.rm_certpem + "\n")
 
     async def user_cert_validate(self) -> bool:
         """Check that the given certificate can at least be opened"""
@@ -232,12 +223,7 @@ class Helpers:
             if self.user.callsign != "mtlsclient":
                 await self.user_cert_write()
             cert_file_name = config.TAK_CERTS_FOLDER / f"{self.user.callsign}.pem"
-            with open(cert_file_name, "rb") as cert_file:
-                cert_content = cert_file.read()
-
-            cert = crypto.load_certificate(crypto.FILETYPE_PEM, cert_content)
-            _ = cert.get_subject()
-            _ = cert.get_issuer()
+            _ = CREDENTIALS.certificate(cert_file_name)
             return True
         except Exception as err:  # pylint: disable=broad-except
             LOGGER.warning("User '{}' certificate check failed ::: {}".format(self.user.callsign, err))
@@ -257,31 +243,7 @@ class Helpers:
         if not await self.user_cert_validate():
             LOGGER.error("User {} TAK certs not valid".format(self.user.callsign))
             return False
-        tasks = []
-        for certname in self.enable_user_cert_names:
-            tasks.append(
-                asyncio.shield(
-                    call_cmd(
-                        f"USER_CERT_NAME={certname} /opt/scripts/enable_user.sh",
-                        timeout=SHELL_TIMEOUT,
-                        stderr_warn=False,
-                    )
-                )
-            )
-        try:
-            results = await asyncio.gather(*tasks)
-            for code, _stdout, _stderr in results:
-                if code != 0:
-                    return False
-        except asyncio.TimeoutError:
-            LOGGER.error("Shell command timed out")
-            return False
-        except asyncio.CancelledError:
-            LOGGER.info("Cancellation shielded, just wait")
-        except Exception as err:  # pylint: disable=W0718
-            LOGGER.exception(err)
-            return False
-        return True
+        return await run_tak_script("enable_user.sh", "USER_CERT_NAME", self.enable_user_cert_names)
 
     async def add_admin_to_tak_with_cert(self) -> bool:
         """Add admin user to TAK using shell"""
@@ -292,33 +254,8 @@ class Helpers:
         if not await self.user_cert_validate():
             LOGGER.error("User {} TAK certs not valid".format(self.user.callsign))
             return False
-        tasks = []
-        for certname in self.enable_user_cert_names:
-            if certname == "mtlsclient_rm":
-                continue
-            tasks.append(
-                asyncio.shield(
-                    call_cmd(
-                        f"ADMIN_CERT_NAME={certname} /opt/scripts/enable_admin.sh",
-                        timeout=SHELL_TIMEOUT,
-                        stderr_warn=False,
-                    )
-                )
-            )
-        try:
-            results = await asyncio.gather(*tasks)
-            for code, _stdout, _stderr in results:
-                if code != 0:
-                    return False
-        except asyncio.TimeoutError:
-            LOGGER.error("Shell command timed out")
-            return False
-        except asyncio.CancelledError:
-            LOGGER.info("Cancellation shielded, just wait")
-        except Exception as err:  # pylint: disable=W0718
-            LOGGER.exception(err)
-            return False
-        return True
+        certnames = [certname for certname in self.enable_user_cert_names if certname != "mtlsclient_rm"]
+        return await run_tak_script("enable_admin.sh", "ADMIN_CERT_NAME", certnames)
 
     async def delete_user_with_cert(self) -> bool:
         """Remove user from TAK using shell"""
@@ -329,28 +266,4 @@ class Helpers:
         if not await self.user_cert_validate():
             LOGGER.error("User {} TAK certs not valid".format(self.user.callsign))
             return False
-        tasks = []
-        for certname in self.enable_user_cert_names:
-            tasks.append(
-                asyncio.shield(
-                    call_cmd(
-                        f"USER_CERT_NAME={certname} /opt/scripts/delete_user.sh",
-                        timeout=SHELL_TIMEOUT,
-                        stderr_warn=False,
-                    )
-                )
-            )
-        try:
-            results = await asyncio.gather(*tasks)
-            for code, _stdout, _stderr in results:
-                if code != 0:
-                    return False
-        except asyncio.TimeoutError:
-            LOGGER.error("Shell command timed out")
-            return False
-        except asyncio.CancelledError:
-            LOGGER.info("Cancellation shielded, just wait")
-        except Exception as err:  # pylint: disable=W0718
-            LOGGER.exception(err)
-            return False
-        return True
+        return await run_tak_script("delete_user.sh", "USER_CERT_NAME", self.enable_user_cert_names)
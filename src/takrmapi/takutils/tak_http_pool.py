@@ -0,0 +1,212 @@
+"""Long-lived mTLS sessions for the TAK REST API and RASENMAEHER.
+
+A new ClientSession per call means a new connector and a full TCP+TLS handshake for every request, the sessions
+here keep a keep-alive connection pool per worker. They are opened in app_lifespan and closed on shutdown,
+outside the app (console, tests) they are created on first use.
+"""
+
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+import asyncio
+import logging
+import ssl
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+from libpvarki.mtlshelp.context import get_ca_context
+
+from takrmapi import config
+
+LOGGER = logging.getLogger(__name__)
+MTLSSignature = Tuple[Tuple[int, int, int, int], ...]
+
+
+def mtls_client_paths() -> Tuple[Path, Path]:
+    """Return (cert, key) paths of the mTLS client identity of this service"""
+    return (
+        config.RMAPI_PERSISTENT_FOLDER / "public" / "mtlsclient.pem",
+        config.RMAPI_PERSISTENT_FOLDER / "private" / "mtlsclient.key",
+    )
+
+
+def mtls_client_signature() -> MTLSSignature:
+    """Identity of the mTLS client files, changes when either file is replaced or rewritten"""
+    signature = []
+    for path in mtls_client_paths():
+        stat = path.stat()
+        signature.append((stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def _create_tak_sslcontext() -> ssl.SSLContext:
+    """Client context for TAK, the server is on localhost with self-signed cert so it's not verified"""
+    sslcontext = ssl.create_default_context()
+    sslcontext.check_hostname = False
+    sslcontext.verify_mode = ssl.CERT_NONE
+    sslcontext.load_cert_chain(*mtls_client_paths())
+    return sslcontext
+
+
+class TAKClientSSLContext:
+    """SSLContext of the mTLS client identity, rebuilt only when the cert or key file changes"""
+
+    def __init__(self, recheck_interval: float) -> None:
+        self.recheck_interval = recheck_interval
+        self.loads = 0
+        self._context: Optional[ssl.SSLContext] = None
+        self._signature: MTLSSignature = ()
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def signature(self) -> MTLSSignature:
+        """Signature of the files the current context was loaded from, re-checked at most every recheck_interval"""
+        self.get()
+        return self._signature
+
+    def get(self) -> ssl.SSLContext:
+        """Return current context"""
+        with self._lock:
+            now = time.monotonic()
+            if self._context is not None and now - self._checked < self.recheck_interval:
+                return self._context
+            signature = mtls_client_signature()
+            self._checked = now
+            if self._context is None or signature != self._signature:
+                if self._context is not None:
+                    LOGGER.info("mTLS client cert or key changed, reloading")
+                self._context = _create_tak_sslcontext()
+                self._signature = signature
+                self.loads += 1
+            return self._context
+
+    def reset(self) -> None:
+        """Force reload on next use"""
+        with self._lock:
+            self._context = None
+            self._signature = ()
+
+
+TAK_SSLCONTEXT = TAKClientSSLContext(recheck_interval=config.TAK_MTLS_RECHECK)
+
+
+def tak_client_sslcontext() -> ssl.SSLContext:
+    """Cached client context for TAK"""
+    return TAK_SSLCONTEXT.get()
+
+
+def request_timeout() -> aiohttp.ClientTimeout:
+    """Per request timeouts"""
+    return aiohttp.ClientTimeout(total=config.TAK_HTTP_TIMEOUT, sock_connect=config.TAK_HTTP_CONNECT_TIMEOUT)
+
+
+class TAKSessionPool:
+    """Shared sessions, bound to the event loop they were created in and to the mTLS client files"""
+
+    def __init__(self) -> None:
+        self._sessions: Dict[str, Tuple[asyncio.AbstractEventLoop, MTLSSignature, aiohttp.ClientSession]] = {}
+        self._retiring: Set["asyncio.Task[None]"] = set()
+
+    @staticmethod
+    def _create_session(sslcontext: ssl.SSLContext) -> aiohttp.ClientSession:
+        """Session with the configured keep-alive pool"""
+        connector = aiohttp.TCPConnector(
+            ssl=sslcontext,
+            limit=config.TAK_HTTP_POOL_SIZE,
+            keepalive_timeout=config.TAK_HTTP_KEEPALIVE,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=request_timeout())
+
+    def _create_tak(self) -> aiohttp.ClientSession:
+        """Session for the TAK Marti REST API"""
+        return self._create_session(tak_client_sslcontext())
+
+    def _create_rm(self) -> aiohttp.ClientSession:
+        """Session for RASENMAEHER, same CA trust as libpvarki get_session"""
+        sslcontext = get_ca_context(ssl.Purpose.SERVER_AUTH)
+        sslcontext.load_cert_chain(*mtls_client_paths())
+        return self._create_session(sslcontext)
+
+    def _retire(self, session: aiohttp.ClientSession) -> None:
+        """Close replaced session once the requests still using it have had time to finish"""
+
+        async def close_later() -> None:
+            """Wait for the request timeout and close"""
+            try:
+                await asyncio.sleep(config.TAK_HTTP_TIMEOUT)
+            finally:
+                await session.close()
+
+        task = asyncio.create_task(close_later())
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    def _get(self, name: str) -> aiohttp.ClientSession:
+        """Return open session, (re-)create if needed"""
+        loop = asyncio.get_running_loop()
+        signature = TAK_SSLCONTEXT.signature
+        current = self._sessions.get(name)
+        if current is not None:
+            session_loop, session_signature, session = current
+            if session_loop is loop and session_signature == signature and not session.closed:
+                return session
+            if session_loop is not loop:
+                LOGGER.warning("Session '{}' belongs to another event loop, creating new one".format(name))
+            elif not session.closed:
+                LOGGER.info("mTLS client identity changed, replacing session '{}'".format(name))
+                self._retire(session)
+        session = self._create_tak() if name == "tak" else self._create_rm()
+        self._sessions[name] = (loop, signature, session)
+        return session
+
+    def tak(self) -> aiohttp.ClientSession:
+        """Shared session for TAK"""
+        return self._get("tak")
+
+    def rm(self) -> aiohttp.ClientSession:  # pylint: disable=invalid-name
+        """Shared session for RASENMAEHER"""
+        return self._get("rm")
+
+    async def open(self) -> None:
+        """Create the sessions up front, if the client identity is not there yet they are created on first use"""
+        try:
+            self.tak()
+            self.rm()
+        except (OSError, ssl.SSLError) as exc:
+            LOGGER.warning("Could not open mTLS sessions yet: {}".format(exc))
+
+    async def reset(self, name: Optional[str] = None) -> None:
+        """Close named (or all) sessions, they are re-created on next use"""
+        loop = asyncio.get_running_loop()
+        names = [name] if name else list(self._sessions)
+        for session_name in names:
+            current = self._sessions.pop(session_name, None)
+            if current is None:
+                continue
+            session_loop, _, session = current
+            if session_loop is loop:
+                await session.close()
+
+    async def close(self) -> None:
+        """Close all sessions"""
+        await self.reset()
+        for task in list(self._retiring):
+            task.cancel()
+        await asyncio.gather(*self._retiring, return_exceptions=True)
+
+
+HTTP_SESSIONS = TAKSessionPool()
+
+
+@asynccontextmanager
+async def tak_mtls_session() -> AsyncIterator[aiohttp.ClientSession]:
+    """Shared keep-alive session to TAK, the session is not closed on exit"""
+    yield HTTP_SESSIONS.tak()
+
+
+@asynccontextmanager
+async def rm_mtls_session() -> AsyncIterator[aiohttp.ClientSession]:
+    """Shared keep-alive session to RASENMAEHER, the session is not closed on exit"""
+    yield HTTP_SESSIONS.rm()
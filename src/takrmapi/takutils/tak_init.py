@@ -1,11 +1,13 @@
 """Init TAK management connection capability"""
 
-from typing import List
+from typing import Any, Dict, Iterator, List, Mapping, Tuple
 import asyncio
 import logging
+import random
 import shutil
 import secrets
 import string
+import time
 
 from libpvarki.schemas.product import UserCRUDRequest
 from takrmapi import config
@@ -22,6 +24,30 @@ LOGGER = logging.getLogger(__name__)
 # CHECK FOR mtlsclient cert in tak cert folder /opt/tak/cert/files
 
 
+def backoff_delays(base: float, maximum: float) -> Iterator[float]:
+    """Exponential backoff with full jitter, endless"""
+    attempt = 0
+    while True:
+        yield random.uniform(0, min(maximum, base * 2**attempt))  # nosec
+        attempt += 1
+
+
+async def wait_for_tak_api(t_rest_helper: RestHelpers) -> bool:
+    """Poll the TAK API with backoff until it responds or TAK_INIT_API_WAIT seconds have passed"""
+    deadline = time.monotonic() + config.TAK_INIT_API_WAIT
+    for delay in backoff_delays(config.TAK_INIT_BACKOFF_BASE, config.TAK_INIT_BACKOFF_MAX):
+        data = await t_rest_helper.tak_api_user_list()
+        if data["success"]:
+            LOGGER.info("TAK API responding, moving on...")
+            return True
+        if time.monotonic() + delay > deadline:
+            LOGGER.warning("TAK API not responding after {}s, moving on anyway".format(config.TAK_INIT_API_WAIT))
+            return False
+        LOGGER.info("TAK API not ready yet. Retrying in {:.1f}s".format(delay))
+        await asyncio.sleep(delay)
+    return False
+
+
 async def setup_tak_mgmt_conn() -> None:
     """Setup required credentials to manage TAK"""
     # FIXME: Refactor to separate helpers not requiring a dummy user
@@ -31,16 +57,7 @@ async def setup_tak_mgmt_conn() -> None:
     t_rest_helper = RestHelpers(user)
 
     # Wait for the TAK API to start responding
-    for _ in range(60):
-        data = await t_rest_helper.tak_api_user_list()
-
-        if not data["success"]:
-            LOGGER.info("TAK API not ready yet. Waiting...")
-            LOGGER.info(data)
-            await asyncio.sleep(5)  # nosec
-        else:
-            LOGGER.info("TAK API responding, moving on...")
-            break
+    await wait_for_tak_api(t_rest_helper)
 
     # Move mtlsclient.pem in place if not there already
     if not await t_helpers.user_cert_exists():
@@ -131,12 +148,10 @@ async def tak_setup_default_profiles(t_rest_helper: RestHelpers) -> None:
         )
 
 
-async def tak_setup_profile_files(t_rest_helper: RestHelpers, tak_missionpkg: TAKPackageZip) -> None:
-    """Upload default tak profile files and bundles to TAK"""
-    # Get current 'Default-ATAK' profile files
-    profile_files = await t_rest_helper.tak_api_get_device_profile_files(profile_name="Default-ATAK")
-
-    # Check dst default profile files before uploading
+async def tak_missing_profile_files(
+    t_rest_helper: RestHelpers, profile_files: Mapping[str, Any]
+) -> Tuple[List[TAKDataPackage], List[TAKDataPackage]]:
+    """Return (single files, bundles) not yet in the given profile file list"""
     local_profile_files: List[TAKDataPackage] = []
     for profile_file in config.TAK_DATAPACKAGE_ADDON_FOLDER_FILES:
         p_file: TAKDataPackage = TAKDataPackage(template_path=profile_file, template_type="environment")
@@ -145,42 +160,73 @@ async def tak_setup_profile_files(t_rest_helper: RestHelpers, tak_missionpkg: TA
             continue
         local_profile_files.append(p_file)
 
-    # Upload default files to profile
-    for pf in local_profile_files:
-        if pf.is_template_file:
-            await tak_missionpkg.render_tak_manifest_template(pf)
-
-        await t_rest_helper.tak_api_upload_file_to_profile(
-            profile_name="Default-ATAK",
-            datapackage=pf,
-        )
-
     # Check for already uploaded bundles
     tmp_bundles: List[TAKDataPackage] = []
     if TAKViteAsset.is_vite_enabled():
         tmp_bundles.extend(TAKViteAsset.get_vite_packages())
     if TAKDynPkgHelper.dynpackages_available:
         tmp_bundles.extend(TAKDynPkgHelper.get_dyn_packages())
+    for bundle in config.TAK_DATAPACKAGE_ADDON_FOLDER_ZIP_PACKAGES:
+        tmp_bundles.append(TAKDataPackage(template_path=bundle, template_type="environment"))
 
     upload_bundles: List[TAKDataPackage] = []
     for b in tmp_bundles:
         if await t_rest_helper.check_file_in_profile_files(datapackage=b, tak_profile_files=profile_files):
             continue
         upload_bundles.append(b)
+    return local_profile_files, upload_bundles
 
-    for bundle in config.TAK_DATAPACKAGE_ADDON_FOLDER_ZIP_PACKAGES:
-        b_package: TAKDataPackage = TAKDataPackage(template_path=bundle, template_type="environment")
-        if await t_rest_helper.check_file_in_profile_files(datapackage=b_package, tak_profile_files=profile_files):
-            continue
-        upload_bundles.append(b_package)
-
-    # Create zip bundles and upload to profile from those missing in dst
-    if len(upload_bundles) > 0:
-        await tak_missionpkg.create_zip_bundles(datapackages=upload_bundles)
-        for dp in upload_bundles:
 
-            await t_rest_helper.tak_api_upload_file_to_profile(profile_name="Default-ATAK", datapackage=dp)
-            await tak_missionpkg.helpers.remove_tmp_dir(dp.zip_tmp_folder)
+async def tak_setup_profile_files(t_rest_helper: RestHelpers, tak_missionpkg: TAKPackageZip) -> None:
+    """Upload default tak profile files and bundles missing from TAK, building and uploading them concurrently"""
+    start = time.monotonic()
+    # Get current 'Default-ATAK' profile files once, the uploads are checked against this list
+    profile_files = await t_rest_helper.tak_api_get_device_profile_files(profile_name="Default-ATAK")
+    local_profile_files, upload_bundles = await tak_missing_profile_files(t_rest_helper, profile_files)
+    tak_missionpkg.check_bundle_sources(upload_bundles)
+
+    upload_limit = asyncio.Semaphore(max(config.TAK_PROFILE_UPLOAD_CONCURRENCY, 1))
+
+    async def upload(datapackage: TAKDataPackage, bundle: bool) -> None:
+        """Build the file or bundle and upload it when there is room"""
+        begin = time.monotonic()
+        try:
+            if bundle:
+                await tak_missionpkg.create_zip_bundle(datapackage)
+            elif datapackage.is_template_file:
+                await tak_missionpkg.render_tak_manifest_template(datapackage)
+            built = time.monotonic()
+            async with upload_limit:
+                queued = time.monotonic()
+                result = await t_rest_helper.tak_api_upload_file_to_profile(
+                    profile_name="Default-ATAK", datapackage=datapackage, profile_files=profile_files
+                )
+            if not result["success"]:
+                LOGGER.error("Uploading '{}' to Default-ATAK profile failed".format(datapackage.package_name))
+            LOGGER.info(
+                "Profile file '{}' built in {:.2f}s, waited {:.2f}s, uploaded in {:.2f}s".format(
+                    datapackage.package_name, built - begin, queued - built, time.monotonic() - queued
+                )
+            )
+        finally:
+            if datapackage.zip_complete:
+                await tak_missionpkg.helpers.remove_tmp_dir(datapackage.zip_tmp_folder)
+
+    results = await asyncio.gather(
+        *[upload(pf, bundle=False) for pf in local_profile_files],
+        *[upload(dp, bundle=True) for dp in upload_bundles],
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for error in errors:
+        LOGGER.error("Profile file upload failed: {!r}".format(error))
+    LOGGER.info(
+        "Uploaded {} profile files and {} bundles in {:.2f}s".format(
+            len(local_profile_files), len(upload_bundles), time.monotonic() - start
+        )
+    )
+    if errors:
+        raise errors[0]
 
 
 async def get_tak_defaults() -> None:
@@ -188,8 +234,19 @@ async def get_tak_defaults() -> None:
 
     LOGGER.debug("Getting TAK defaults")
     # Read the tak server networkMeshKey to memory.
+    delays = backoff_delays(config.TAK_INIT_BACKOFF_BASE, config.TAK_INIT_BACKOFF_MAX)
     while not config.TAK_SERVER_NETWORKMESH_KEY_FILE.exists():
         LOGGER.debug("Waiting for TAK_SERVER_NETWORKMESH_KEY_FILE to be populated")
-        await asyncio.sleep(2)
+        await asyncio.sleep(next(delays))
 
     config.TAK_SERVER_NETWORKMESH_KEY_STR = config.TAK_SERVER_NETWORKMESH_KEY_FILE.read_text(encoding="utf-8")
+
+
+def shared_state() -> Dict[str, str]:
+    """State loaded by the init leader that the other workers need"""
+    return {"networkmesh_key": config.TAK_SERVER_NETWORKMESH_KEY_STR}
+
+
+def apply_shared_state(state: Dict[str, str]) -> None:
+    """Take state from the init leader into use"""
+    config.TAK_SERVER_NETWORKMESH_KEY_STR = state["networkmesh_key"]
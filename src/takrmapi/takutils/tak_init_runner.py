@@ -0,0 +1,219 @@
+"""TAK initialisation as a background task.
+
+The app starts serving right away, routes that need TAK wait for the readiness event (see api.readiness).
+Initialisation goes through the phases below, failing phases are retried with exponential backoff and jitter.
+
+Of the gunicorn workers the one holding the init lock is the leader and runs the phases. It keeps the lock for its
+lifetime and serves the shared state (mesh key) over a Unix socket. The followers connect to the socket and
+get the state the moment the leader is ready. If the leader dies the lock frees up and a follower takes over.
+"""
+
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, cast
+import asyncio
+import json
+import logging
+import os
+import time
+
+import filelock
+
+from takrmapi import config
+from takrmapi.takutils import tak_init
+
+LOGGER = logging.getLogger(__name__)
+
+PHASE_PENDING = "pending"
+PHASE_LOCK = "lock"
+PHASE_FOLLOW = "follow"
+PHASE_MGMT_CONN = "mgmt-conn"
+PHASE_DEFAULTS = "defaults"
+PHASE_LOAD = "load-defaults"
+PHASE_READY = "ready"
+
+
+class TAKInitRunner:  # pylint: disable=too-many-instance-attributes
+    """Runs the TAK initialisation phases and tracks their progress"""
+
+    def __init__(self, lockpath: Path, socketpath: Path, backoff_base: float, backoff_max: float) -> None:
+        self.lockpath = lockpath
+        self.socketpath = socketpath
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.phase = PHASE_PENDING
+        self.retries = 0
+        self.error: Optional[str] = None
+        self.phase_times: Dict[str, float] = {}
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.leader = False
+        self._ready: Optional[asyncio.Event] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers: Set["asyncio.Task[Any]"] = set()
+        self._lock = filelock.FileLock(lockpath)
+
+    @property
+    def started(self) -> bool:
+        """Initialisation has been started, outside the app (console, tests) it never is"""
+        return self._task is not None
+
+    @property
+    def ready(self) -> bool:
+        """Initialisation has completed"""
+        return self.phase == PHASE_READY
+
+    def start(self) -> "asyncio.Task[None]":
+        """Start the initialisation in the background"""
+        if self._task is None or self._task.done():
+            self._ready = asyncio.Event()
+            self.phase = PHASE_PENDING
+            self._task = asyncio.create_task(self._run(), name="tak-init")
+            self._task.add_done_callback(self._done)
+        return self._task
+
+    def _done(self, task: "asyncio.Task[None]") -> None:
+        """Record initialisation that died outside the retried phases"""
+        if not task.cancelled() and task.exception() is not None:
+            self.error = "{}: {!r}".format(self.phase, task.exception())
+            LOGGER.error("TAK init failed in phase '{}': {!r}".format(self.phase, task.exception()))
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the initialisation, True when complete or never started"""
+        if self._ready is None or self._ready.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _phase(self, phase: str, func: Callable[[], Awaitable[Any]]) -> None:
+        """Run single phase until it succeeds"""
+        self.phase = phase
+        start = time.monotonic()
+        delays = tak_init.backoff_delays(self.backoff_base, self.backoff_max)
+        while True:
+            try:
+                await func()
+                break
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                delay = next(delays)
+                self.retries += 1
+                self.error = "{}: {!r}".format(phase, exc)
+                LOGGER.exception("TAK init phase '{}' failed, retrying in {:.1f}s".format(phase, delay))
+                await asyncio.sleep(delay)
+        self.phase_times[phase] = time.monotonic() - start
+        LOGGER.info("TAK init phase '{}' done in {:.2f}s".format(phase, self.phase_times[phase]))
+
+    async def _run(self) -> None:
+        """Become the leader and initialise, or follow the leader"""
+        self.phase = PHASE_LOCK
+        delays = tak_init.backoff_delays(self.backoff_base, self.backoff_max)
+        while True:
+            try:
+                self._lock.acquire(timeout=0.0)
+            except filelock.Timeout:
+                self.phase = PHASE_FOLLOW
+                state = await self._follow()
+                if state is not None:
+                    tak_init.apply_shared_state(state)
+                    break
+                # Leader not listening yet or gone, try again and take over if the lock is free
+                await asyncio.sleep(next(delays))
+                continue
+            self.leader = True
+            LOGGER.info("Acquired {}, this worker initialises TAK".format(self.lockpath))
+            try:
+                await self._serve()
+            except OSError as exc:
+                # Initialise anyway so this worker gets ready, the followers wait until this worker is gone
+                self.error = "serve: {!r}".format(exc)
+                LOGGER.error(
+                    "Could not serve init state at {}, other workers can not get it: {}".format(self.socketpath, exc)
+                )
+            await self._phase(PHASE_MGMT_CONN, tak_init.setup_tak_mgmt_conn)
+            await self._phase(PHASE_DEFAULTS, tak_init.setup_tak_defaults)
+            await self._phase(PHASE_LOAD, tak_init.get_tak_defaults)
+            break
+
+        self.phase = PHASE_READY
+        self.error = None
+        if self._ready is not None:
+            self._ready.set()
+        LOGGER.info("TAK init complete ({})".format(self.stats))
+
+    async def _serve(self) -> None:
+        """Leader, accept followers right away and send them the shared state once ready"""
+
+        async def handle(_reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            """Single follower"""
+            handler = cast("asyncio.Task[Any]", asyncio.current_task())
+            self._handlers.add(handler)
+            try:
+                await self.wait_ready()
+                writer.write(json.dumps(tak_init.shared_state()).encode("utf-8") + b"\n")
+                await writer.drain()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+            finally:
+                writer.close()
+                self._handlers.discard(handler)
+
+        # Holding the lock, so anything at the path is left over from a dead leader
+        self.socketpath.parent.mkdir(parents=True, exist_ok=True)
+        self.socketpath.unlink(missing_ok=True)
+        self._server = await asyncio.start_unix_server(handle, path=str(self.socketpath))
+        os.chmod(self.socketpath, 0o600)
+
+    async def _follow(self) -> Optional[Dict[str, str]]:
+        """Wait for the leader to send the shared state, None if the leader can not be reached"""
+        try:
+            reader, writer = await asyncio.open_unix_connection(str(self.socketpath))
+        except (FileNotFoundError, ConnectionError) as exc:
+            LOGGER.debug("Init leader not reachable at {}: {}".format(self.socketpath, exc))
+            return None
+        try:
+            line = await reader.readline()
+        except ConnectionError:
+            line = b""
+        finally:
+            writer.close()
+        if not line:
+            LOGGER.warning("Init leader went away before completing, retrying")
+            return None
+        return cast(Dict[str, str], json.loads(line))
+
+    async def shutdown(self) -> None:
+        """Cancel unfinished initialisation, stop serving followers and give up leadership"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._server is not None:
+            self._server.close()
+            # Followers still waiting for the state
+            for handler in list(self._handlers):
+                handler.cancel()
+            await self._server.wait_closed()
+            self._server = None
+            self.socketpath.unlink(missing_ok=True)
+        # Only the leader holds the lock
+        if self.leader:
+            self._lock.release()
+            self.leader = False
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Progress of the initialisation"""
+        return {
+            "phase": self.phase,
+            "retries": self.retries,
+            "error": self.error,
+            "phase_times": dict(self.phase_times),
+        }
+
+
+TAK_INIT = TAKInitRunner(
+    lockpath=config.TAK_CERTS_FOLDER / "takrmapi_init.lock",
+    socketpath=config.TAK_INIT_SOCKET,
+    backoff_base=config.TAK_INIT_BACKOFF_BASE,
+    backoff_max=config.TAK_INIT_BACKOFF_MAX,
+)
@@ -0,0 +1,172 @@
+"""Pool of pre-generated keypairs for the TAK user certificates.
+
+Key generation is the slowest step of /users/created. When the pool is enabled keypairs are generated in the
+background into RMAPI_PERSISTENT_FOLDER/private/keypool and new users take one from there. The pool is refilled
+up to the high watermark once it drops below the low watermark, and only while no keys are being taken.
+Claiming a key is a rename so workers sharing the folder never hand out the same key twice. The file operations
+run in the packaging executor.
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+import time
+import uuid
+import weakref
+
+from cryptography.hazmat.primitives.asymmetric.types import PrivateKeyTypes
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from libpvarki.mtlshelp.csr import async_create_keypair
+
+from takrmapi import config
+from takrmapi.takutils.tak_pkg_executor import PKG_EXECUTOR
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TAKKeypairPool:  # pylint: disable=too-many-instance-attributes
+    """Keypairs on disk, filled in the background between low and high watermark"""
+
+    def __init__(self, folder: Path, low: int, high: int, idle: float) -> None:
+        self.folder = folder
+        self.low = low
+        self.high = high
+        self.idle = idle
+        self.generated = 0
+        self.taken = 0
+        self.misses = 0
+        self._last_take = 0.0
+        self._refills: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task[None]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """High watermark 0 disables the pool"""
+        return self.high > 0
+
+    def _available(self) -> List[Path]:
+        """Private keys that are ready to be taken, oldest first"""
+        if not self.folder.is_dir():
+            return []
+        return sorted(self.folder.glob("*.key"), key=lambda path: path.name)
+
+    @property
+    def size(self) -> int:
+        """Number of keypairs in the pool"""
+        return len(self._available())
+
+    async def take(self, privpath: Path, pubpath: Path) -> Optional[PrivateKeyTypes]:
+        """Move pooled keypair to the given paths and return the private key, None if the pool is empty"""
+        if not self.enabled:
+            return None
+        self._last_take = time.monotonic()
+        key: Optional[PrivateKeyTypes] = None
+        try:
+            key = await PKG_EXECUTOR.run(self._claim, privpath, pubpath)
+        except (OSError, ValueError) as err:
+            LOGGER.warning("Taking pooled keypair failed: {}".format(err))
+        if key is not None:
+            self.taken += 1
+        else:
+            self.misses += 1
+        LOGGER.debug("Keypair pool take {}".format("hit" if key else "miss"))
+        self.start()
+        return key
+
+    def _claim(self, privpath: Path, pubpath: Path) -> Optional[PrivateKeyTypes]:
+        """Move the oldest pooled keypair to the given paths and load the key, None if pool is empty. Blocking IO."""
+        for pooled in self._available():
+            try:
+                os.rename(pooled, privpath)
+            except FileNotFoundError:
+                # Another worker got it first
+                continue
+            try:
+                os.rename(pooled.with_suffix(".pub"), pubpath)
+            except FileNotFoundError:
+                # Key without public half, not usable
+                LOGGER.warning("Pooled keypair {} has no public key, dropping it".format(pooled.stem))
+                privpath.unlink(missing_ok=True)
+                continue
+            except OSError:
+                # Put the key back so the pair is not left half claimed
+                os.rename(privpath, pooled)
+                raise
+            return load_pem_private_key(privpath.read_bytes(), password=None)
+        return None
+
+    def start(self) -> None:
+        """Start refill in the background if the pool is below the low watermark"""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        refill = self._refills.get(loop)
+        if refill is not None and not refill.done():
+            return
+        self._refills[loop] = asyncio.create_task(self._refill(), name="tak-keypair-pool")
+
+    def _prepare(self) -> int:
+        """Create the pool folder, return the pool size. Blocking IO."""
+        self.folder.mkdir(mode=0o700, parents=True, exist_ok=True)
+        os.chmod(self.folder, 0o700)
+        return self.size
+
+    async def _refill(self) -> None:
+        """Refill up to the high watermark when below the low one, waiting for the takes to quiet down between keys"""
+        if await PKG_EXECUTOR.run(self._prepare) >= max(self.low, 1):
+            return
+        while await PKG_EXECUTOR.run(lambda: self.size) < self.high:
+            busy_for = self.idle - (time.monotonic() - self._last_take)
+            if busy_for > 0:
+                await asyncio.sleep(busy_for)
+                continue
+            try:
+                await self._generate()
+            except Exception:  # pylint: disable=broad-exception-caught
+                LOGGER.exception("Generating pooled keypair failed")
+                return
+        LOGGER.debug("Keypair pool refilled, {} keypairs generated so far".format(self.generated))
+
+    async def _generate(self) -> None:
+        """Generate single keypair, the .key file appears last and only when both files are complete"""
+        name = uuid.uuid4().hex
+        tmp_priv = self.folder / f".{name}.key.tmp"
+        tmp_pub = self.folder / f".{name}.pub.tmp"
+        try:
+            await async_create_keypair(tmp_priv, tmp_pub)
+            os.chmod(tmp_priv, 0o600)
+            os.chmod(tmp_pub, 0o600)
+            os.rename(tmp_pub, self.folder / f"{name}.pub")
+            os.rename(tmp_priv, self.folder / f"{name}.key")
+        finally:
+            for path in (tmp_priv, tmp_pub):
+                path.unlink(missing_ok=True)
+        self.generated += 1
+
+    async def shutdown(self) -> None:
+        """Stop refilling in the running loop"""
+        refill = self._refills.pop(asyncio.get_running_loop(), None)
+        if refill is not None:
+            refill.cancel()
+            await asyncio.gather(refill, return_exceptions=True)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Pool counters"""
+        return {
+            "size": self.size,
+            "generated": self.generated,
+            "taken": self.taken,
+            "misses": self.misses,
+        }
+
+
+KEYPAIR_POOL = TAKKeypairPool(
+    folder=config.RMAPI_PERSISTENT_FOLDER / "private" / "keypool",
+    low=config.TAK_KEYPOOL_LOW,
+    high=config.TAK_KEYPOOL_HIGH,
+    idle=config.TAK_KEYPOOL_IDLE,
+)
@@ -0,0 +1,80 @@
+"""Readiness of the per-user TAK keypairs.
+
+Waiters register per user folder and are woken when the keypair is written in this process (notify) or, with
+the inotify watcher (watchfiles), when another worker writes it. While the watcher is not running the waiters
+re-check the files every poll_interval.
+"""
+
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+import asyncio
+import logging
+
+import watchfiles
+
+from takrmapi import config
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TAKKeypairReadiness:
+    """Per user folder wake ups for keypair waiters"""
+
+    def __init__(self, root: Path, poll_interval: float) -> None:
+        self.root = root
+        self.poll_interval = poll_interval
+        self.watching = False
+        self._waiters: Dict[Path, List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    def notify(self, userdata: Path) -> None:
+        """Wake up everyone waiting on files in the user folder"""
+        for loop, event in self._waiters.get(userdata, []):
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, userdata: Path, paths: Sequence[Path]) -> None:
+        """Return once all the paths exist"""
+        if all(path.exists() for path in paths):
+            return
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        self._waiters.setdefault(userdata, []).append(waiter)
+        try:
+            while True:
+                waiter[1].clear()
+                # Checked after registering so a write right before registering is not missed
+                if all(path.exists() for path in paths):
+                    return
+                LOGGER.debug("Waiting for {}".format(", ".join(str(path) for path in paths)))
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), timeout=None if self.watching else self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            waiters = self._waiters[userdata]
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[userdata]
+
+    async def watch(self) -> None:
+        """Wake up waiters on writes by other workers using inotify, runs until cancelled"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        try:
+            # The first yield (changes or timeout) means inotify is armed, until then the waiters keep polling
+            async for changes in watchfiles.awatch(self.root, yield_on_timeout=True, rust_timeout=1000):
+                if not self.watching:
+                    self.watching = True
+                    # Waiters that started polling before the watcher was up re-check once
+                    for userdata in list(self._waiters):
+                        self.notify(userdata)
+                for userdata in {Path(changed_path).parent for _change, changed_path in changes}:
+                    self.notify(userdata)
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.warning("Keypair watcher stopped ({}), falling back to polling".format(err))
+        finally:
+            self.watching = False
+            for userdata in list(self._waiters):
+                self.notify(userdata)
+
+
+KEYPAIR_READY = TAKKeypairReadiness(
+    root=config.RMAPI_PERSISTENT_FOLDER / "users", poll_interval=config.TAK_KEYPAIR_POLL_INTERVAL
+)
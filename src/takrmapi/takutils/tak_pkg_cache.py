@@ -0,0 +1,289 @@
+"""Content addressed cache for generated TAK packages.
+
+Users re-download the same package several times in short succession (QR re-scans, client retries), cached
+builds are served without rendering templates or creating PKCS12 files again.
+
+With shared_folder set the archives are also written under it so that every worker sharing the folder can serve
+them, the in-memory LRU is the first level in front of it. The archives contain the PKCS12 of the user (password is
+the callsign), so the shared folder is opt-in. The files are only readable by the service and they are deleted when
+the user is revoked or updated, builds that were started before that are not stored.
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, astuple
+from functools import cached_property
+
+from takrmapi import config
+
+LOGGER = logging.getLogger(__name__)
+
+
+def content_etag(data: bytes) -> str:
+    """Strong HTTP entity tag for the content"""
+    return '"{}"'.format(hashlib.sha256(data).hexdigest()[:32])
+
+
+@dataclass(frozen=True)
+class TAKPackageCacheKey:
+    """Everything that affects the content of generated package"""
+
+    user_uuid: str
+    callsign: str
+    package: str
+    tree_version: str
+    cert_fingerprint: str
+    mesh_key_hash: str
+
+    @property
+    def digest(self) -> str:
+        """Content address of the package"""
+        return hashlib.sha256("\0".join(astuple(self)).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class TAKCachedPackage:
+    """Cached package archive"""
+
+    filename: str
+    data: bytes
+    user_uuid: str = ""
+    callsign: str = ""
+    created: float = field(default_factory=time.monotonic)
+
+    @property
+    def size(self) -> int:
+        """Size of the archive"""
+        return len(self.data)
+
+    @cached_property
+    def etag(self) -> str:
+        """Entity tag of the archive, computed on first use"""
+        return content_etag(self.data)
+
+
+class TAKPackageCache:  # pylint: disable=too-many-instance-attributes
+    """Size bounded LRU with TTL, safe to use from the threadpool that streams the responses"""
+
+    def __init__(
+        self, max_bytes: int, ttl: float, shared_folder: Optional[Path] = None, max_entry_bytes: Optional[int] = None
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_bytes, max_entry_bytes) if max_entry_bytes is not None else max_bytes
+        self.ttl = ttl
+        self.shared_folder = shared_folder
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+        self._size = 0
+        self._entries: "OrderedDict[str, TAKCachedPackage]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._invalidated: Dict[str, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """Cache can be disabled by setting the size to 0"""
+        return self.max_bytes > 0
+
+    @property
+    def size(self) -> int:
+        """Total size of cached archives"""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, digest: str) -> None:
+        """Remove entry, lock must be held"""
+        entry = self._entries.pop(digest)
+        self._size -= entry.size
+
+    def get(self, key: TAKPackageCacheKey) -> Optional[TAKCachedPackage]:
+        """Return cached package or None"""
+        if not self.enabled:
+            return None
+        digest = key.digest
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and time.monotonic() - entry.created > self.ttl:
+                self._drop(digest)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+        LOGGER.debug("Package cache hit for {} ({})".format(key.package, self.stats))
+        return entry
+
+    def load(self, key: TAKPackageCacheKey) -> Optional[TAKCachedPackage]:
+        """Return package from the shared folder or None, found packages are kept in memory too. Blocking IO."""
+        folder = self._shared_path(key.user_uuid, key.digest)
+        if not self.enabled or folder is None:
+            return None
+        try:
+            paths = list(folder.iterdir())
+            if not paths:
+                return None
+            age = time.time() - paths[0].stat().st_mtime
+            if age > self.ttl:
+                shutil.rmtree(folder, ignore_errors=True)
+                return None
+            data = paths[0].read_bytes()
+        except FileNotFoundError:
+            return None
+        package = TAKCachedPackage(
+            filename=paths[0].name,
+            data=data,
+            user_uuid=key.user_uuid,
+            callsign=key.callsign,
+            created=time.monotonic() - age,
+        )
+        self._put_memory(key.digest, package)
+        with self._lock:
+            self.shared_hits += 1
+        LOGGER.debug("Shared package cache hit for {} ({})".format(key.package, self.stats))
+        return package
+
+    def put(self, key: TAKPackageCacheKey, package: TAKCachedPackage) -> None:
+        """Store package, stale builds of the same package for the same user and callsign are dropped.
+
+        Package.created should be the build start, builds started before the user was invalidated are not stored.
+        Blocking IO when shared_folder is set.
+        """
+        if not self.enabled or package.size > self.max_entry_bytes:
+            return
+        with self._lock:
+            if package.created < self._invalidated.get(package.user_uuid, float("-inf")):
+                LOGGER.debug("Not caching {}, the user was invalidated during the build".format(package.filename))
+                return
+        self._put_memory(key.digest, package)
+        if self.shared_folder is not None:
+            try:
+                self._put_shared(key.digest, package)
+            except OSError as err:
+                LOGGER.warning("Could not write {} to shared package cache: {}".format(package.filename, err))
+
+    def _put_memory(self, digest: str, package: TAKCachedPackage) -> None:
+        """Store package in the in-memory LRU"""
+        with self._lock:
+            stale = [
+                old_digest
+                for old_digest, entry in self._entries.items()
+                if old_digest != digest
+                and (entry.user_uuid, entry.callsign, entry.filename)
+                == (package.user_uuid, package.callsign, package.filename)
+            ]
+            for old_digest in stale:
+                self._drop(old_digest)
+            if digest in self._entries:
+                self._drop(digest)
+            self._entries[digest] = package
+            self._size += package.size
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _shared_path(self, *parts: str) -> Optional[Path]:
+        """Path under the shared folder, None if sharing is disabled or the parts are not plain names"""
+        if self.shared_folder is None or any(part in ("", ".", "..") or Path(part).name != part for part in parts):
+            return None
+        return self.shared_folder.joinpath(*parts)
+
+    def _put_shared(self, digest: str, package: TAKCachedPackage) -> None:
+        """Write package to the shared folder, replacing older builds of the same package for the user"""
+        folder = self._shared_path(package.user_uuid, digest)
+        if folder is None or self._shared_path(package.filename) is None:
+            return
+        userfolder = folder.parent
+        # Folders 0700 and files 0600 (mkstemp), the archives have the user key
+        userfolder.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        userfolder.mkdir(mode=0o700, exist_ok=True)
+        fdesc, tmpname = tempfile.mkstemp(dir=userfolder, prefix=f".{digest}.", suffix=".tmp")
+        try:
+            with os.fdopen(fdesc, "wb") as tmpfile:
+                tmpfile.write(package.data)
+            folder.mkdir(mode=0o700, exist_ok=True)
+            os.replace(tmpname, folder / package.filename)
+        except BaseException:
+            Path(tmpname).unlink(missing_ok=True)
+            raise
+        for other in userfolder.iterdir():
+            if other.name != digest and (other / package.filename).exists():
+                shutil.rmtree(other, ignore_errors=True)
+        self._sweep_shared()
+
+    def _sweep_shared(self) -> None:
+        """Drop expired and least recently written packages over max_bytes from the shared folder, once per TTL"""
+        now = time.monotonic()
+        if self.shared_folder is None or now - self._last_sweep < self.ttl:
+            return
+        self._last_sweep = now
+        packages: List[Tuple[float, int, Path]] = []
+        for path in self.shared_folder.glob("*/*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            packages.append((stat.st_mtime, stat.st_size, path.parent))
+        total = sum(size for _, size, _ in packages)
+        expires = time.time() - self.ttl
+        for mtime, size, folder in sorted(packages):
+            if mtime >= expires and total <= self.max_bytes:
+                break
+            shutil.rmtree(folder, ignore_errors=True)
+            total -= size
+
+    def invalidate_user(self, user_uuid: str) -> int:
+        """Drop all packages built for the user including the shared folder ones, return number of dropped entries.
+
+        Blocking IO when shared_folder is set.
+        """
+        with self._lock:
+            self._invalidated[user_uuid] = time.monotonic()
+            digests = [digest for digest, entry in self._entries.items() if entry.user_uuid == user_uuid]
+            for digest in digests:
+                self._drop(digest)
+        userfolder = self._shared_path(user_uuid)
+        if userfolder is not None:
+            shutil.rmtree(userfolder, ignore_errors=True)
+        if digests:
+            LOGGER.info("Dropped {} cached packages of user {}".format(len(digests), user_uuid))
+        return len(digests)
+
+    def clear(self) -> None:
+        """Drop everything held in memory"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Cache counters"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._size,
+        }
+
+
+PACKAGE_CACHE = TAKPackageCache(
+    max_bytes=config.TAK_PKG_CACHE_MAX_BYTES,
+    ttl=config.TAK_PKG_CACHE_TTL,
+    max_entry_bytes=config.TAK_PKG_CACHE_MAX_ENTRY_BYTES,
+    shared_folder=config.RMAPI_PERSISTENT_FOLDER / "private" / "package_cache" if config.TAK_PKG_CACHE_SHARED else None,
+)
@@ -0,0 +1,342 @@
+"""In-memory index of the TAK package template trees.
+
+The template folders are walked once, lookups for package paths and the merged default+addon file lists are
+served from memory. The index keeps the mtime and size of every file, until the inotify watcher (watchfiles) is
+live the stats are rechecked at most once per recheck_interval and the changed parts are refreshed incrementally.
+On the event loop the recheck runs in the executor and lookups are served from the current index meanwhile.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path, PurePosixPath
+
+import watchfiles
+
+from takrmapi import config
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TAKTemplateTree:
+    """Index of single template root folder, paths are relative posix strings ("" is the root)"""
+
+    def __init__(self, root: Path) -> None:
+        self.root: Path = root
+        self.entries: Dict[str, bool] = {}
+        self.dir_mtimes: Dict[str, int] = {}
+        self.file_stats: Dict[str, Tuple[int, int]] = {}
+        self.generation: int = 0
+        self._files_cache: Dict[str, Dict[str, Path]] = {}
+
+    def relative(self, path: Path) -> Optional[str]:
+        """Return index key for path, None if path is not under this root"""
+        try:
+            rel = path.relative_to(self.root)
+        except ValueError:
+            return None
+        return "" if rel == Path(".") else rel.as_posix()
+
+    def _scan_dir(self, rel: str) -> None:
+        """Walk the directory and add everything under it"""
+        top = self.root / rel
+        for dirpath, dirnames, filenames in os.walk(top):
+            dir_rel = self.relative(Path(dirpath))
+            if dir_rel is None:
+                continue
+            self.entries[dir_rel] = True
+            self.dir_mtimes[dir_rel] = Path(dirpath).stat().st_mtime_ns
+            prefix = f"{dir_rel}/" if dir_rel else ""
+            for name in filenames:
+                self._add_file(f"{prefix}{name}")
+            for name in dirnames:
+                self.entries[f"{prefix}{name}"] = True
+
+    def _add_file(self, rel: str) -> None:
+        """Add file to index with its stat"""
+        try:
+            stat = (self.root / rel).stat()
+        except FileNotFoundError:
+            return
+        self.entries[rel] = False
+        self.file_stats[rel] = (stat.st_mtime_ns, stat.st_size)
+
+    def _drop_subtree(self, rel: str) -> None:
+        """Remove directory and everything under it from index"""
+        prefix = f"{rel}/" if rel else ""
+        for key in [key for key in self.entries if key == rel or key.startswith(prefix)]:
+            del self.entries[key]
+            self.dir_mtimes.pop(key, None)
+            self.file_stats.pop(key, None)
+
+    def _rescan(self, rel: str) -> None:
+        """Rescan subtree"""
+        self._drop_subtree(rel)
+        if (self.root / rel).is_dir():
+            self._scan_dir(rel)
+        elif (self.root / rel).exists():
+            self._add_file(rel)
+        self._files_cache.clear()
+        self.generation += 1
+
+    def scan(self) -> None:
+        """Full scan"""
+        self.entries.clear()
+        self.dir_mtimes.clear()
+        self.file_stats.clear()
+        self._rescan("")
+        LOGGER.debug("Indexed {} template paths under {}".format(len(self.entries), self.root))
+
+    def changed_dirs(self, dir_mtimes: Dict[str, int], file_stats: Dict[str, Tuple[int, int]]) -> List[str]:
+        """Return the directories whose mtime or file stats differ from the given snapshot of the index
+
+        Only stats the filesystem and does not touch the index, so it can run in a thread.
+        """
+        changed: List[str] = []
+        for rel, mtime in dir_mtimes.items():
+            try:
+                if (self.root / rel).stat().st_mtime_ns != mtime:
+                    changed.append(rel)
+            except FileNotFoundError:
+                changed.append(rel)
+        # In-place edits of file contents do not touch the directory mtime
+        for rel, file_stat in file_stats.items():
+            try:
+                stat = (self.root / rel).stat()
+            except FileNotFoundError:
+                stat = None
+            if stat is None or (stat.st_mtime_ns, stat.st_size) != file_stat:
+                changed.append(PurePosixPath(rel).parent.as_posix() if "/" in rel else "")
+        if not dir_mtimes and self.root.is_dir():
+            changed.append("")
+        return changed
+
+    def apply_changes(self, changed: List[str]) -> bool:
+        """Rescan the changed directories, return True if something changed"""
+        # Rescan only the topmost changed directories, their subtrees are handled by the same walk
+        rescanned: List[str] = []
+        for rel in sorted(changed, key=lambda rel: rel.count("/") if rel else -1):
+            if any(done == "" or rel == done or rel.startswith(f"{done}/") for done in rescanned):
+                continue
+            LOGGER.info("Template folder {} changed, refreshing index".format(self.root / rel))
+            self._rescan(rel)
+            rescanned.append(rel)
+        return bool(changed)
+
+    def refresh(self) -> bool:
+        """Rescan the directories whose mtime or file stats have changed, return True if something changed"""
+        return self.apply_changes(self.changed_dirs(dict(self.dir_mtimes), dict(self.file_stats)))
+
+    def refresh_path(self, path: Path) -> None:
+        """Refresh index for changed path (from inotify)"""
+        rel = self.relative(path)
+        if rel is None:
+            return
+        # Rescan the nearest indexed parent folder
+        parent = PurePosixPath(rel).parent.as_posix() if rel else ""
+        while parent not in ("", ".") and parent not in self.dir_mtimes:
+            parent = PurePosixPath(parent).parent.as_posix()
+        self._rescan("" if parent == "." else parent)
+
+    def lookup(self, rel: str) -> Optional[bool]:
+        """Return True for directory, False for file and None if not found"""
+        return self.entries.get(rel)
+
+    def file_stat(self, rel: str) -> Optional[Tuple[int, int]]:
+        """Return indexed (mtime_ns, size) of file, None if not found"""
+        return self.file_stats.get(rel)
+
+    def list_dir(self, rel: str) -> Dict[str, bool]:
+        """Return immediate children of directory as name -> is_dir"""
+        prefix = f"{rel}/" if rel else ""
+        return {
+            key[len(prefix) :]: is_dir
+            for key, is_dir in self.entries.items()
+            if key.startswith(prefix) and key != rel and "/" not in key[len(prefix) :]
+        }
+
+    def files_under(self, rel: str) -> Dict[str, Path]:
+        """Return all files under directory as relative path -> full path"""
+        if rel not in self._files_cache:
+            prefix = f"{rel}/" if rel else ""
+            self._files_cache[rel] = {
+                key[len(prefix) :]: self.root / key
+                for key, is_dir in sorted(self.entries.items())
+                if not is_dir and key.startswith(prefix)
+            }
+        return self._files_cache[rel]
+
+
+class TAKTemplateCatalog:
+    """Lookups against the indexed template trees, paths outside them fall back to filesystem"""
+
+    def __init__(self, roots: List[Path], recheck_interval: float) -> None:
+        self.trees: List[TAKTemplateTree] = [TAKTemplateTree(root) for root in roots]
+        self.recheck_interval = recheck_interval
+        self.watching = False
+        self.recheck_task: Optional["asyncio.Task[None]"] = None
+        self._scanned = False
+        self._last_check = 0.0
+        self._merged_cache: Dict[Tuple[Path, Optional[Path]], Tuple[Tuple[int, ...], Dict[str, Path]]] = {}
+
+    def scan(self) -> None:
+        """Index all template trees"""
+        for tree in self.trees:
+            tree.scan()
+        self._scanned = True
+        self._last_check = time.monotonic()
+
+    def _ensure_current(self) -> None:
+        """Scan on first use and recheck the stats at most once per recheck_interval when the watcher is not live"""
+        if not self._scanned:
+            self.scan()
+            return
+        if self.watching:
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.recheck_interval:
+            return
+        self._last_check = now
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Not on the event loop (executor thread or startup), nothing to block
+            for tree in self.trees:
+                tree.refresh()
+            return
+        # Statting every template file would block the loop, serve the current index and recheck in a thread
+        if self.recheck_task is None or self.recheck_task.done():
+            self.recheck_task = asyncio.create_task(self.recheck(), name="tak-template-recheck")
+
+    async def recheck(self) -> None:
+        """Stat the indexed paths in the executor and rescan the changed directories"""
+        loop = asyncio.get_running_loop()
+        for tree in self.trees:
+            changed = await loop.run_in_executor(None, tree.changed_dirs, dict(tree.dir_mtimes), dict(tree.file_stats))
+            tree.apply_changes(changed)
+
+    def _locate(self, path: Path) -> Optional[Tuple[TAKTemplateTree, str]]:
+        """Find the tree path belongs to"""
+        self._ensure_current()
+        for tree in self.trees:
+            rel = tree.relative(path)
+            if rel is not None:
+                return tree, rel
+        return None
+
+    def lookup(self, path: Path) -> Optional[bool]:
+        """Return True for directory, False for file and None if path is not found"""
+        located = self._locate(path)
+        if located is None:
+            if not path.exists():
+                return None
+            return path.is_dir()
+        tree, rel = located
+        return tree.lookup(rel)
+
+    def exists(self, path: Path) -> bool:
+        """Check if path exists"""
+        return self.lookup(path) is not None
+
+    def is_dir(self, path: Path) -> bool:
+        """Check if path is directory"""
+        return self.lookup(path) is True
+
+    def file_stat(self, path: Path) -> Optional[Tuple[int, int]]:
+        """Return (mtime_ns, size) of file, None if path is not found"""
+        located = self._locate(path)
+        if located is None:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                return None
+            return stat.st_mtime_ns, stat.st_size
+        tree, rel = located
+        return tree.file_stat(rel)
+
+    def list_dir(self, path: Path) -> Dict[str, bool]:
+        """Return directory content as name -> is_dir"""
+        located = self._locate(path)
+        if located is None:
+            return {item.name: item.is_dir() for item in path.iterdir()}
+        tree, rel = located
+        return tree.list_dir(rel)
+
+    def files_under(self, path: Path) -> Dict[str, Path]:
+        """Return all files under directory as relative path -> full path"""
+        located = self._locate(path)
+        if located is None:
+            return {
+                (Path(root) / name).relative_to(path).as_posix(): Path(root) / name
+                for root, _, files in os.walk(path)
+                for name in files
+            }
+        tree, rel = located
+        return tree.files_under(rel)
+
+    @property
+    def generation(self) -> Tuple[int, ...]:
+        """Changes whenever any of the template trees is reindexed"""
+        self._ensure_current()
+        return tuple(tree.generation for tree in self.trees)
+
+    def package_files(self, default_path: Path, extra_path: Optional[Path]) -> Dict[str, Path]:
+        """Return merged default+extra package file list, files from extra override the defaults"""
+        generations = self.generation
+        cache_key = (default_path, extra_path)
+        cached = self._merged_cache.get(cache_key)
+        if cached and cached[0] == generations:
+            return cached[1]
+
+        pkg_files: Dict[str, Path] = {}
+        if self.is_dir(default_path):
+            pkg_files.update(self.files_under(default_path))
+        if extra_path is not None and self.is_dir(extra_path):
+            LOGGER.debug("Extra content found for data package from path {}".format(extra_path))
+            for f_pkg_str, f_src_path in self.files_under(extra_path).items():
+                if f_pkg_str in pkg_files:
+                    LOGGER.debug("Package file {} overridden with {}".format(f_pkg_str, f_src_path))
+                pkg_files[f_pkg_str] = f_src_path
+
+        self._merged_cache[cache_key] = (generations, pkg_files)
+        return pkg_files
+
+    def refresh_path(self, path: Path) -> None:
+        """Refresh index for changed path"""
+        for tree in self.trees:
+            if tree.relative(path) is not None:
+                tree.refresh_path(path)
+
+    async def watch(self) -> None:
+        """Keep the index up to date using inotify, runs until cancelled"""
+        roots = [str(tree.root) for tree in self.trees if tree.root.is_dir()]
+        if not roots:
+            return
+        self._ensure_current()
+        try:
+            # The first yield (changes or timeout) means inotify is armed, anything changed before that is
+            # caught by one more stat check
+            async for changes in watchfiles.awatch(
+                *roots, yield_on_timeout=True, rust_timeout=max(int(self.recheck_interval * 1000), 1000)
+            ):
+                if not self.watching:
+                    self.watching = True
+                    await self.recheck()
+                for _change, changed_path in changes:
+                    self.refresh_path(Path(changed_path))
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.warning("Template watcher stopped ({}), falling back to stat checks".format(err))
+        finally:
+            self.watching = False
+
+
+TEMPLATE_CATALOG = TAKTemplateCatalog(
+    roots=[
+        Path(config.TAK_DATAPACKAGE_TEMPLATES_FOLDER),
+        Path(config.TAK_MISSIONPKG_TEMPLATES_FOLDER),
+        Path(config.VITE_ASSET_SET_TEMPLATES_FOLDER),
+    ],
+    recheck_interval=config.TAK_TEMPLATE_CATALOG_RECHECK,
+)
@@ -0,0 +1,130 @@
+"""Compression policy and deflate backends for the package archives.
+
+Already compressed content (images, nested archives, map tiles, PKCS12) is stored as is, everything else is
+deflated with the configured level using the fastest available zlib compatible backend.
+"""
+
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Protocol
+import logging
+import zlib
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+
+from takrmapi import config
+
+LOGGER = logging.getLogger(__name__)
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+
+
+class TAKCompressObj(Protocol):  # pylint: disable=too-few-public-methods
+    """What we need from the compressobj of a backend"""
+
+    def compress(self, data: bytes, /) -> bytes:
+        """Compress chunk"""
+
+    def flush(self) -> bytes:
+        """Finish the stream"""
+
+
+@dataclass(frozen=True)
+class TAKCompressor:
+    """Raw deflate backend"""
+
+    name: str
+    module: Any
+    max_level: int = 9
+
+    def compressobj(self, level: int) -> TAKCompressObj:
+        """Raw deflate (no zlib header) compressor, level is scaled to the range of the backend"""
+        if self.max_level != 9:
+            level = 6 if level < 0 else level
+            level = min(self.max_level, (level * self.max_level + 8) // 9)
+        obj: TAKCompressObj = self.module.compressobj(level, zlib.DEFLATED, -15)
+        return obj
+
+    def crc32(self, data: bytes, value: int = 0) -> int:
+        """CRC-32 of data"""
+        crc: int = self.module.crc32(data, value)
+        return crc
+
+
+def _load_zlib_ng() -> Optional[TAKCompressor]:
+    """zlib-ng drop-in (python-zlib-ng)"""
+    try:
+        from zlib_ng import zlib_ng  # type: ignore[import-not-found]  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return TAKCompressor(name="zlib-ng", module=zlib_ng)
+
+
+def _load_isal() -> Optional[TAKCompressor]:
+    """Intel ISA-L (python-isal), supports levels 0-3"""
+    try:
+        from isal import isal_zlib  # type: ignore[import-not-found]  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return TAKCompressor(name="isal", module=isal_zlib, max_level=3)
+
+
+_BACKEND_LOADERS: Dict[str, Callable[[], Optional[TAKCompressor]]] = {
+    "zlib-ng": _load_zlib_ng,
+    "isal": _load_isal,
+    "zlib": lambda: TAKCompressor(name="zlib", module=zlib),
+}
+
+
+def available_compressors() -> List[TAKCompressor]:
+    """All backends that can be imported, fastest first"""
+    return [backend for backend in (loader() for loader in _BACKEND_LOADERS.values()) if backend is not None]
+
+
+def get_compressor(name: str = "auto") -> TAKCompressor:
+    """Return named backend, "auto" picks the fastest installed one. Falls back to stdlib zlib"""
+    if name != "auto":
+        loader = _BACKEND_LOADERS.get(name)
+        backend = loader() if loader else None
+        if backend is not None:
+            return backend
+        LOGGER.warning("Compressor backend '{}' not available, using zlib".format(name))
+    return available_compressors()[0]
+
+
+@dataclass(frozen=True)
+class TAKCompressionPolicy:
+    """Decides per archive member whether it's stored or deflated"""
+
+    level: int = zlib.Z_DEFAULT_COMPRESSION
+    store_extensions: FrozenSet[str] = frozenset()
+    min_deflate_size: int = 0
+    compressor: TAKCompressor = TAKCompressor(name="zlib", module=zlib)
+
+    def method(self, arcname: str, size: int) -> int:
+        """Return ZIP compression method for member"""
+        if self.level == 0 or size < self.min_deflate_size:
+            return METHOD_STORED
+        if PurePosixPath(arcname).suffix.lower() in self.store_extensions:
+            return METHOD_STORED
+        return METHOD_DEFLATED
+
+    def compressobj(self) -> TAKCompressObj:
+        """Compressor for deflated member"""
+        return self.compressor.compressobj(self.level)
+
+    def crc32(self, data: bytes, value: int = 0) -> int:
+        """CRC-32 of data"""
+        return self.compressor.crc32(data, value)
+
+
+def parse_extensions(value: str) -> FrozenSet[str]:
+    """Comma separated extensions to normalized set (".png")"""
+    return frozenset(f".{ext.strip().lstrip('.').lower()}" for ext in value.split(",") if ext.strip())
+
+
+DEFAULT_POLICY = TAKCompressionPolicy(
+    level=config.TAK_PKG_DEFLATE_LEVEL,
+    store_extensions=parse_extensions(config.TAK_PKG_STORE_EXTENSIONS),
+    min_deflate_size=config.TAK_PKG_DEFLATE_MIN_SIZE,
+    compressor=get_compressor(config.TAK_PKG_COMPRESSOR),
+)
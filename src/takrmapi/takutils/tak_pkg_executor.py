@@ -0,0 +1,118 @@
+"""Bounded executor for the blocking package building steps.
+
+PKCS12 conversion, template rendering, deflate and file IO are dispatched here instead of the default executor,
+so a burst of enrollments queues up behind the concurrency cap instead of starving healthchecks and the
+usercrud hooks that share the worker.
+"""
+
+from typing import Any, Callable, Dict, Optional, TypeVar
+import asyncio
+import functools
+import logging
+import time
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from takrmapi import config
+
+LOGGER = logging.getLogger(__name__)
+T = TypeVar("T")  # pylint: disable=invalid-name
+
+
+class TAKPackagingExecutor:  # pylint: disable=too-many-instance-attributes
+    """Thread pool (and optional process pool) with concurrency cap and queue metrics"""
+
+    def __init__(self, threads: int, processes: int, max_concurrency: int) -> None:
+        self.threads = threads
+        self.processes = processes
+        self.max_concurrency = max_concurrency
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Semaphores are bound to event loop"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    @property
+    def thread_pool(self) -> ThreadPoolExecutor:
+        """Thread pool for IO and GIL releasing work"""
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="takpkg")
+        return self._thread_pool
+
+    @property
+    def process_pool(self) -> Optional[ProcessPoolExecutor]:
+        """Process pool for CPU heavy work, None when not configured"""
+        if self._process_pool is None and self.processes > 0:
+            self._process_pool = ProcessPoolExecutor(max_workers=self.processes)
+        return self._process_pool
+
+    async def _submit(self, executor: Executor, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Wait for free slot and run the function in executor"""
+        queued_at = time.monotonic()
+        self.queued += 1
+        try:
+            await self._get_semaphore().acquire()
+        finally:
+            self.queued -= 1
+        try:
+            waited = time.monotonic() - queued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.running += 1
+            return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._get_semaphore().release()
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run blocking function in the thread pool"""
+        return await self._submit(self.thread_pool, func, *args, **kwargs)
+
+    async def run_cpu(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run CPU heavy function in the process pool if one is configured, function and args must pickle"""
+        process_pool = self.process_pool
+        if process_pool is None:
+            return await self.run(func, *args, **kwargs)
+        return await self._submit(process_pool, func, *args, **kwargs)
+
+    def shutdown(self) -> None:
+        """Shut down the pools, they are re-created on next use"""
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Executor counters"""
+        return {
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "wait_avg": self.wait_total / self.completed if self.completed else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+PKG_EXECUTOR = TAKPackagingExecutor(
+    threads=config.TAK_PKG_EXECUTOR_THREADS,
+    processes=config.TAK_PKG_EXECUTOR_PROCESSES,
+    max_concurrency=config.TAK_PKG_EXECUTOR_MAX_CONCURRENCY,
+)
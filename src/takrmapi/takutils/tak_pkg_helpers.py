@@ -2,20 +2,28 @@
 
 import base64
 import binascii
-from typing import List, Any, Dict, ClassVar
+from typing import List, Any, Dict, ClassVar, Optional, Sequence
 import logging
 from dataclasses import dataclass, field
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 import tempfile
 import asyncio
+import hashlib
 import os
-import shutil
-from jinja2 import Template
+import time
 
-from libpvarki.mtlshelp.pkcs12 import convert_pem_to_pkcs12
 from takrmapi import config
 from takrmapi.takutils.tak_helpers import UserCRUD, Helpers
+from takrmapi.takutils.tak_credentials import CREDENTIALS
 from takrmapi.takutils.tak_pkg_vars import TAKDataPackagePathVars, TAKViteAssetVars, UserTAKTemplateVars
+from takrmapi.takutils.tak_pkg_zipstream import TAKZipStream, TAKZipBytesStream
+from takrmapi.takutils.tak_pkg_skeleton import TAKZipSkeleton
+from takrmapi.takutils.tak_pkg_cache import PACKAGE_CACHE, TAKPackageCacheKey, TAKCachedPackage
+from takrmapi.takutils.tak_pkg_catalog import TEMPLATE_CATALOG
+from takrmapi.takutils.tak_pkg_templates import TEMPLATE_ENV
+from takrmapi.takutils.tak_pkg_pkcs12 import CA_BUNDLE, USER_PKCS12_CACHE, create_user_pkcs12
+from takrmapi.takutils.tak_pkg_executor import PKG_EXECUTOR
+from takrmapi.takutils.tak_pkg_manifest import TAKManifest, TAKManifestContent
 
 
 LOGGER = logging.getLogger(__name__)
@@ -24,7 +32,7 @@ KEYPAIR_TIMEOUT = 5.0
 
 
 @dataclass
-class TAKPkgVars:
+class TAKPkgVars:  # pylint: disable=too-many-instance-attributes
     """TAK datapackage variables"""
 
     package_default_path: Path
@@ -34,6 +42,8 @@ class TAKPkgVars:
     zip_path: Path
     zip_tmp_folder: Path
     template_file_render_str: str
+    zip_stream: Optional[TAKZipStream] = None
+    manifest: Optional[TAKManifest] = None
 
 
 def _get_secret_key_from_environ() -> bytes:
@@ -111,15 +121,17 @@ class TAKDataPackage:
     @property
     def is_folder(self) -> bool:
         """Check if package is folder"""
+        default_is_dir = TEMPLATE_CATALOG.is_dir(self._pkgvars.package_default_path)
+        extra_is_dir = TEMPLATE_CATALOG.is_dir(self._pkgvars.package_extra_path)
         if self.default_path_found and self.extra_path_found:
-            if self._pkgvars.package_default_path.is_dir() != self._pkgvars.package_extra_path.is_dir():
+            if default_is_dir != extra_is_dir:
                 raise ValueError(
                     "Mismatch in package paths! Both default and extra path should either be file or folder! {}".format(
                         self.template_path
                     )
                 )
 
-        if self._pkgvars.package_default_path.is_dir() or self._pkgvars.package_extra_path.is_dir():
+        if default_is_dir or extra_is_dir:
             return True
 
         return False
@@ -134,14 +146,14 @@ class TAKDataPackage:
     @property
     def default_path_found(self) -> bool:
         """Data package default path is found"""
-        return self._pkgvars.package_default_path.exists()
+        return TEMPLATE_CATALOG.exists(self._pkgvars.package_default_path)
 
     @property
     def extra_path_found(self) -> bool:
         """Data package extra/override path is found"""
         if self._pkgvars.package_extra_path == self._pkgvars.package_default_path:
             return False
-        return self._pkgvars.package_extra_path.exists()
+        return TEMPLATE_CATALOG.exists(self._pkgvars.package_extra_path)
 
     @property
     def default_path(self) -> Path:
@@ -156,38 +168,9 @@ class TAKDataPackage:
     @property
     def get_package_files(self) -> Dict[str, Path]:
         """Return combined default+extra file list. Content from extra overrides default"""
-        # Extra package files
-        pkg_extra_files: Dict[str, Any] = {}
-        if self.extra_path_found:
-            LOGGER.debug("Extra content found for data package from path {}".format(self._pkgvars.package_extra_path))
-            for root, _, files in os.walk(self._pkgvars.package_extra_path):
-                for name in files:
-                    f_src_path = Path(root) / name
-                    f_pkg_str = str(f_src_path).replace(str(self._pkgvars.package_extra_path) + "/", "")
-                    pkg_extra_files[f_pkg_str] = f_src_path
-
-        # Default package files, override using extras
-        pkg_files: Dict[str, Any] = {}
-
-        for root, _, files in os.walk(self._pkgvars.package_default_path):
-            for name in files:
-                if name in pkg_extra_files:
-                    pkg_files[name] = pkg_extra_files[name]
-                    LOGGER.debug("Package file {} overridden with {}".format(name, pkg_extra_files[name]))
-                    pkg_extra_files.pop(name)
-                else:
-                    f_src_path = Path(root) / name
-                    f_pkg_str = str(f_src_path).replace(str(self._pkgvars.package_extra_path) + "/", "")
-                    pkg_files[f_pkg_str] = f_src_path
-
-        # Add extra files if there are some left.
-        if pkg_extra_files:
-            LOGGER.debug("Additional files are added to data package from {}".format(self._pkgvars.package_extra_path))
-            for e_name, e_path in pkg_extra_files.items():
-                pkg_files[e_name] = e_path
-                # pkg_files.append(extra_file)
-
-        return pkg_files
+        return TEMPLATE_CATALOG.package_files(
+            self._pkgvars.package_default_path, self._pkgvars.package_extra_path if self.extra_path_found else None
+        )
 
     @property
     def is_mission_package(self) -> bool:
@@ -267,6 +250,28 @@ class TAKDataPackage:
         """Set package tmp folder path"""
         self._pkgvars.zip_tmp_folder = z_tmp_folder
 
+    @property
+    def zip_stream(self) -> TAKZipStream:
+        """Return streamable package archive"""
+        if self._pkgvars.zip_stream is None:
+            raise ValueError("Package '{}' archive has not been assembled".format(self.template_path))
+        return self._pkgvars.zip_stream
+
+    @zip_stream.setter
+    def zip_stream(self, z_stream: TAKZipStream) -> None:
+        """Set streamable package archive"""
+        self._pkgvars.zip_stream = z_stream
+
+    @property
+    def manifest(self) -> Optional[TAKManifest]:
+        """Return parsed mission package manifest, None if package has no manifest"""
+        return self._pkgvars.manifest
+
+    @manifest.setter
+    def manifest(self, manifest: TAKManifest) -> None:
+        """Set parsed mission package manifest"""
+        self._pkgvars.manifest = manifest
+
     @property
     def template_str(self) -> str:
         """Return rendered template file str"""
@@ -284,15 +289,14 @@ class TAKPackageZip:
     def __init__(self, user: UserCRUD):
         self.user: UserCRUD = user
         self.helpers = Helpers(self.user)
-
-    async def create_zip_bundles(
-        # self, template_folders: list[Path], is_mission_package: bool = False
-        self,
-        datapackages: list[TAKDataPackage],
-    ) -> None:
-        """Create tak mission package packages to different app versions"""
-
-        tasks: List[asyncio.Task[Any]] = []
+        # User secrets are resolved once and shared by all the packages built with this instance
+        self._user_p12: Optional[bytes] = None
+        self._cert_fingerprint: Optional[str] = None
+        self._user_p12_lock = asyncio.Lock()
+
+    @staticmethod
+    def check_bundle_sources(datapackages: list[TAKDataPackage]) -> None:
+        """Check that the packages can be bundled"""
         for dp in datapackages:
             if not dp.path_found:
                 raise ValueError(
@@ -300,136 +304,199 @@ class TAKPackageZip:
                         dp.package_name, dp.default_path, dp.extra_path
                     )
                 )
+            if not dp.is_folder:
+                raise ValueError(
+                    "'{}' is file. Package bundles can be created only from directories.".format(dp.default_path)
+                )
 
-            # TODO tmpfile in memory
-            dp.zip_tmp_folder = Path(tempfile.mkdtemp(suffix=f"_{self.user.callsign}"))
+    async def create_zip_bundles(
+        # self, template_folders: list[Path], is_mission_package: bool = False
+        self,
+        datapackages: list[TAKDataPackage],
+    ) -> None:
+        """Create tak mission package zip files to temp folders (for uploading them to TAK)"""
+        self.check_bundle_sources(datapackages)
 
+        tasks: List[asyncio.Task[Any]] = []
+        for dp in datapackages:
             LOGGER.info("Added {} to background tasks".format(dp.package_name))
-
-            if dp.is_folder:
-                tasks.append(asyncio.create_task(self.create_datapackage_zip(datapackage=dp)))
-            else:
-                raise ValueError(
-                    "'{}' is file. create_zip_bundles works only with directories.".format(dp.default_path)
-                )
+            tasks.append(asyncio.create_task(self.create_zip_bundle(datapackage=dp)))
 
         LOGGER.debug("Waiting for the zip tasks to finish")
         await asyncio.gather(*tasks)
         LOGGER.info("Background zipping tasks done")
 
-    async def create_datapackage_zip(self, datapackage: TAKDataPackage) -> None:  # pylint: disable=too-many-locals
-        """Loop through files in missionpkg templates folder"""
-        # TODO maybe in memory fs for tmp files...
+    async def create_zip_bundle(self, datapackage: TAKDataPackage) -> None:
+        """Create single package zip file to a new temp folder, sources must be checked beforehand"""
+        datapackage.zip_tmp_folder = Path(tempfile.mkdtemp(suffix=f"_{self.user.callsign}"))
+        try:
+            await self.create_datapackage_zip(datapackage=datapackage)
+        except BaseException:
+            await self.helpers.remove_tmp_dir(datapackage.zip_tmp_folder)
+            raise
+
+    async def create_zip_streams(self, datapackages: list[TAKDataPackage]) -> None:
+        """Assemble streamable package archives, nothing is written to disk"""
+        self.check_bundle_sources(datapackages)
+        await asyncio.gather(*[self.create_datapackage_stream(datapackage=dp) for dp in datapackages])
+
+    async def create_mission_packages(self, variants: Sequence[Path]) -> List[TAKDataPackage]:
+        """Build all mission package variants for the user in single pass, secrets are shared between them"""
+        datapackages = [TAKDataPackage(template_path=variant, template_type="mission") for variant in variants]
+        await self.create_zip_streams(datapackages=datapackages)
+        return datapackages
+
+    async def create_datapackage_zip(self, datapackage: TAKDataPackage) -> None:
+        """Write the package archive to the package temp folder"""
+        zstream = await self.create_datapackage_stream(datapackage)
+        datapackage.zip_path = datapackage.zip_tmp_folder / zstream.filename
+        await PKG_EXECUTOR.run(zstream.write_to, datapackage.zip_path)
+        datapackage.zip_complete = True
 
-        # FIXME: use Paths for everything
+    async def create_datapackage_stream(self, datapackage: TAKDataPackage) -> TAKZipStream:
+        """Loop through files in package templates folder and collect the archive entries"""
         walk_dir = datapackage.default_path
-        tmp_zip_folder = datapackage.zip_tmp_folder / walk_dir.name
+        zip_name = walk_dir.name
         if datapackage.is_mission_package:
-            tmp_zip_folder = datapackage.zip_tmp_folder / f"{config.TAK_SERVER_NAME}_{walk_dir.name}"
-        tmp_zip_folder.mkdir(parents=True, exist_ok=True)
-
-        LOGGER.debug("Moving files from '{}' to '{}' for bundling.".format(walk_dir, tmp_zip_folder))
+            zip_name = f"{config.TAK_SERVER_NAME}_{walk_dir.name}"
+        zstream = TAKZipStream(filename=f"{zip_name}.zip")
+        # Cache drops builds that were started before the user was invalidated
+        started = time.monotonic()
 
         package_files: Dict[str, Any] = datapackage.get_package_files
+        skeleton = await TAKZipSkeleton.get_skeleton(str(datapackage.default_path), package_files)
+        zstream.timestamp = skeleton.timestamp
+
+        cache_key = await self.package_cache_key(datapackage, skeleton.version)
+        if cache_key:
+            cached = PACKAGE_CACHE.get(cache_key)
+            if cached is None and PACKAGE_CACHE.shared_folder is not None:
+                # Built by another worker (or prewarmed)
+                cached = await PKG_EXECUTOR.run(PACKAGE_CACHE.load, cache_key)
+            if cached:
+                datapackage.zip_stream = TAKZipBytesStream(filename=cached.filename, data=cached.data, etag=cached.etag)
+                return datapackage.zip_stream
 
         for pkg_file_path, org_full_path in package_files.items():
-            dst_file = tmp_zip_folder / pkg_file_path
-            dst_file.parent.mkdir(parents=True, exist_ok=True)
+            LOGGER.debug("org_full_path={} pkg_file_path={}".format(org_full_path, pkg_file_path))
 
-            LOGGER.debug("org_full_path={} dst_file={}".format(org_full_path, dst_file))
-
-            if dst_file.name.endswith(".tpl"):
+            if pkg_file_path.endswith(".tpl"):
                 template_f = TAKDataPackage(template_path=org_full_path, template_type=datapackage.template_type)
                 await self.render_tak_manifest_template(template_f)
 
-                dst_template_file = dst_file.parent / template_f.package_upload_dst_fname
-
-                LOGGER.debug("Handling template file -> '{}' for bundling.".format(dst_template_file))
-                with open(dst_template_file, "w", encoding="utf-8") as filehandle:
-                    filehandle.write(template_f.template_str)
+                arcname = str(PurePosixPath(pkg_file_path).parent / template_f.package_upload_dst_fname)
+                LOGGER.debug("Handling template file -> '{}' for bundling.".format(arcname))
+                zstream.add_bytes(arcname, template_f.template_str.encode("utf-8"))
 
                 # Missionpackage zip specific peculiarities here
                 if datapackage.is_mission_package:
-                    if dst_template_file.name == "manifest.xml":
-                        await self.tak_missionpackage_extras(dst_template_file, tmp_zip_folder)
+                    if template_f.package_upload_dst_fname == "manifest.xml":
+                        manifest = TAKManifest.parse(template_f.template_str)
+                        datapackage.manifest = manifest
+                        await self.tak_missionpackage_extras(manifest, zstream)
 
+            elif pkg_file_path in skeleton.members:
+                zstream.add_precompressed(pkg_file_path, skeleton.members[pkg_file_path])
             else:
-                shutil.copy(org_full_path, dst_file)
+                zstream.add_file(pkg_file_path, org_full_path)
+
+        if cache_key:
+            # Archives that do not fit in the cache are not collected while streaming
+            zstream.complete_max_bytes = PACKAGE_CACHE.max_entry_bytes
+            zstream.on_complete.append(
+                lambda data: PACKAGE_CACHE.put(
+                    cache_key,
+                    TAKCachedPackage(
+                        filename=zstream.filename,
+                        data=data,
+                        user_uuid=cache_key.user_uuid,
+                        callsign=cache_key.callsign,
+                        created=started,
+                    ),
+                )
+            )
 
-        await self.zip_folder_content(str(tmp_zip_folder), str(tmp_zip_folder))
+        datapackage.zip_stream = zstream
+        return zstream
 
-        datapackage.zip_path = Path(f"{tmp_zip_folder}.zip")
-        datapackage.zip_complete = True
+    async def package_cache_key(self, datapackage: TAKDataPackage, tree_version: str) -> Optional[TAKPackageCacheKey]:
+        """Return cache key for the package, None if the package should not be cached"""
+        if not PACKAGE_CACHE.enabled:
+            return None
+        # Only mission packages have the user cert
+        cert_fingerprint = ""
+        if datapackage.is_mission_package:
+            fingerprint = await self.cert_fingerprint()
+            if fingerprint is None:
+                # Keypair is not ready yet, build will wait for it
+                return None
+            cert_fingerprint = fingerprint
+        return TAKPackageCacheKey(
+            user_uuid=self.user.user.uuid,
+            callsign=self.user.callsign,
+            package=str(datapackage.default_path),
+            tree_version=tree_version,
+            cert_fingerprint=cert_fingerprint,
+            mesh_key_hash=hashlib.sha256(config.TAK_SERVER_NETWORKMESH_KEY_STR.encode("utf-8")).hexdigest(),
+        )
+
+    async def cert_fingerprint(self) -> Optional[str]:
+        """Fingerprint of the users local cert, None if the cert does not exist yet"""
+        if self._cert_fingerprint is None:
+            self._cert_fingerprint = await PKG_EXECUTOR.run(self._load_cert_fingerprint)
+        return self._cert_fingerprint
+
+    def _load_cert_fingerprint(self) -> Optional[str]:
+        """Read the cert through the stat cached credential store"""
+        try:
+            return CREDENTIALS.load(self.user.certpath).digest
+        except FileNotFoundError:
+            return None
+
+    async def ca_p12(self) -> bytes:
+        """Return the CA chain as PKCS12"""
+        return await PKG_EXECUTOR.run(CA_BUNDLE.get)
+
+    async def user_p12(self) -> bytes:
+        """Return the users cert and key as PKCS12, resolved once per instance"""
+        async with self._user_p12_lock:
+            if self._user_p12 is None:
+                await asyncio.wait_for(self.user.wait_for_keypair(), timeout=KEYPAIR_TIMEOUT)
+                certpem, certkey = await PKG_EXECUTOR.run(lambda: (self.user.certpem, self.user.certkey))
+                cache_args = (self.user.user.uuid, certpem, certkey, self.user.callsign)
+                p12bytes = USER_PKCS12_CACHE.get(*cache_args)
+                if p12bytes is None:
+                    p12bytes = await PKG_EXECUTOR.run_cpu(create_user_pkcs12, certpem, certkey, self.user.callsign)
+                    USER_PKCS12_CACHE.put(*cache_args, p12bytes)
+                self._user_p12 = p12bytes
+        return self._user_p12
 
     async def render_tak_manifest_template(self, datapackage: TAKDataPackage) -> None:
         """Render tak manifest template"""
 
         template_user_vars = UserTAKTemplateVars(user=self.user, template_file=datapackage.package_single_file_path)
 
-        with open(datapackage.package_single_file_path, "r", encoding="utf-8") as filehandle:
-            template = Template(filehandle.read())
-            datapackage.template_str = template.render(
-                v=template_user_vars,
-            )
-
-    async def zip_folder_content(self, zipfile: str, tmp_folder: str) -> None:
-        """Zip folder content"""
-        await asyncio.get_running_loop().run_in_executor(None, shutil.make_archive, zipfile, "zip", tmp_folder)
+        datapackage.template_str = await PKG_EXECUTOR.run(
+            TEMPLATE_ENV.render_file,
+            datapackage.package_single_file_path,
+            v=template_user_vars,
+        )
 
-    async def tak_missionpackage_extras(self, manifest_file: Path, tmp_folder: Path) -> None:
+    async def tak_missionpackage_extras(self, manifest: TAKManifest, zstream: TAKZipStream) -> None:
         """Check if there is some extra that needs to be done defined in the manifest"""
-        manifest_rows = manifest_file.read_text().splitlines()
-        for row in manifest_rows:
-            # .p12 rows
-            # <!--
-            if "<!--" in row:
-                continue
-
-            # Add the certificate files to the zip package
-            if ".p12" in row:
-                await self.tak_missionpackage_add_p12(row, tmp_folder)
-
-    async def tak_missionpackage_add_p12(self, row: str, tmp_folder: Path) -> None:
-        """Handle manifest .p12 rows"""
-        tmp_folder = await self.chk_manifest_file_extra_folder(row=row, tmp_folder=tmp_folder)
-        # FIXME: do the blocking IO in executor
-        LOGGER.info("PKCS12 Got template %s, tmp folder %s...", row, tmp_folder)
-        if "rasenmaeher_ca-public.p12" in row:
-            # FIXME: instead of adding the root key into the software, need a way to get full chain with Root CA
-            templates_folder = Path(__file__).parent.parent / "templates"
-            LOGGER.info("Searching keys from  %s...", templates_folder)
-            ca_files = templates_folder.rglob("*.pem")
-            srcdata = Path("/le_certs/rasenmaeher/fullchain.pem").read_bytes()
-            for ca_f in sorted(ca_files):
-                LOGGER.info("Adding PEM %s to CA bundle", ca_f.name)
-                srcdata = srcdata + ca_f.read_bytes()
-
-            tgtfile = Path(tmp_folder) / "rasenmaeher_ca-public.p12"
-            LOGGER.info("Creating %s", tgtfile)
-            p12bytes = convert_pem_to_pkcs12(srcdata, None, "public", None, "ca-chains")
-            tgtfile.parent.mkdir(parents=True, exist_ok=True)
-            LOGGER.debug("{} exists: {}".format(tgtfile.parent, tgtfile.parent.exists()))
-            tgtfile.write_bytes(p12bytes)
-            LOGGER.debug("{} exists: {}".format(tgtfile, tgtfile.exists()))
-        elif f"{self.user.callsign}.p12" in row:
-            tgtfile = Path(tmp_folder) / f"{self.user.callsign}.p12"
-            await asyncio.wait_for(self.user.wait_for_keypair(), timeout=KEYPAIR_TIMEOUT)
-            LOGGER.info("Creating {}".format(tgtfile))
-            p12bytes = convert_pem_to_pkcs12(
-                self.user.certpem, self.user.certkey, self.user.callsign, None, self.user.callsign
-            )
-            tgtfile.parent.mkdir(parents=True, exist_ok=True)
-            tgtfile.write_bytes(p12bytes)
-            LOGGER.debug("{} exists: {}".format(tgtfile, tgtfile.exists()))
+        # Add the certificate files to the zip package
+        for content in manifest.pkcs12_contents:
+            await self.tak_missionpackage_add_p12(content, zstream)
+
+    async def tak_missionpackage_add_p12(self, content: TAKManifestContent, zstream: TAKZipStream) -> None:
+        """Handle manifest .p12 entries"""
+        LOGGER.info("PKCS12 Got manifest entry %s, archive folder '%s'...", content.zip_entry, content.folder)
+        arcname = str(content.folder / content.name)
+        if content.name == "rasenmaeher_ca-public.p12":
+            LOGGER.info("Adding %s", arcname)
+            zstream.add_bytes(arcname, await self.ca_p12())
+        elif content.name == f"{self.user.callsign}.p12":
+            LOGGER.info("Adding {}".format(arcname))
+            zstream.add_bytes(arcname, await self.user_p12())
         else:
-            raise RuntimeError("IDK what to do")
-
-    async def chk_manifest_file_extra_folder(self, row: str, tmp_folder: Path) -> Path:
-        """Check folder path from manifest, return updated path if folder was located"""
-        xml_value: str = row.split(">")[1].split("<")[0]
-        if "/" in xml_value:
-            manifest_file = tmp_folder / xml_value
-            manifest_file.parent.mkdir(parents=True, exist_ok=True)
-            LOGGER.info("File defined in manifest in folder {}".format(manifest_file.parent.absolute()))
-            return manifest_file.parent.absolute()
-        return tmp_folder
+            raise RuntimeError("Unknown PKCS12 file '{}' in manifest".format(content.zip_entry))
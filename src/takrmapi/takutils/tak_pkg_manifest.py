@@ -0,0 +1,72 @@
+"""Mission package manifest model, parsed from the rendered manifest.xml"""
+
+from typing import Dict, List
+import logging
+from dataclasses import dataclass, field
+from pathlib import PurePosixPath
+from xml.etree import ElementTree  # nosec B405 # we only parse manifests rendered from our own templates
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TAKManifestContent:
+    """Single Content entry of the manifest"""
+
+    zip_entry: str
+    ignore: bool = False
+
+    @property
+    def path(self) -> PurePosixPath:
+        """Archive path of the entry"""
+        return PurePosixPath(self.zip_entry)
+
+    @property
+    def name(self) -> str:
+        """File name of the entry"""
+        return self.path.name
+
+    @property
+    def folder(self) -> PurePosixPath:
+        """Archive folder of the entry, "." for the root"""
+        return self.path.parent
+
+    @property
+    def is_pkcs12(self) -> bool:
+        """Entry is a PKCS12 file that has to be generated"""
+        return self.name.lower().endswith(".p12")
+
+
+@dataclass
+class TAKManifest:
+    """MissionPackageManifest"""
+
+    version: str = ""
+    parameters: Dict[str, str] = field(default_factory=dict)
+    contents: List[TAKManifestContent] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, manifest_str: str) -> "TAKManifest":
+        """Parse rendered manifest, comments are skipped by the parser"""
+        try:
+            root = ElementTree.fromstring(manifest_str)  # nosec B314 # rendered from our own templates
+        except ElementTree.ParseError as exc:
+            raise ValueError("Invalid mission package manifest: {}".format(exc)) from exc
+        manifest = TAKManifest(version=root.get("version", ""))
+        for param in root.iterfind("./Configuration/Parameter"):
+            manifest.parameters[param.get("name", "")] = param.get("value", "")
+        for content in root.iterfind("./Contents/Content"):
+            # Version 2 manifests use the zipEntry attribute, version 1 had the path as element text
+            zip_entry = (content.get("zipEntry") or content.text or "").strip()
+            if not zip_entry:
+                LOGGER.warning("Manifest Content without zipEntry, skipping")
+                continue
+            manifest.contents.append(
+                TAKManifestContent(zip_entry=zip_entry, ignore=content.get("ignore", "false").lower() == "true")
+            )
+        return manifest
+
+    @property
+    def pkcs12_contents(self) -> List[TAKManifestContent]:
+        """PKCS12 entries that have to be added to the package"""
+        return [content for content in self.contents if content.is_pkcs12]
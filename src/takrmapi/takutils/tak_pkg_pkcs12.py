@@ -0,0 +1,199 @@
+"""PKCS12 files for the TAK packages.
+
+The CA chain PKCS12 is the same for every user in the deployment, it's built once per process and rebuilt only
+when the source PEM files change. User PKCS12 files are cached by the cert and key they were made from.
+"""
+
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from libpvarki.mtlshelp.pkcs12 import convert_pem_to_pkcs12
+
+from takrmapi import config
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TAKCABundle:  # pylint: disable=too-many-instance-attributes
+    """CA chain as PKCS12, shared by all users"""
+
+    def __init__(self, fullchain: Path, pem_folder: Path, persist_path: Optional[Path], recheck_interval: float):
+        self.fullchain = fullchain
+        self.pem_folder = pem_folder
+        self.persist_path = persist_path
+        self.recheck_interval = recheck_interval
+        self.rebuilds = 0
+        self.loads = 0
+        self.hits = 0
+        self._p12: Optional[bytes] = None
+        self._version = ""
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def sources(self) -> List[Path]:
+        """PEM files bundled into the PKCS12, in bundling order"""
+        # FIXME: instead of adding the root key into the software, need a way to get full chain with Root CA
+        return [self.fullchain] + sorted(self.pem_folder.rglob("*.pem"))
+
+    def source_version(self) -> Tuple[List[Path], str]:
+        """Return the sources and version string over their paths, sizes and mtimes"""
+        sources = self.sources()
+        digest = hashlib.sha256()
+        for src in sources:
+            stat = src.stat()
+            digest.update(f"{src}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+        return sources, digest.hexdigest()
+
+    def _build(self, sources: List[Path]) -> bytes:
+        """Concatenate the PEMs and convert"""
+        srcdata = b""
+        for src in sources:
+            LOGGER.info("Adding PEM {} to CA bundle".format(src.name))
+            srcdata = srcdata + src.read_bytes()
+        p12bytes: bytes = convert_pem_to_pkcs12(srcdata, None, "public", None, "ca-chains")
+        return p12bytes
+
+    def _load_persisted(self, version: str) -> Optional[bytes]:
+        """Return persisted PKCS12 if it was built from the same sources"""
+        if not self.persist_path:
+            return None
+        try:
+            header, separator, p12bytes = self.persist_path.read_bytes().partition(b"\n")
+        except FileNotFoundError:
+            return None
+        if not separator or header != version.encode("utf-8"):
+            return None
+        return p12bytes
+
+    def _persist(self, p12bytes: bytes, version: str) -> None:
+        """Write the PKCS12 for the other workers"""
+        if not self.persist_path:
+            return
+        # Version is the first line of the same file so a single replace swaps both, workers never pair
+        # a bundle with the version of another one
+        tmp_path = self.persist_path.with_name(f".{self.persist_path.name}.{os.getpid()}")
+        try:
+            self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(version.encode("utf-8") + b"\n" + p12bytes)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as err:
+            LOGGER.warning("Unable to persist CA bundle to {}: {}".format(self.persist_path, err))
+
+    def get(self) -> bytes:
+        """Return the CA chain PKCS12, rebuilt if the sources have changed"""
+        with self._lock:
+            now = time.monotonic()
+            if self._p12 is not None and now - self._last_check < self.recheck_interval:
+                self.hits += 1
+                return self._p12
+            sources, version = self.source_version()
+            self._last_check = now
+            if self._p12 is not None and version == self._version:
+                self.hits += 1
+                return self._p12
+
+            p12bytes = self._load_persisted(version)
+            if p12bytes is not None:
+                self.loads += 1
+            else:
+                LOGGER.info("Building CA chain PKCS12 from {} PEM files".format(len(sources)))
+                p12bytes = self._build(sources)
+                self.rebuilds += 1
+                self._persist(p12bytes, version)
+            self._p12 = p12bytes
+            self._version = version
+            return p12bytes
+
+    def clear(self) -> None:
+        """Drop the in-memory bundle"""
+        with self._lock:
+            self._p12 = None
+            self._version = ""
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Bundle counters"""
+        return {"hits": self.hits, "rebuilds": self.rebuilds, "loads": self.loads}
+
+
+def create_user_pkcs12(certpem: str, keypem: str, callsign: str) -> bytes:
+    """Convert users cert and key to PKCS12, callsign is used as password and friendly name"""
+    p12bytes: bytes = convert_pem_to_pkcs12(certpem, keypem, callsign, None, callsign)
+    return p12bytes
+
+
+class TAKUserPKCS12Cache:
+    """Bounded LRU of user PKCS12 files keyed by SHA-256 of the user uuid, cert and key"""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def fingerprint(user_uuid: str, certpem: str, keypem: str, callsign: str) -> str:
+        """Cache key, callsign is the PKCS12 password and friendly name"""
+        return hashlib.sha256("\0".join((user_uuid, certpem, keypem, callsign)).encode("utf-8")).hexdigest()
+
+    def get(self, user_uuid: str, certpem: str, keypem: str, callsign: str) -> Optional[bytes]:
+        """Return cached PKCS12 of the user or None"""
+        digest = self.fingerprint(user_uuid, certpem, keypem, callsign)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_uuid: str, certpem: str, keypem: str, callsign: str, p12bytes: bytes) -> None:
+        """Store PKCS12"""
+        if self.max_entries <= 0:
+            return
+        digest = self.fingerprint(user_uuid, certpem, keypem, callsign)
+        with self._lock:
+            self._entries[digest] = (user_uuid, p12bytes)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_user(self, user_uuid: str) -> int:
+        """Drop the users PKCS12 files, return number of dropped entries"""
+        with self._lock:
+            digests = [digest for digest, entry in self._entries.items() if entry[0] == user_uuid]
+            for digest in digests:
+                del self._entries[digest]
+        return len(digests)
+
+    def clear(self) -> None:
+        """Drop everything"""
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Cache counters"""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._entries)}
+
+
+CA_BUNDLE = TAKCABundle(
+    fullchain=config.TAK_CA_FULLCHAIN,
+    pem_folder=Path(__file__).parent.parent / "templates",
+    persist_path=config.RMAPI_PERSISTENT_FOLDER / "ca_bundle" / "rasenmaeher_ca-public.p12",
+    recheck_interval=config.TAK_CA_BUNDLE_RECHECK,
+)
+USER_PKCS12_CACHE = TAKUserPKCS12Cache(max_entries=config.TAK_USER_P12_CACHE_SIZE)
@@ -0,0 +1,125 @@
+"""Background builds of the mission packages of newly created users.
+
+The first download after enrollment happens while the user is standing there with the phone, so the packages are
+built into PACKAGE_CACHE right after the users/created hook. Only a few users are warmed at a time so that
+mass enrollment does not starve the foreground downloads.
+
+Prewarming needs the shared folder of PACKAGE_CACHE (TAK_PKG_CACHE_SHARED, off by default), without it the
+archives would only serve the downloads that happen to land on the worker that got the hook.
+"""
+
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+import asyncio
+import logging
+import weakref
+
+from libpvarki.schemas.product import UserCRUDRequest
+
+from takrmapi import config
+from takrmapi.takutils.tak_helpers import UserCRUD
+from takrmapi.takutils.tak_pkg_cache import PACKAGE_CACHE
+from takrmapi.takutils.tak_pkg_executor import PKG_EXECUTOR
+from takrmapi.takutils.tak_pkg_helpers import TAKPackageZip
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TAKPackagePrewarmer:  # pylint: disable=too-many-instance-attributes
+    """Schedules background package builds with a cap on concurrent jobs"""
+
+    def __init__(self, variants: Sequence[Path], max_concurrency: int) -> None:
+        self.variants = list(variants)
+        self.max_concurrency = max_concurrency
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._tasks: Dict[str, "asyncio.Task[None]"] = {}
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """Prewarming is pointless without the package cache shared between the workers"""
+        return (
+            self.max_concurrency > 0
+            and PACKAGE_CACHE.enabled
+            and PACKAGE_CACHE.shared_folder is not None
+            and bool(self.variants)
+        )
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Semaphores are bound to event loop"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    def schedule(self, user: UserCRUDRequest) -> Optional["asyncio.Task[None]"]:
+        """Start background build for the user, pending build with older data for the same user is cancelled"""
+        if not self.enabled:
+            return None
+        self.cancel(user.uuid)
+        task = asyncio.create_task(self._prewarm(user), name=f"prewarm-{user.uuid}")
+        self._tasks[user.uuid] = task
+        task.add_done_callback(lambda done: self._forget(user.uuid, done))
+        self.scheduled += 1
+        return task
+
+    def _forget(self, user_uuid: str, task: "asyncio.Task[None]") -> None:
+        """Done callback, drop the task reference unless it was already replaced"""
+        if self._tasks.get(user_uuid) is task:
+            del self._tasks[user_uuid]
+
+    async def _prewarm(self, user: UserCRUDRequest) -> None:
+        """Build and drain the package streams, the streams put the archives to the cache when complete"""
+        async with self._get_semaphore():
+            try:
+                localuser = UserCRUD(user)
+                datapackages = await TAKPackageZip(localuser).create_mission_packages(self.variants)
+                for datapackage in datapackages:
+                    await PKG_EXECUTOR.run(datapackage.zip_stream.read_all)
+            except Exception:  # pylint: disable=broad-exception-caught
+                # Failure here only means the first download builds the package itself
+                LOGGER.exception("Prewarming packages of '{}' failed".format(user.callsign))
+                self.failed += 1
+                return
+        self.completed += 1
+        LOGGER.debug("Prewarmed packages of '{}' ({})".format(user.callsign, self.stats))
+
+    def cancel(self, user_uuid: str) -> bool:
+        """Cancel pending build of the user"""
+        task = self._tasks.pop(user_uuid, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        self.cancelled += 1
+        return True
+
+    async def shutdown(self) -> None:
+        """Cancel all pending builds and wait for them to finish"""
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Prewarm counters"""
+        return {
+            "scheduled": self.scheduled,
+            "pending": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
+
+
+PACKAGE_PREWARMER = TAKPackagePrewarmer(
+    variants=config.TAK_MISSIONPKG_ENABLED_PACKAGES, max_concurrency=config.TAK_PKG_PREWARM_CONCURRENCY
+)
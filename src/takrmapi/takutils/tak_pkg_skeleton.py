@@ -0,0 +1,86 @@
+"""Pre-compressed static content of TAK packages.
+
+Everything except the .tpl files is the same for every user, so the static files are deflated once per
+template tree version and the compressed members are spliced into each user specific archive. The version
+follows the template catalog generation and the indexed file stats, so requests do not need to stat the
+template files.
+"""
+
+from typing import ClassVar, Dict, Mapping, Sequence
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from takrmapi import config
+from takrmapi.takutils.tak_pkg_catalog import TEMPLATE_CATALOG
+from takrmapi.takutils.tak_pkg_compression import DEFAULT_POLICY, TAKCompressionPolicy
+from takrmapi.takutils.tak_pkg_zipstream import ZIP_DEFAULT_TIMESTAMP, TAKZipPrecompressed, precompress_file
+from takrmapi.takutils.tak_pkg_executor import PKG_EXECUTOR
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class TAKZipSkeleton:
+    """Pre-compressed static members of single package"""
+
+    version: str
+    members: Dict[str, TAKZipPrecompressed] = field(default_factory=dict)
+    timestamp: float = ZIP_DEFAULT_TIMESTAMP
+
+    _cache: ClassVar[Dict[str, "TAKZipSkeleton"]] = {}
+
+    @staticmethod
+    def tree_version(package_files: Mapping[str, Path], generation: Sequence[int]) -> str:
+        """Return version hash of the package file list and file stats at the catalog generation"""
+        digest = hashlib.sha256(repr(tuple(generation)).encode("utf-8"))
+        for pkg_file_path, src_path in sorted(package_files.items()):
+            file_stat = TEMPLATE_CATALOG.file_stat(src_path)
+            digest.update(f"{pkg_file_path}\0{src_path}\0{file_stat}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    @classmethod
+    def build(
+        cls, package_files: Mapping[str, Path], version: str, policy: TAKCompressionPolicy = DEFAULT_POLICY
+    ) -> "TAKZipSkeleton":
+        """Compress the static files of the package"""
+        skeleton = TAKZipSkeleton(version=version)
+        for pkg_file_path, src_path in package_files.items():
+            stat = src_path.stat()
+            # Generated members get the time of the newest template file
+            skeleton.timestamp = max(skeleton.timestamp, stat.st_mtime)
+            if pkg_file_path.endswith(".tpl"):
+                continue
+            if stat.st_size > config.TAK_PKG_SKELETON_MAX_ENTRY_SIZE:
+                LOGGER.debug("{} is too large for skeleton, it will be streamed from file".format(src_path))
+                continue
+            skeleton.members[pkg_file_path] = precompress_file(src_path, arcname=pkg_file_path, policy=policy)
+        return skeleton
+
+    @classmethod
+    def _get_current(
+        cls, cache_key: str, package_files: Mapping[str, Path], generation: Sequence[int]
+    ) -> "TAKZipSkeleton":
+        """Return cached skeleton or build new if the template tree has changed"""
+        version = cls.tree_version(package_files, generation)
+        skeleton = cls._cache.get(cache_key)
+        if skeleton is None or skeleton.version != version:
+            LOGGER.info("Building pre-compressed skeleton for '{}' version {}".format(cache_key, version[:12]))
+            skeleton = cls.build(package_files, version)
+            cls._cache[cache_key] = skeleton
+        return skeleton
+
+    @classmethod
+    async def get_skeleton(cls, cache_key: str, package_files: Mapping[str, Path]) -> "TAKZipSkeleton":
+        """Return skeleton for package, cached skeleton is returned right away, builds run in the packaging executor"""
+        generation = TEMPLATE_CATALOG.generation
+        skeleton = cls._cache.get(cache_key)
+        if skeleton is not None and skeleton.version == cls.tree_version(package_files, generation):
+            return skeleton
+        return await PKG_EXECUTOR.run(cls._get_current, cache_key, package_files, generation)
+
+    @classmethod
+    def clear(cls) -> None:
+        """Drop all cached skeletons"""
+        cls._cache.clear()
@@ -0,0 +1,118 @@
+"""Shared Jinja2 environment for package and page templates.
+
+Templates are compiled once per process and re-used until the source file changes. Compiled bytecode is
+also kept on disk under RMAPI_PERSISTENT_FOLDER so new workers do not need to parse the templates again.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+from pathlib import Path
+
+from jinja2 import BaseLoader, BytecodeCache, Environment, FileSystemBytecodeCache, FileSystemLoader, PrefixLoader
+from jinja2 import Template, select_autoescape
+
+from takrmapi import config
+from takrmapi.takutils.tak_pkg_vars import TAKDataPackagePathVars, TAKViteAssetVars
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _unique(paths: List[Path]) -> List[Path]:
+    """Drop duplicate search paths (addon folder can be the default folder), keep the order"""
+    result: List[Path] = []
+    for path in paths:
+        if path not in result:
+            result.append(path)
+    return result
+
+
+def template_roots() -> Dict[str, List[Path]]:
+    """Template name prefix -> search path, addon folders come before the defaults so they override"""
+    return {
+        "missionpkg": _unique(
+            [TAKDataPackagePathVars.missionpkg_extra_folder, TAKDataPackagePathVars.missionpkg_default_folder]
+        ),
+        "client-packages": _unique(
+            [TAKDataPackagePathVars.client_pkg_extra_folder, TAKDataPackagePathVars.client_pkg_default_folder]
+        ),
+        "environment-packages": _unique(
+            [TAKDataPackagePathVars.env_pkg_extra_folder, TAKDataPackagePathVars.env_pkg_default_folder]
+        ),
+        "vite": [TAKViteAssetVars.vite_asset_default_folder],
+        "rmapi": [config.TEMPLATES_PATH],
+    }
+
+
+def _bytecode_cache() -> Optional[BytecodeCache]:
+    """On-disk bytecode cache shared by the workers, None if disabled or the folder is not writable"""
+    if not config.TAK_TEMPLATE_BYTECODE_CACHE:
+        return None
+    cache_dir = config.RMAPI_PERSISTENT_FOLDER / "jinja_cache"
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    except OSError as err:
+        LOGGER.warning("Unable to use {} for template bytecode cache: {}".format(cache_dir, err))
+        return None
+    return FileSystemBytecodeCache(directory=str(cache_dir))
+
+
+class TAKTemplateEnvironment:
+    """Process wide Jinja2 environment, created on first use"""
+
+    def __init__(self) -> None:
+        self._env: Optional[Environment] = None
+        self._roots: List[Tuple[str, Path]] = []
+
+    @property
+    def env(self) -> Environment:
+        """Return the shared environment"""
+        if self._env is None:
+            roots = template_roots()
+            loaders: Dict[str, BaseLoader] = {
+                prefix: FileSystemLoader([str(path) for path in paths]) for prefix, paths in roots.items()
+            }
+            self._roots = [(prefix, path) for prefix, paths in roots.items() for path in paths]
+            self._env = Environment(
+                loader=PrefixLoader(loaders),
+                # Package templates (.tpl) are XML/pref files that were always rendered without escaping
+                autoescape=select_autoescape(enabled_extensions=("html", "htm"), default=False),
+                bytecode_cache=_bytecode_cache(),
+                cache_size=config.TAK_TEMPLATE_CACHE_SIZE,
+                auto_reload=True,
+            )
+        return self._env
+
+    def template_name(self, path: Path) -> Optional[str]:
+        """Map template file path to loader name, None if the file is outside the template roots"""
+        _ = self.env
+        for prefix, root in self._roots:
+            try:
+                rel = path.relative_to(root)
+            except ValueError:
+                continue
+            return f"{prefix}/{rel.as_posix()}"
+        return None
+
+    def get_template(self, name: str) -> Template:
+        """Return compiled template by loader name"""
+        return self.env.get_template(name)
+
+    def get_template_file(self, path: Path) -> Template:
+        """Return compiled template for file path"""
+        name = self.template_name(path)
+        if name is None:
+            LOGGER.debug("Template {} is not under the template roots, compiling from source".format(path))
+            return self.env.from_string(path.read_text(encoding="utf-8"))
+        return self.env.get_template(name)
+
+    def render_file(self, path: Path, **context: Any) -> str:
+        """Render template file"""
+        return self.get_template_file(path).render(**context)
+
+    def reset(self) -> None:
+        """Drop the environment and everything compiled with it"""
+        self._env = None
+        self._roots = []
+
+
+TEMPLATE_ENV = TAKTemplateEnvironment()
@@ -6,6 +6,7 @@ from dataclasses import dataclass
 from pathlib import Path
 
 from takrmapi.takutils.tak_pkg_helpers import TAKDataPackage
+from takrmapi.takutils.tak_pkg_catalog import TEMPLATE_CATALOG
 from takrmapi.takutils.tak_pkg_vars import TAKViteAssetVars
 
 LOGGER = logging.getLogger(__name__)
@@ -30,7 +31,7 @@ class TAKViteAsset:
     @staticmethod
     def vite_folder_exists() -> bool:
         """Return Vite Assets package path"""
-        return TAKViteAssetVars.vite_asset_default_folder.exists()
+        return TEMPLATE_CATALOG.exists(TAKViteAssetVars.vite_asset_default_folder)
 
     @staticmethod
     def get_vite_packages() -> List[TAKDataPackage]:
@@ -43,10 +44,10 @@ class TAKViteAsset:
             )
             return []
         vite_packages: List[TAKDataPackage] = []
-        for item in TAKViteAsset.get_vite_folder().iterdir():
+        for name in sorted(TEMPLATE_CATALOG.list_dir(TAKViteAsset.get_vite_folder())):
             vite_packages.append(
                 TAKDataPackage(
-                    template_path=item,
+                    template_path=TAKViteAsset.get_vite_folder() / name,
                     template_type="vite",
                 )
             )
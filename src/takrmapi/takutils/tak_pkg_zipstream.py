@@ -0,0 +1,486 @@
+"""Streaming ZIP assembly for TAK data and mission packages.
+
+Entries are written straight from the template files, rendered template strings and in-memory PKCS12 blobs
+into the output stream, no temporary folder tree is needed.
+"""
+
+from typing import Callable, Iterator, List, Optional, Set, Tuple
+import logging
+import struct
+import time
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+
+from takrmapi.takutils.tak_pkg_cache import content_etag
+from takrmapi.takutils.tak_pkg_compression import DEFAULT_POLICY, METHOD_DEFLATED, METHOD_STORED, TAKCompressionPolicy
+
+LOGGER = logging.getLogger(__name__)
+
+ZIP_CHUNK_SIZE = 64 * 1024
+ZIP_MAX_32 = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+# Timestamp of the directory and in-memory members unless set, 1980-01-01 is the earliest ZIP can store
+ZIP_DEFAULT_TIMESTAMP = 315532800.0
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_DATA_DESCRIPTOR = struct.Struct("<IIII")
+_END_OF_CENTRAL_DIR = struct.Struct("<IHHHHIIH")
+
+_SIG_LOCAL = 0x04034B50
+_SIG_CENTRAL = 0x02014B50
+_SIG_DESCRIPTOR = 0x08074B50
+_SIG_END = 0x06054B50
+
+_VERSION_NEEDED = 20
+_VERSION_MADE_BY = (3 << 8) | 20  # unix
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+
+def dos_datetime(timestamp: float) -> Tuple[int, int]:
+    """Return (time, date) in MS-DOS format for given unix timestamp"""
+    tm = time.localtime(timestamp)
+    if tm.tm_year < 1980:
+        # Earliest time ZIP can store
+        return 0, (1 << 5) | 1
+    dostime = (tm.tm_hour << 11) | (tm.tm_min << 5) | (tm.tm_sec // 2)
+    dosdate = ((tm.tm_year - 1980) << 9) | (tm.tm_mon << 5) | tm.tm_mday
+    return dostime, dosdate
+
+
+@dataclass
+class TAKZipPrecompressed:  # pylint: disable=too-many-instance-attributes
+    """Already deflated member data that can be spliced into archives as is"""
+
+    data: bytes
+    crc: int
+    file_size: int
+    method: int
+    dostime: int
+    dosdate: int
+    external_attr: int
+
+    @property
+    def compress_size(self) -> int:
+        """Size of the member data in archive"""
+        return len(self.data)
+
+
+def precompress_file(
+    src_path: Path, arcname: Optional[str] = None, policy: Optional[TAKCompressionPolicy] = None
+) -> TAKZipPrecompressed:
+    """Deflate file contents with the policy level for later splicing, stored as is if deflate does not help"""
+    policy = policy or DEFAULT_POLICY
+    stat = src_path.stat()
+    content = src_path.read_bytes()
+    method = policy.method(arcname or src_path.name, len(content))
+    compressed = content
+    if method == METHOD_DEFLATED:
+        compressor = policy.compressobj()
+        compressed = compressor.compress(content) + compressor.flush()
+        if len(compressed) >= len(content):
+            compressed, method = content, METHOD_STORED
+    dostime, dosdate = dos_datetime(stat.st_mtime)
+    return TAKZipPrecompressed(
+        data=compressed,
+        crc=policy.crc32(content),
+        file_size=len(content),
+        method=method,
+        dostime=dostime,
+        dosdate=dosdate,
+        external_attr=(stat.st_mode & 0xFFFF) << 16,
+    )
+
+
+@dataclass
+class TAKZipEntry:
+    """Single member of a package archive"""
+
+    arcname: str
+    src_path: Optional[Path] = None
+    content: Optional[bytes] = None
+    precompressed: Optional[TAKZipPrecompressed] = None
+
+    @property
+    def is_dir(self) -> bool:
+        """Directory entries end with slash"""
+        return self.arcname.endswith("/")
+
+
+@dataclass
+class _ZipRecord:  # pylint: disable=too-many-instance-attributes
+    """Central directory bookkeeping for written member"""
+
+    name: bytes
+    flags: int
+    method: int
+    dostime: int
+    dosdate: int
+    crc: int
+    compress_size: int
+    file_size: int
+    external_attr: int
+    offset: int
+
+
+@dataclass
+class _ZipWriter:
+    """Produces the raw ZIP byte stream member by member"""
+
+    policy: TAKCompressionPolicy = DEFAULT_POLICY
+    offset: int = 0
+    records: List[_ZipRecord] = field(default_factory=list)
+
+    def _emit(self, data: bytes) -> bytes:
+        """Track stream position"""
+        self.offset += len(data)
+        return data
+
+    @staticmethod
+    def _encode_name(arcname: str) -> Tuple[bytes, int]:
+        """Return encoded name and the flags it requires"""
+        try:
+            return arcname.encode("ascii"), 0
+        except UnicodeEncodeError:
+            return arcname.encode("utf-8"), _FLAG_UTF8
+
+    def _check_limits(self, *values: int) -> None:
+        """We do not write ZIP64, refuse to produce corrupted archives"""
+        if any(value > ZIP_MAX_32 for value in values) or len(self.records) >= ZIP_MAX_ENTRIES:
+            raise ValueError("Package archive would require ZIP64 which is not supported")
+
+    def _local_header(self, record: _ZipRecord) -> bytes:
+        """Local file header for record"""
+        return (
+            _LOCAL_HEADER.pack(
+                _SIG_LOCAL,
+                _VERSION_NEEDED,
+                record.flags,
+                record.method,
+                record.dostime,
+                record.dosdate,
+                record.crc,
+                record.compress_size,
+                record.file_size,
+                len(record.name),
+                0,
+            )
+            + record.name
+        )
+
+    def directory(self, arcname: str, timestamp: float) -> Iterator[bytes]:
+        """Write directory member"""
+        name, flags = self._encode_name(arcname)
+        dostime, dosdate = dos_datetime(timestamp)
+        self._check_limits(self.offset)
+        record = _ZipRecord(
+            name=name,
+            flags=flags,
+            method=METHOD_STORED,
+            dostime=dostime,
+            dosdate=dosdate,
+            crc=0,
+            compress_size=0,
+            file_size=0,
+            external_attr=(0o40775 << 16) | 0x10,
+            offset=self.offset,
+        )
+        yield self._emit(self._local_header(record))
+        self.records.append(record)
+
+    def member_bytes(self, arcname: str, content: bytes, timestamp: float, mode: int = 0o600) -> Iterator[bytes]:
+        """Write member from in-memory content, sizes are known so no data descriptor is needed"""
+        name, flags = self._encode_name(arcname)
+        dostime, dosdate = dos_datetime(timestamp)
+        method = self.policy.method(arcname, len(content))
+        compressed = content
+        if method == METHOD_DEFLATED:
+            compressor = self.policy.compressobj()
+            compressed = compressor.compress(content) + compressor.flush()
+        self._check_limits(self.offset, len(content), len(compressed))
+        record = _ZipRecord(
+            name=name,
+            flags=flags,
+            method=method,
+            dostime=dostime,
+            dosdate=dosdate,
+            crc=self.policy.crc32(content),
+            compress_size=len(compressed),
+            file_size=len(content),
+            external_attr=(0o100000 | mode) << 16,
+            offset=self.offset,
+        )
+        yield self._emit(self._local_header(record))
+        yield self._emit(compressed)
+        self.records.append(record)
+
+    def member_precompressed(self, arcname: str, member: TAKZipPrecompressed) -> Iterator[bytes]:
+        """Splice already compressed member data"""
+        name, flags = self._encode_name(arcname)
+        self._check_limits(self.offset, member.file_size, member.compress_size)
+        record = _ZipRecord(
+            name=name,
+            flags=flags,
+            method=member.method,
+            dostime=member.dostime,
+            dosdate=member.dosdate,
+            crc=member.crc,
+            compress_size=member.compress_size,
+            file_size=member.file_size,
+            external_attr=member.external_attr,
+            offset=self.offset,
+        )
+        yield self._emit(self._local_header(record))
+        yield self._emit(member.data)
+        self.records.append(record)
+
+    def member_file(self, arcname: str, src_path: Path) -> Iterator[bytes]:
+        """Write member from file, streamed in chunks"""
+        stat = src_path.stat()
+        if self.policy.method(arcname, stat.st_size) == METHOD_STORED:
+            yield from self._member_file_stored(arcname, src_path, stat.st_size)
+        else:
+            yield from self._member_file_deflated(arcname, src_path)
+
+    def _member_file_stored(self, arcname: str, src_path: Path, size: int) -> Iterator[bytes]:
+        """Stored file member, CRC is calculated in a first pass so the header has the sizes"""
+        name, flags = self._encode_name(arcname)
+        stat = src_path.stat()
+        dostime, dosdate = dos_datetime(stat.st_mtime)
+        self._check_limits(self.offset, size)
+        crc = 0
+        with src_path.open("rb") as filehandle:
+            while chunk := filehandle.read(ZIP_CHUNK_SIZE):
+                crc = self.policy.crc32(chunk, crc)
+        record = _ZipRecord(
+            name=name,
+            flags=flags,
+            method=METHOD_STORED,
+            dostime=dostime,
+            dosdate=dosdate,
+            crc=crc,
+            compress_size=size,
+            file_size=size,
+            external_attr=(stat.st_mode & 0xFFFF) << 16,
+            offset=self.offset,
+        )
+        yield self._emit(self._local_header(record))
+        written = 0
+        with src_path.open("rb") as filehandle:
+            while chunk := filehandle.read(ZIP_CHUNK_SIZE):
+                written += len(chunk)
+                yield self._emit(chunk)
+        if written != size:
+            raise ValueError("File {} changed while it was being archived".format(src_path))
+        self.records.append(record)
+
+    def _member_file_deflated(self, arcname: str, src_path: Path) -> Iterator[bytes]:
+        """Deflated file member, compressed in chunks and sizes written in the trailing data descriptor"""
+        name, flags = self._encode_name(arcname)
+        stat = src_path.stat()
+        dostime, dosdate = dos_datetime(stat.st_mtime)
+        self._check_limits(self.offset, stat.st_size)
+        record = _ZipRecord(
+            name=name,
+            flags=flags | _FLAG_DATA_DESCRIPTOR,
+            method=METHOD_DEFLATED,
+            dostime=dostime,
+            dosdate=dosdate,
+            crc=0,
+            compress_size=0,
+            file_size=0,
+            external_attr=(stat.st_mode & 0xFFFF) << 16,
+            offset=self.offset,
+        )
+        yield self._emit(self._local_header(record))
+        compressor = self.policy.compressobj()
+        with src_path.open("rb") as filehandle:
+            while chunk := filehandle.read(ZIP_CHUNK_SIZE):
+                record.crc = self.policy.crc32(chunk, record.crc)
+                record.file_size += len(chunk)
+                compressed = compressor.compress(chunk)
+                if compressed:
+                    record.compress_size += len(compressed)
+                    yield self._emit(compressed)
+        compressed = compressor.flush()
+        record.compress_size += len(compressed)
+        self._check_limits(record.file_size, record.compress_size)
+        yield self._emit(compressed)
+        yield self._emit(_DATA_DESCRIPTOR.pack(_SIG_DESCRIPTOR, record.crc, record.compress_size, record.file_size))
+        self.records.append(record)
+
+    def central_directory(self) -> bytes:
+        """Central directory and end record"""
+        cd_offset = self.offset
+        parts: List[bytes] = []
+        for record in self.records:
+            parts.append(
+                _CENTRAL_HEADER.pack(
+                    _SIG_CENTRAL,
+                    _VERSION_MADE_BY,
+                    _VERSION_NEEDED,
+                    record.flags,
+                    record.method,
+                    record.dostime,
+                    record.dosdate,
+                    record.crc,
+                    record.compress_size,
+                    record.file_size,
+                    len(record.name),
+                    0,
+                    0,
+                    0,
+                    0,
+                    record.external_attr,
+                    record.offset,
+                )
+            )
+            parts.append(record.name)
+        central = b"".join(parts)
+        self._check_limits(cd_offset, len(central))
+        end = _END_OF_CENTRAL_DIR.pack(_SIG_END, 0, 0, len(self.records), len(self.records), len(central), cd_offset, 0)
+        return self._emit(central + end)
+
+
+class TAKZipStream:
+    """ZIP archive assembled from file/bytes entries and produced as a stream of chunks"""
+
+    def __init__(self, filename: str, policy: Optional[TAKCompressionPolicy] = None) -> None:
+        self.filename: str = filename
+        self.policy: TAKCompressionPolicy = policy or DEFAULT_POLICY
+        self.entries: List[TAKZipEntry] = []
+        self.on_complete: List[Callable[[bytes], None]] = []
+        self.complete_max_bytes: Optional[int] = None
+        # Fixed so that rebuilding the same content gives the same bytes
+        self.timestamp: float = ZIP_DEFAULT_TIMESTAMP
+        self._dirs: Set[str] = set()
+
+    def _add_parents(self, arcname: str) -> None:
+        """Add directory entries for the parents like shutil.make_archive does"""
+        parents = list(PurePosixPath(arcname.rstrip("/")).parents)[:-1]
+        for parent in reversed(parents):
+            dirname = f"{parent}/"
+            if dirname not in self._dirs:
+                self._dirs.add(dirname)
+                self.entries.append(TAKZipEntry(arcname=dirname))
+
+    def add_dir(self, arcname: str) -> None:
+        """Add directory entry"""
+        dirname = arcname.rstrip("/") + "/"
+        self._add_parents(dirname)
+        if dirname not in self._dirs:
+            self._dirs.add(dirname)
+            self.entries.append(TAKZipEntry(arcname=dirname))
+
+    def add_file(self, arcname: str, src_path: Path) -> None:
+        """Add entry that is read from src_path when streamed"""
+        self._add_parents(arcname)
+        self.entries.append(TAKZipEntry(arcname=arcname, src_path=src_path))
+
+    def add_bytes(self, arcname: str, content: bytes) -> None:
+        """Add entry from in-memory content"""
+        self._add_parents(arcname)
+        self.entries.append(TAKZipEntry(arcname=arcname, content=content))
+
+    def add_precompressed(self, arcname: str, member: TAKZipPrecompressed) -> None:
+        """Add entry from already compressed member data"""
+        self._add_parents(arcname)
+        self.entries.append(TAKZipEntry(arcname=arcname, precompressed=member))
+
+    @property
+    def arcnames(self) -> List[str]:
+        """Return names of the entries in archive order"""
+        return [entry.arcname for entry in self.entries]
+
+    def _iter_pieces(self) -> Iterator[bytes]:
+        """Yield the archive as it is written, piece sizes vary"""
+        writer = _ZipWriter(policy=self.policy)
+        for entry in self.entries:
+            if entry.is_dir:
+                yield from writer.directory(entry.arcname, self.timestamp)
+            elif entry.precompressed is not None:
+                yield from writer.member_precompressed(entry.arcname, entry.precompressed)
+            elif entry.content is not None:
+                yield from writer.member_bytes(entry.arcname, entry.content, self.timestamp)
+            elif entry.src_path is not None:
+                yield from writer.member_file(entry.arcname, entry.src_path)
+            else:
+                raise ValueError("Entry '{}' has no content".format(entry.arcname))
+        yield writer.central_directory()
+
+    def iter_chunks(self, chunk_size: int = ZIP_CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the archive in chunks of roughly chunk_size bytes, on_complete callbacks get the whole archive.
+
+        The archive is only collected for the callbacks up to complete_max_bytes, bigger archives just stream.
+        """
+        collect = bool(self.on_complete)
+        produced: List[bytes] = []
+        produced_size = 0
+        buffer = bytearray()
+        for piece in self._iter_pieces():
+            buffer += piece
+            if len(buffer) < chunk_size:
+                continue
+            chunk = bytes(buffer)
+            buffer.clear()
+            if collect:
+                produced.append(chunk)
+                produced_size += len(chunk)
+                if self.complete_max_bytes is not None and produced_size > self.complete_max_bytes:
+                    LOGGER.debug(
+                        "{} is over {} bytes, not collecting it".format(self.filename, self.complete_max_bytes)
+                    )
+                    collect = False
+                    produced.clear()
+            yield chunk
+        if buffer:
+            chunk = bytes(buffer)
+            if collect:
+                produced.append(chunk)
+                produced_size += len(chunk)
+            yield chunk
+        if collect and (self.complete_max_bytes is None or produced_size <= self.complete_max_bytes):
+            data = b"".join(produced)
+            for callback in self.on_complete:
+                callback(data)
+
+    def __iter__(self) -> Iterator[bytes]:
+        """Iterating the stream yields the archive chunks"""
+        return self.iter_chunks()
+
+    def read_all(self) -> bytes:
+        """Return the whole archive as bytes"""
+        return b"".join(self.iter_chunks())
+
+    def write_to(self, path: Path) -> None:
+        """Write the archive to a file"""
+        with path.open("wb") as filehandle:
+            for chunk in self.iter_chunks():
+                filehandle.write(chunk)
+        LOGGER.debug("Wrote {} entries to {}".format(len(self.entries), path))
+
+
+class TAKZipBytesStream(TAKZipStream):
+    """Already assembled archive, for example from cache"""
+
+    def __init__(self, filename: str, data: bytes, etag: str = "") -> None:
+        super().__init__(filename=filename)
+        self.data: bytes = data
+        self._etag = etag
+
+    @property
+    def etag(self) -> str:
+        """Entity tag of the archive"""
+        if not self._etag:
+            self._etag = content_etag(self.data)
+        return self._etag
+
+    def iter_chunks(self, chunk_size: int = ZIP_CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the archive in chunks of chunk_size bytes"""
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start : start + chunk_size]
+
+    def read_all(self) -> bytes:
+        """Return the whole archive as bytes"""
+        return self.data
@@ -1,6 +1,6 @@
 """Helper functions to manage tak"""
 
-from typing import Any, Mapping, Union, cast, List, Dict
+from typing import Any, Mapping, Optional, Union, cast, List, Dict
 import logging
 import time
 import urllib.parse
@@ -10,6 +10,8 @@ import aiohttp
 from libpvarki.schemas.product import UserCRUDRequest
 
 from takrmapi.takutils.tak_helpers import UserCRUD, Helpers
+from takrmapi.takutils.tak_http_pool import tak_mtls_session
+from takrmapi.takutils.tak_pkg_executor import PKG_EXECUTOR
 from takrmapi.takutils.tak_pkg_helpers import TAKDataPackage
 
 
@@ -40,11 +42,11 @@ class RestHelpers:  # pylint: disable=too-few-public-methods
 
     async def tak_api_user_list(self) -> Mapping[str, Any]:
         """Get list of users from TAK"""
-        async with await self.helpers.tak_mtls_client() as session:
+        async with tak_mtls_session() as session:
             try:
                 url = f"{self.helpers.tak_base_url()}/user-management/api/list-users"
-                resp = await session.get(url, ssl=await self.helpers.tak_mtls_client_sslcontext())
-                data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+                async with session.get(url) as resp:
+                    data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
             except aiohttp.ClientError:
                 return {"success": False, "data": []}
         LOGGER.info("tak_api_user_list={}".format(data))
@@ -53,19 +55,19 @@ class RestHelpers:  # pylint: disable=too-few-public-methods
 
     async def tak_api_mission_get(self, groupname: str) -> Mapping[str, Any]:
         """Get mission from TAK"""
-        async with await self.helpers.tak_mtls_client() as session:
+        async with tak_mtls_session() as session:
             try:
                 url = f"{self.helpers.tak_base_url()}/Marti/api/missions/{groupname}"
 
-                resp = await session.get(url, ssl=await self.helpers.tak_mtls_client_sslcontext())
-                data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+                async with session.get(url) as resp:
+                    data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+
+                    if resp.status == 200:
+                        return {"success": True, "data": data}
 
-                if resp.status == 200:
+                    LOGGER.info("Unable to find requested mission '{}' from TAK".format(groupname))
+                    await self.output_response_to_output(resp)
                     return {"success": True, "data": data}
-
-                LOGGER.info("Unable to find requested mission '{}' from TAK".format(groupname))
-                await self.output_response_to_output(resp)
-                return {"success": True, "data": data}
             except aiohttp.ClientError as e:
                 LOGGER.exception(e)
                 return {"success": False, "data": []}
@@ -74,7 +76,7 @@ class RestHelpers:  # pylint: disable=too-few-public-methods
         """Put mission to TAK"""
 
         description_urlencoded = urllib.parse.quote(description)
-        async with await self.helpers.tak_mtls_client() as session:
+        async with tak_mtls_session() as session:
             try:
                 url = f"{self.helpers.tak_base_url()}/Marti/api/missions/\
 { groupname }?\
@@ -86,47 +88,45 @@ inviteOnly=false&\
 allowGroupChange=false"
                 headers = {"Content-Type": "application/json", "accept": "*/*"}
 
-                resp = await session.put(
-                    url, json='"string"', ssl=await self.helpers.tak_mtls_client_sslcontext(), headers=headers
-                )
-                data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
-                if resp.status == 201:
-                    return {"success": True, "data": data}
+                async with session.put(url, json='"string"', headers=headers) as resp:
+                    data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+                    if resp.status == 201:
+                        return {"success": True, "data": data}
 
-                LOGGER.info("Unable to add requested mission '{}' to TAK".format(groupname))
-                await self.output_response_to_output(resp)
-                return {"success": True, "data": data}
+                    LOGGER.info("Unable to add requested mission '{}' to TAK".format(groupname))
+                    await self.output_response_to_output(resp)
+                    return {"success": True, "data": data}
             except aiohttp.ClientError:
                 return {"success": False, "data": []}
 
     async def tak_api_mission_keywords(self, groupname: str, keywords: List[str]) -> Mapping[str, Any]:
         """Put keywords to mission"""
 
-        async with await self.helpers.tak_mtls_client() as session:
+        async with tak_mtls_session() as session:
             try:
                 url = f"{self.helpers.tak_base_url()}/Marti/api/missions/{ groupname }/keywords"
 
-                resp = await session.put(url, json=keywords, ssl=await self.helpers.tak_mtls_client_sslcontext())
-                data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+                async with session.put(url, json=keywords) as resp:
+                    data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
 
-                if resp.status == 200:
-                    return {"success": True, "data": data}
+                    if resp.status == 200:
+                        return {"success": True, "data": data}
 
-                LOGGER.info("Unable to add keywords {} to mission '{}'".format(keywords, groupname))
-                await self.output_response_to_output(resp)
-                return {"success": True, "data": data}
+                    LOGGER.info("Unable to add keywords {} to mission '{}'".format(keywords, groupname))
+                    await self.output_response_to_output(resp)
+                    return {"success": True, "data": data}
 
             except aiohttp.ClientError:
                 return {"success": False, "data": []}
 
     async def tak_api_get_device_profile(self, profile_name: str) -> Mapping[str, Any]:
         """Get device profile from TAK"""
-        async with await self.helpers.tak_mtls_client() as session:
+        async with tak_mtls_session() as session:
             try:
                 url = f"{self.helpers.tak_base_url()}/Marti/api/device/profile/{profile_name}"
 
-                resp = await session.get(url, ssl=await self.helpers.tak_mtls_client_sslcontext(), json="{}")
-                data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+                async with session.get(url, json="{}") as resp:
+                    data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
 
             except aiohttp.ClientError:
                 return {"success": False, "data": {}}
@@ -135,12 +135,12 @@ allowGroupChange=false"
 
     async def tak_api_get_device_profile_files(self, profile_name: str) -> Mapping[str, Any]:
         """Get device profile from TAK"""
-        async with await self.helpers.tak_mtls_client() as session:
+        async with tak_mtls_session() as session:
             try:
                 url = f"{self.helpers.tak_base_url()}/Marti/api/device/profile/{profile_name}/files"
 
-                resp = await session.get(url, ssl=await self.helpers.tak_mtls_client_sslcontext(), json="{}")
-                data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+                async with session.get(url, json="{}") as resp:
+                    data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
             except aiohttp.ClientError:
                 return {"success": False, "data": []}
 
@@ -149,20 +149,20 @@ allowGroupChange=false"
     async def tak_api_add_device_profile(self, profile_name: str, groups: List[str]) -> Mapping[str, Any]:
         """Add device profile to TAK"""
         group_str: str = "?group=".join(groups)
-        async with await self.helpers.tak_mtls_client() as session:
+        async with tak_mtls_session() as session:
             try:
                 # url = f"{self.helpers.tak_base_url()}/Marti/api/device/profile/{profile_name}"
                 url = f"{self.helpers.tak_base_url()}/Marti/api/device/profile/{profile_name}?group={group_str}"
 
-                resp = await session.post(url, ssl=await self.helpers.tak_mtls_client_sslcontext(), json={})
-                data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+                async with session.post(url, json={}) as resp:
+                    data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
 
-                if resp.status == 201:
-                    return {"success": True, "data": data}
+                    if resp.status == 201:
+                        return {"success": True, "data": data}
 
-                LOGGER.info("Unable to add device_profile '{}' ".format(profile_name))
-                await self.output_response_to_output(resp)
-                return {"success": True, "data": data}
+                    LOGGER.info("Unable to add device_profile '{}' ".format(profile_name))
+                    await self.output_response_to_output(resp)
+                    return {"success": True, "data": data}
 
             except aiohttp.ClientError:
                 return {"success": False, "data": []}
@@ -172,15 +172,14 @@ allowGroupChange=false"
 
         profile_info = await self.tak_api_get_device_profile(profile_name=profile_name)
 
-        async with await self.helpers.tak_mtls_client() as session:
+        async with tak_mtls_session() as session:
             try:
                 url = f"{self.helpers.tak_base_url()}/Marti/api/device/profile/{profile_name}"
 
                 updated_time = int(time.time())
 
-                resp = await session.put(
+                async with session.put(
                     url,
-                    ssl=await self.helpers.tak_mtls_client_sslcontext(),
                     json={
                         "id": profile_info["data"]["data"]["id"],
                         "name": profile_name,
@@ -192,15 +191,15 @@ allowGroupChange=false"
                         "updated": f"{updated_time}",
                         "groups": profile_vars["groups"],
                     },
-                )
-                data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+                ) as resp:
+                    data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
 
-                if resp.status == 200:
-                    return {"success": True, "data": data}
+                    if resp.status == 200:
+                        return {"success": True, "data": data}
 
-                LOGGER.info("Unable to update device_profile '{}' ".format(profile_name))
-                await self.output_response_to_output(resp)
-                return {"success": True, "data": data}
+                    LOGGER.info("Unable to update device_profile '{}' ".format(profile_name))
+                    await self.output_response_to_output(resp)
+                    return {"success": True, "data": data}
 
             except aiohttp.ClientError:
                 return {"success": False, "data": []}
@@ -226,42 +225,39 @@ allowGroupChange=false"
                     return True
         return False
 
-    async def tak_api_upload_file_to_profile(self, profile_name: str, datapackage: TAKDataPackage) -> Mapping[str, Any]:
-        """Add file to device profile at TAK"""
+    async def tak_api_upload_file_to_profile(
+        self, profile_name: str, datapackage: TAKDataPackage, profile_files: Optional[Mapping[str, Any]] = None
+    ) -> Mapping[str, Any]:
+        """Add file to device profile at TAK, pass profile_files when uploading many to avoid refetching it"""
 
-        profile_files = await self.tak_api_get_device_profile_files(
-            profile_name=profile_name,
-        )
+        if profile_files is None:
+            profile_files = await self.tak_api_get_device_profile_files(
+                profile_name=profile_name,
+            )
 
         if await self.check_file_in_profile_files(datapackage=datapackage, tak_profile_files=profile_files):
             return {"success": True, "data": profile_files["data"]}
 
-        async with await self.helpers.tak_mtls_client() as session:
+        async with tak_mtls_session() as session:
             try:
 
                 url = f"{self.helpers.tak_base_url()}\
 /Marti/api/device/profile/{profile_name}/file?filename={datapackage.package_upload_dst_fname}"
 
                 if datapackage.is_template_file:
-                    resp = await session.put(
-                        url,
-                        ssl=await self.helpers.tak_mtls_client_sslcontext(),
-                        data=datapackage.template_str.encode(encoding="utf-8"),
-                    )
-                    data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+                    payload = datapackage.template_str.encode(encoding="utf-8")
                 else:
-                    with open(datapackage.package_upload_src_file, "rb") as f:
-                        resp = await session.put(
-                            url, ssl=await self.helpers.tak_mtls_client_sslcontext(), data=f.read()
-                        )
-                        data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+                    payload = await PKG_EXECUTOR.run(datapackage.package_upload_src_file.read_bytes)
 
-                if resp.status == 200:
-                    return {"success": True, "data": data}
+                async with session.put(url, data=payload) as resp:
+                    data = cast(Mapping[str, Union[Any, Mapping[str, Any]]], await resp.json(content_type=None))
+
+                    if resp.status == 200:
+                        return {"success": True, "data": data}
 
-                LOGGER.info("Unable to add device_profile '{}' ".format(datapackage.package_upload_dst_fname))
-                await self.output_response_to_output(resp)
-                return {"success": True, "data": data}
+                    LOGGER.info("Unable to add device_profile '{}' ".format(datapackage.package_upload_dst_fname))
+                    await self.output_response_to_output(resp)
+                    return {"success": True, "data": data}
 
             except aiohttp.ClientError:
                 return {"success": False, "data": []}
@@ -0,0 +1,241 @@
+"""Coalescing queue for the TAK user management scripts.
+
+enable_user.sh, enable_admin.sh and delete_user.sh come with the TAK server image and take a single cert name
+per run. Operations arriving within a short window are collected into a batch that runs as parallel jobs of a
+single shell invocation, so a burst of enrollments pays one shell start-up instead of one per cert name. Every
+job has its own timeout and exit code, each caller gets the result of its own cert name.
+
+Batches do not wait for each other. Operations on the same cert name are kept in order: a cert name is in at most
+one running batch, later operations for it wait for the next batch. A request that duplicates a pending operation
+shares its result instead of running again.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set
+import asyncio
+import logging
+import re
+import shlex
+import time
+import weakref
+from dataclasses import dataclass, field
+
+from libpvarki.shell import call_cmd
+
+from takrmapi import config
+
+LOGGER = logging.getLogger(__name__)
+RESULT_MARKER = "takrmapi-script-result"
+_RESULT_RE = re.compile(rf"^{RESULT_MARKER} (\d+) (\d+)$", re.MULTILINE)
+# Seconds the batch shell gets on top of the per job timeout, covers the kill grace period of timeout(1)
+BATCH_TIMEOUT_GRACE = 2.0
+
+
+@dataclass
+class TAKScriptOperation:
+    """Single script run for single cert name"""
+
+    script: str
+    env_name: str
+    certname: str
+    future: "asyncio.Future[bool]"
+    queued_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def command(self) -> str:
+        """Shell command of the operation, script output goes to stderr so stdout only has the result markers"""
+        return f"$TAK_SCRIPT_TIMEOUT env {self.env_name}={shlex.quote(self.certname)} {shlex.quote(self.script)} 1>&2"
+
+
+def batch_command(operations: Sequence[TAKScriptOperation], timeout: float) -> str:
+    """Shell script running the operations as parallel jobs with timeout and printing the exit code of each"""
+    lines = [
+        # Without timeout(1) the jobs are only bounded by the timeout of the whole batch
+        "if command -v timeout >/dev/null 2>&1; then "
+        f"TAK_SCRIPT_TIMEOUT='timeout -k 1 {timeout:g}'; else TAK_SCRIPT_TIMEOUT=''; fi"
+    ]
+    lines += [f'( {operation.command}; echo "{RESULT_MARKER} {idx} $?" ) &' for idx, operation in enumerate(operations)]
+    lines.append("wait")
+    return "\n".join(lines)
+
+
+def parse_batch_output(stdout: str, count: int) -> List[bool]:
+    """Per operation success from batch output, missing markers are failures"""
+    results = [False] * count
+    for idx, code in _RESULT_RE.findall(stdout):
+        if int(idx) < count:
+            results[int(idx)] = int(code) == 0
+    return results
+
+
+@dataclass
+class TAKScriptWorker:
+    """Queue state of single event loop"""
+
+    wakeup: asyncio.Event = field(default_factory=asyncio.Event)
+    pending: List[TAKScriptOperation] = field(default_factory=list)
+    running: Set[str] = field(default_factory=set)
+    batches: Set["asyncio.Task[None]"] = field(default_factory=set)
+    task: Optional["asyncio.Task[None]"] = None
+
+
+class TAKScriptQueue:  # pylint: disable=too-many-instance-attributes
+    """Collects script operations and runs them in batches"""
+
+    def __init__(self, folder: Path, window: float, max_batch: int, timeout: float) -> None:
+        self.folder = folder
+        self.window = window
+        self.max_batch = max(max_batch, 1)
+        self.timeout = timeout
+        self.batches = 0
+        self.operations = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.batch_size_max = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self._workers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, TAKScriptWorker]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _get_worker(self) -> TAKScriptWorker:
+        """Return the worker of the running loop, start it if needed"""
+        loop = asyncio.get_running_loop()
+        worker = self._workers.get(loop)
+        if worker is None:
+            worker = TAKScriptWorker()
+            self._workers[loop] = worker
+        if worker.task is None or worker.task.done():
+            worker.task = asyncio.create_task(self._run(worker), name="tak-script-queue")
+        return worker
+
+    async def submit(self, script: str, env_name: str, certname: str) -> bool:
+        """Queue script run for the cert name and wait for the result"""
+        script_path = str(self.folder / script)
+        worker = self._get_worker()
+        for operation in reversed(worker.pending):
+            if operation.certname != certname:
+                continue
+            if operation.script == script_path:
+                # Same operation is already waiting for its turn
+                self.coalesced += 1
+                return await asyncio.shield(operation.future)
+            break
+
+        operation = TAKScriptOperation(
+            script=script_path,
+            env_name=env_name,
+            certname=certname,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        worker.pending.append(operation)
+        worker.wakeup.set()
+        # Shielded so that a cancelled request does not leave TAK half updated
+        return await asyncio.shield(operation.future)
+
+    def _take_batch(self, worker: TAKScriptWorker) -> List[TAKScriptOperation]:
+        """Remove the next batch from pending, at most one operation per cert name and none for running ones"""
+        batch: List[TAKScriptOperation] = []
+        blocked = set(worker.running)
+        for operation in worker.pending:
+            if len(batch) >= self.max_batch:
+                break
+            if operation.certname in blocked:
+                continue
+            blocked.add(operation.certname)
+            batch.append(operation)
+        for operation in batch:
+            worker.pending.remove(operation)
+            worker.running.add(operation.certname)
+        return batch
+
+    async def _run(self, worker: TAKScriptWorker) -> None:
+        """Collect pending operations for the window and start the batches"""
+        while True:
+            await worker.wakeup.wait()
+            worker.wakeup.clear()
+            if len(worker.pending) < self.max_batch:
+                await asyncio.sleep(self.window)
+            while batch := self._take_batch(worker):
+                task = asyncio.create_task(self._run_batch(worker, batch), name="tak-script-batch")
+                worker.batches.add(task)
+                task.add_done_callback(worker.batches.discard)
+
+    async def _run_batch(self, worker: TAKScriptWorker, batch: List[TAKScriptOperation]) -> None:
+        """Run the operations and resolve their futures"""
+        results = [False] * len(batch)
+        try:
+            code, stdout, stderr = await call_cmd(
+                batch_command(batch, self.timeout), timeout=self.timeout + BATCH_TIMEOUT_GRACE, stderr_warn=False
+            )
+            results = parse_batch_output(stdout, len(batch))
+            if code != 0 or not all(results):
+                failed = [operation.certname for operation, success in zip(batch, results) if not success]
+                LOGGER.warning("TAK script failed for {}, stderr: {}".format(", ".join(failed), stderr))
+        except asyncio.TimeoutError:
+            LOGGER.error("TAK script batch of {} timed out".format(len(batch)))
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            LOGGER.exception(err)
+        finally:
+            for operation in batch:
+                worker.running.discard(operation.certname)
+            if worker.pending:
+                # Operations held back by this batch
+                worker.wakeup.set()
+
+        now = time.monotonic()
+        self.batches += 1
+        self.operations += len(batch)
+        self.batch_size_max = max(self.batch_size_max, len(batch))
+        for operation, success in zip(batch, results):
+            latency = now - operation.queued_at
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            if not success:
+                self.failures += 1
+            if not operation.future.done():
+                operation.future.set_result(success)
+        LOGGER.debug("TAK script batch of {} done ({})".format(len(batch), self.stats))
+
+    async def shutdown(self) -> None:
+        """Stop the worker of the running loop, running batches are waited for and pending operations fail"""
+        worker = self._workers.pop(asyncio.get_running_loop(), None)
+        if worker is None:
+            return
+        if worker.task is not None:
+            worker.task.cancel()
+            await asyncio.gather(worker.task, return_exceptions=True)
+        await asyncio.gather(*worker.batches, return_exceptions=True)
+        for operation in worker.pending:
+            if not operation.future.done():
+                operation.future.set_result(False)
+        worker.pending.clear()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Queue counters, latency is seconds from submit to result"""
+        return {
+            "batches": self.batches,
+            "operations": self.operations,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "pending": sum(len(worker.pending) for worker in self._workers.values()),
+            "batch_size_avg": self.operations / self.batches if self.batches else 0.0,
+            "batch_size_max": self.batch_size_max,
+            "latency_avg": self.latency_total / self.operations if self.operations else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+
+SCRIPT_QUEUE = TAKScriptQueue(
+    folder=config.TAK_SCRIPTS_FOLDER,
+    window=config.TAK_SCRIPTS_COALESCE_WINDOW,
+    max_batch=config.TAK_SCRIPTS_MAX_BATCH,
+    timeout=config.TAK_SCRIPTS_TIMEOUT,
+)
+
+
+async def run_tak_script(script: str, env_name: str, certnames: Sequence[str]) -> bool:
+    """Run the script for all the cert names through the queue, True if all succeeded"""
+    results = await asyncio.gather(*[SCRIPT_QUEUE.submit(script, env_name, certname) for certname in certnames])
+    return all(results)
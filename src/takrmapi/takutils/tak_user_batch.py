@@ -0,0 +1,107 @@
+"""Provision many users at once.
+
+Every user goes through key generation, CSR signing at RASENMAEHER and TAK enablement. The users run
+concurrently and each stage has its own cap, so while some users wait for the signing others generate keys
+or get enabled in TAK.
+"""
+
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, TypeVar
+import asyncio
+import logging
+import time
+import weakref
+from dataclasses import dataclass
+
+from libpvarki.schemas.product import UserCRUDRequest
+
+from takrmapi import config
+from takrmapi.takutils.tak_helpers import UserCRUD
+
+LOGGER = logging.getLogger(__name__)
+T = TypeVar("T")  # pylint: disable=invalid-name
+
+STAGE_KEYGEN = "keygen"
+STAGE_SIGN = "sign"
+STAGE_ENABLE = "enable"
+
+
+@dataclass
+class TAKUserProvisionResult:
+    """Outcome for single user"""
+
+    uuid: str
+    callsign: str
+    success: bool = False
+    failed_stage: Optional[str] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+
+class TAKUserProvisioner:  # pylint: disable=too-few-public-methods
+    """Runs the provisioning stages for a batch of users with per stage concurrency caps"""
+
+    def __init__(self, keygen_concurrency: int, sign_concurrency: int, enable_concurrency: int) -> None:
+        self.limits = {
+            STAGE_KEYGEN: keygen_concurrency,
+            STAGE_SIGN: sign_concurrency,
+            STAGE_ENABLE: enable_concurrency,
+        }
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _get_semaphores(self) -> Dict[str, asyncio.Semaphore]:
+        """Stage semaphores are shared by all batches and bound to event loop"""
+        loop = asyncio.get_running_loop()
+        semaphores = self._semaphores.get(loop)
+        if semaphores is None:
+            semaphores = {stage: asyncio.Semaphore(max(limit, 1)) for stage, limit in self.limits.items()}
+            self._semaphores[loop] = semaphores
+        return semaphores
+
+    async def provision(self, users: Sequence[UserCRUDRequest]) -> List[TAKUserProvisionResult]:
+        """Provision the users, results are in the same order as the users"""
+        semaphores = self._get_semaphores()
+        start = time.monotonic()
+        results = await asyncio.gather(*[self._provision_user(user, semaphores) for user in users])
+        LOGGER.info(
+            "Provisioned {}/{} users in {:.1f}s".format(
+                sum(1 for result in results if result.success), len(results), time.monotonic() - start
+            )
+        )
+        return list(results)
+
+    async def _provision_user(
+        self, user: UserCRUDRequest, semaphores: Dict[str, asyncio.Semaphore]
+    ) -> TAKUserProvisionResult:
+        """Run the stages for single user, stop at first failure"""
+        result = TAKUserProvisionResult(uuid=user.uuid, callsign=user.callsign)
+        localuser = UserCRUD(user)
+        start = time.monotonic()
+
+        async def stage(name: str, func: Callable[[], Awaitable[T]]) -> T:
+            """Run stage under its semaphore, record the stage on failure"""
+            result.failed_stage = name
+            async with semaphores[name]:
+                return await func()
+
+        try:
+            csrpem = await stage(STAGE_KEYGEN, localuser.create_keypair_and_csr)
+            await stage(STAGE_SIGN, lambda: localuser.sign_csr(csrpem))
+            if await stage(STAGE_ENABLE, localuser.helpers.add_user_to_tak_with_cert):
+                result.success = True
+                result.failed_stage = None
+            else:
+                result.error = "TAK enablement failed"
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            LOGGER.exception("Provisioning '{}' failed at {}".format(user.callsign, result.failed_stage))
+            result.error = str(exc) or exc.__class__.__name__
+        result.elapsed = time.monotonic() - start
+        return result
+
+
+USER_PROVISIONER = TAKUserProvisioner(
+    keygen_concurrency=config.TAK_BATCH_KEYGEN_CONCURRENCY,
+    sign_concurrency=config.TAK_BATCH_SIGN_CONCURRENCY,
+    enable_concurrency=config.TAK_BATCH_ENABLE_CONCURRENCY,
+)
@@ -1,15 +1,28 @@
 """pytest automagics"""
 
-from typing import Generator, Dict
+from typing import Any, Generator, Dict, List, Tuple
+import datetime
 import logging
 import os
 import uuid
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
 
 from libpvarki.logging import init_logging
+from libpvarki.schemas.product import UserCRUDRequest
 import pytest
 from fastapi.testclient import TestClient
 
+from takrmapi import config
 from takrmapi.app import get_app
+from takrmapi.takutils import tak_pkg_pkcs12
+from takrmapi.takutils.tak_helpers import UserCRUD
+from takrmapi.takutils.tak_pkg_cache import PACKAGE_CACHE
+from takrmapi.takutils.tak_pkg_pkcs12 import CA_BUNDLE, USER_PKCS12_CACHE
 
 # Default is "ecs" and it's not great for tests
 os.environ["LOG_CONSOLE_FORMATTER"] = "local"
@@ -39,3 +52,54 @@ def create_user_dict(callsign: str) -> Dict[str, str]:
 def norppa11() -> Dict[str, str]:
     """Session scoped user dict (to keep same UUID)"""
     return create_user_dict("NORPPA11a")
+
+
+def self_signed_pem(common_name: str) -> Tuple[bytes, bytes]:
+    """Return (cert, key) PEMs of throwaway self-signed identity"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return (
+        cert.public_bytes(serialization.Encoding.PEM),
+        key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()),
+    )
+
+
+@pytest.fixture
+def pkcs12_calls(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Generator[List[str], None, None]:
+    """Persistent folder under tmp_path and fake PKCS12 conversion, yields the names PKCS12 files were made for"""
+    monkeypatch.setattr(config, "RMAPI_PERSISTENT_FOLDER", tmp_path)
+    calls: List[str] = []
+
+    def fake_pkcs12(*args: Any) -> bytes:
+        """Record the calls"""
+        calls.append(args[-1])
+        return f"p12-{args[-1]}".encode("utf-8")
+
+    monkeypatch.setattr(tak_pkg_pkcs12, "convert_pem_to_pkcs12", fake_pkcs12)
+    monkeypatch.setattr(CA_BUNDLE, "get", lambda: fake_pkcs12("ca-chains"))
+    monkeypatch.setattr(PACKAGE_CACHE, "shared_folder", tmp_path / "private" / "package_cache")
+    PACKAGE_CACHE.clear()
+    USER_PKCS12_CACHE.clear()
+    yield calls
+    PACKAGE_CACHE.clear()
+    USER_PKCS12_CACHE.clear()
+
+
+def package_user(request: UserCRUDRequest) -> UserCRUD:
+    """Return user with placeholder cert and key files in the persistent folder"""
+    user = UserCRUD(request)
+    user.userdata.mkdir(parents=True)
+    user.certpath.write_text("cert", encoding="utf-8")
+    user.keypath.write_text("key", encoding="utf-8")
+    return user
@@ -0,0 +1,163 @@
+"""Test the package response helpers"""
+
+from pathlib import Path
+from typing import List
+import base64
+import json
+import os
+
+import pytest
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from takrmapi.api.package_responses import (
+    conditional_response,
+    file_etag,
+    iter_base64,
+    iter_client_zips_json,
+    package_download_response,
+    parse_range,
+)
+from takrmapi.api.schemas import ClientInstructionData, ClientInstructionResponse, TakZipFile
+from takrmapi.takutils.tak_pkg_cache import content_etag
+from takrmapi.takutils.tak_pkg_zipstream import ZIP_CHUNK_SIZE, TAKZipBytesStream, TAKZipStream
+
+
+def test_iter_base64_alignment() -> None:
+    """Check that chunked encoding matches encoding the whole data"""
+    data = os.urandom(1000)
+    for size in (1, 2, 3, 7, 64, 1000):
+        chunks = [data[start : start + size] for start in range(0, len(data), size)]
+        assert b"".join(iter_base64(chunks)) == base64.b64encode(data)
+    assert not list(iter_base64([]))
+
+
+def test_client_zips_json_matches_model() -> None:
+    """Check that streamed JSON is identical to the pydantic response"""
+    zstream = TAKZipStream(filename="localmaeher_atak.zip")
+    zstream.add_bytes("server.pref", os.urandom(100000))
+    cached = TAKZipBytesStream(filename="localmaeher_itak.zip", data=os.urandom(70001))
+    zips = [
+        ("localmaeher_atak.zip", "NÄÄTÄ01_localmaeher_atak.zip", zstream),
+        ("localmaeher_itak.zip", "NÄÄTÄ01_localmaeher_itak.zip", cached),
+    ]
+
+    streamed = b"".join(iter_client_zips_json(zips))
+
+    expected = ClientInstructionResponse(
+        data=ClientInstructionData(
+            tak_zips=[
+                TakZipFile(
+                    title=title,
+                    filename=filename,
+                    data=f"data:application/zip;base64,{base64.b64encode(archive.read_all()).decode('ascii')}",
+                )
+                for title, filename, archive in zips
+            ]
+        )
+    )
+    assert json.loads(streamed) == json.loads(expected.json())
+    assert streamed == json.dumps(json.loads(expected.json()), ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+
+
+def make_request(**headers: str) -> Request:
+    """Return GET request with given headers"""
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "headers": [
+                (name.replace("_", "-").encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()
+            ],
+        }
+    )
+
+
+def test_parse_range() -> None:
+    """Check single byte range parsing"""
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("bytes=9-0", 100) is None
+    assert parse_range("items=0-9", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=100-", 100)
+
+
+def test_conditional_response() -> None:
+    """Check ETag, If-None-Match and Range handling"""
+    data = os.urandom(1000)
+    full = conditional_response(make_request(), data)
+    etag = full.headers["etag"]
+    assert full.status_code == 200 and full.body == data
+    assert full.headers["accept-ranges"] == "bytes"
+
+    assert conditional_response(make_request(if_none_match=f'"other", {etag}'), data).status_code == 304
+
+    partial = conditional_response(make_request(range="bytes=100-"), data)
+    assert partial.status_code == 206
+    assert partial.body == data[100:]
+    assert partial.headers["content-range"] == "bytes 100-999/1000"
+
+    assert conditional_response(make_request(range="bytes=0-9", if_range=etag), data).status_code == 206
+    assert conditional_response(make_request(range="bytes=0-9", if_range='"old"'), data).status_code == 200
+    unsatisfiable = conditional_response(make_request(range="bytes=1000-"), data)
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == "bytes */1000"
+
+
+@pytest.mark.asyncio
+async def test_download_response_cacheable_builds() -> None:
+    """Check that cacheable builds are completed into the cache and the first response has ETag and Range"""
+    zstream = TAKZipStream(filename="localmaeher_atak.zip")
+    zstream.add_bytes("server.pref", os.urandom(1000))
+    completed: List[bytes] = []
+    zstream.on_complete.append(completed.append)
+    partial = await package_download_response(make_request(range="bytes=0-9"), zstream)
+    assert len(completed) == 1
+    assert partial.status_code == 206
+    assert partial.body == completed[0][:10]
+    assert partial.headers["etag"] == TAKZipBytesStream(filename=zstream.filename, data=completed[0]).etag
+
+    cached = TAKZipBytesStream(filename="localmaeher_atak.zip", data=completed[0])
+    resumed = await package_download_response(make_request(range="bytes=10-", if_range=partial.headers["etag"]), cached)
+    assert resumed.status_code == 206
+    assert bytes(partial.body) + bytes(resumed.body) == completed[0]
+
+
+@pytest.mark.asyncio
+async def test_download_response_streams_uncached_builds() -> None:
+    """Check that builds that are not cached, or do not fit in the cache, are streamed"""
+    zstream = TAKZipStream(filename="localmaeher_atak.zip")
+    zstream.add_bytes("server.pref", os.urandom(1000))
+    streamed = await package_download_response(make_request(range="bytes=0-9"), zstream)
+    assert isinstance(streamed, StreamingResponse)
+    assert "etag" not in streamed.headers
+
+    big = TAKZipStream(filename="localmaeher_itak.zip")
+    big.add_bytes("big.bin", os.urandom(3 * ZIP_CHUNK_SIZE))
+    completed: List[bytes] = []
+    big.on_complete.append(completed.append)
+    big.complete_max_bytes = ZIP_CHUNK_SIZE
+    streamed = await package_download_response(make_request(), big)
+    assert isinstance(streamed, StreamingResponse)
+    assert b"".join([chunk async for chunk in streamed.body_iterator]) == big.read_all()  # type: ignore[misc]
+    assert not completed
+
+
+def test_file_etag(tmp_path: Path) -> None:
+    """Check that static files get the content hash ETag and it follows content changes"""
+    path = tmp_path / "Google_Hybrid.xml"
+    path.write_bytes(b"<customMapSource/>")
+    stat, etag = file_etag(path)
+    assert stat.st_size == path.stat().st_size
+    assert etag == content_etag(b"<customMapSource/>")
+    assert file_etag(path)[1] == etag
+
+    path.write_bytes(b"<customMapSource>changed</customMapSource>")
+    assert file_etag(path)[1] == content_etag(b"<customMapSource>changed</customMapSource>")
@@ -0,0 +1,53 @@
+"""Test the credential store"""
+
+from pathlib import Path
+
+import pytest
+
+from takrmapi.takutils.tak_credentials import TAKCredentialStore
+
+from .conftest import self_signed_pem
+
+
+def cert_pem(callsign: str) -> str:
+    """Throwaway self-signed cert"""
+    return self_signed_pem(callsign)[0].decode("utf-8")
+
+
+def test_materialize_and_parse_once(tmp_path: Path) -> None:
+    """Check that unchanged content is not rewritten or reparsed"""
+    store = TAKCredentialStore()
+    target = tmp_path / "certs" / "NORPPA11a.pem"
+    pem = cert_pem("NORPPA11a")
+
+    assert store.materialize(target, pem)
+    inode = target.stat().st_ino
+    for _ in range(5):
+        assert not store.materialize(target, pem)
+        cert = store.certificate(target)
+    assert target.stat().st_ino == inode
+    assert store.stats["writes"] == 1
+    assert store.stats["parses"] == 1
+    assert not cert.expired
+    assert len(cert.fingerprint) == 64
+    assert not list(target.parent.glob(".*"))
+
+    # New content is written atomically and reparsed
+    assert store.materialize(target, cert_pem("NORPPA11a"))
+    assert store.certificate(target).fingerprint != cert.fingerprint
+    assert store.stats["parses"] == 2
+
+    # Deleted behind the store's back
+    target.unlink()
+    assert store.materialize(target, pem)
+    assert store.certificate(target).fingerprint == cert.fingerprint
+
+
+def test_invalid_and_missing(tmp_path: Path) -> None:
+    """Check the errors"""
+    store = TAKCredentialStore()
+    with pytest.raises(FileNotFoundError):
+        store.load(tmp_path / "missing.pem")
+    store.materialize(tmp_path / "broken.pem", "not a cert\n")
+    with pytest.raises(ValueError):
+        store.certificate(tmp_path / "broken.pem")
@@ -0,0 +1,99 @@
+"""Test the shared mTLS sessions"""
+
+from pathlib import Path
+import os
+import ssl
+
+import aiohttp
+import pytest
+
+from takrmapi import config
+from takrmapi.takutils import tak_http_pool
+from takrmapi.takutils.tak_http_pool import TAK_SSLCONTEXT, TAKClientSSLContext, TAKSessionPool, mtls_client_paths
+
+from .conftest import self_signed_pem
+
+
+@pytest.fixture
+def mtlsclient_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Write self-signed mTLS client identity"""
+    monkeypatch.setattr(config, "RMAPI_PERSISTENT_FOLDER", tmp_path)
+    certpem, keypem = self_signed_pem("mtlsclient")
+    certpath, keypath = mtls_client_paths()
+    certpath.parent.mkdir(parents=True)
+    keypath.parent.mkdir(parents=True)
+    certpath.write_bytes(certpem)
+    keypath.write_bytes(keypem)
+
+
+def touch(path: Path) -> None:
+    """Bump the mtime of the file"""
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.mark.usefixtures("mtlsclient_files")
+def test_sslcontext_reload() -> None:
+    """Check that the context is loaded once and reloaded when the key material changes"""
+    context = TAKClientSSLContext(recheck_interval=0.0)
+    first = context.get()
+    assert context.get() is first
+    assert context.loads == 1
+
+    touch(mtls_client_paths()[1])
+    assert context.get() is not first
+    assert context.loads == 2
+
+    slow = TAKClientSSLContext(recheck_interval=3600.0)
+    cached = slow.get()
+    touch(mtls_client_paths()[0])
+    assert slow.get() is cached
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mtlsclient_files")
+async def test_session_replaced_on_rotation(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that the TAK session is re-created when the client cert is replaced"""
+    monkeypatch.setattr(TAK_SSLCONTEXT, "recheck_interval", 0.0)
+    monkeypatch.setattr(config, "TAK_HTTP_TIMEOUT", 0.0)
+    pool = TAKSessionPool()
+    session = pool.tak()
+    assert pool.tak() is session
+
+    touch(mtls_client_paths()[0])
+    replacement = pool.tak()
+    assert replacement is not session
+    await pool.close()
+    assert session.closed and replacement.closed
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mtlsclient_files")
+async def test_tak_session_is_shared() -> None:
+    """Check that the TAK session is re-used until closed"""
+    pool = TAKSessionPool()
+    session = pool.tak()
+    assert pool.tak() is session
+    assert session.connector is not None
+    assert session.connector.limit == config.TAK_HTTP_POOL_SIZE
+    assert session.timeout.total == config.TAK_HTTP_TIMEOUT
+
+    await pool.close()
+    assert session.closed
+    replacement = pool.tak()
+    assert replacement is not session
+    await pool.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mtlsclient_files")
+async def test_rm_session_pool(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that the RASENMAEHER session uses the configured pool and the client identity"""
+    monkeypatch.setattr(tak_http_pool, "get_ca_context", ssl.create_default_context)
+    pool = TAKSessionPool()
+    session = pool.rm()
+    assert pool.rm() is session
+    assert isinstance(session.connector, aiohttp.TCPConnector)
+    assert session.connector.limit == config.TAK_HTTP_POOL_SIZE
+    await pool.close()
+    assert session.closed
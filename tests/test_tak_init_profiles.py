@@ -0,0 +1,107 @@
+"""Test the startup profile file sync"""
+
+from typing import Any, Dict, List, Mapping, Tuple
+import asyncio
+from dataclasses import dataclass
+
+import pytest
+
+from takrmapi import config
+from takrmapi.takutils import tak_init
+
+
+@dataclass
+class FakePackage:
+    """Enough of TAKDataPackage for the sync"""
+
+    package_name: str
+    is_template_file: bool = False
+    zip_complete: bool = False
+    zip_tmp_folder: Any = None
+
+
+class FakeRest:  # pylint: disable=too-few-public-methods
+    """Records the profile file list fetches and upload concurrency"""
+
+    def __init__(self) -> None:
+        self.fetches = 0
+        self.running = 0
+        self.peak = 0
+        self.uploaded: List[str] = []
+
+    async def tak_api_get_device_profile_files(self, profile_name: str) -> Mapping[str, Any]:
+        """Fake list"""
+        _ = profile_name
+        self.fetches += 1
+        return {"success": True, "data": {"data": []}}
+
+    async def tak_api_upload_file_to_profile(
+        self, profile_name: str, datapackage: FakePackage, profile_files: Mapping[str, Any]
+    ) -> Mapping[str, Any]:
+        """Fake upload, must get the shared list"""
+        assert profile_name == "Default-ATAK" and profile_files["success"]
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.02)
+        self.running -= 1
+        self.uploaded.append(datapackage.package_name)
+        return {"success": True, "data": {}}
+
+
+class FakeHelpers:  # pylint: disable=too-few-public-methods
+    """Tmp dir cleanup"""
+
+    def __init__(self) -> None:
+        self.removed: List[Any] = []
+
+    async def remove_tmp_dir(self, dirname: Any) -> None:
+        """Record"""
+        self.removed.append(dirname)
+
+
+class FakeZip:
+    """Bundle builder"""
+
+    def __init__(self) -> None:
+        self.helpers = FakeHelpers()
+        self.rendered: List[str] = []
+
+    @staticmethod
+    def check_bundle_sources(datapackages: List[FakePackage]) -> None:
+        """All good"""
+        _ = datapackages
+
+    async def create_zip_bundle(self, datapackage: FakePackage) -> None:
+        """Fake zip"""
+        _ = self
+        await asyncio.sleep(0.01)
+        datapackage.zip_tmp_folder = f"/tmp/{datapackage.package_name}"
+        datapackage.zip_complete = True
+
+    async def render_tak_manifest_template(self, datapackage: FakePackage) -> None:
+        """Fake render"""
+        self.rendered.append(datapackage.package_name)
+
+
+@pytest.mark.asyncio
+async def test_profile_files_uploaded_concurrently(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that the profile list is fetched once and uploads run within the limit"""
+    files = [FakePackage("single.xml.tpl", is_template_file=True)]
+    bundles = [FakePackage(f"bundle{idx}") for idx in range(6)]
+
+    async def fake_missing(t_rest_helper: Any, profile_files: Mapping[str, Any]) -> Tuple[Any, Any]:
+        """Everything is missing"""
+        _ = t_rest_helper, profile_files
+        return files, bundles
+
+    monkeypatch.setattr(tak_init, "tak_missing_profile_files", fake_missing)
+    monkeypatch.setattr(config, "TAK_PROFILE_UPLOAD_CONCURRENCY", 3)
+    rest, pkgzip = FakeRest(), FakeZip()
+    fakes: Dict[str, Any] = {"t_rest_helper": rest, "tak_missionpkg": pkgzip}
+    await tak_init.tak_setup_profile_files(**fakes)
+
+    assert rest.fetches == 1
+    assert rest.peak == 3
+    assert sorted(rest.uploaded) == sorted(pkg.package_name for pkg in files + bundles)
+    assert pkgzip.rendered == ["single.xml.tpl"]
+    assert sorted(pkgzip.helpers.removed) == sorted(f"/tmp/{pkg.package_name}" for pkg in bundles)
@@ -0,0 +1,185 @@
+"""Test the background TAK initialisation"""
+
+from pathlib import Path
+from typing import Dict, Iterator, List, cast
+import asyncio
+import itertools
+import stat
+
+import pytest
+from fastapi.testclient import TestClient
+
+from takrmapi import config
+from takrmapi.takutils import tak_init
+from takrmapi.takutils.tak_rest_helpers import RestHelpers
+from takrmapi.takutils.tak_init_runner import TAK_INIT, TAKInitRunner, PHASE_FOLLOW, PHASE_READY, PHASE_MGMT_CONN
+
+from .conftest import create_user_dict
+
+
+def test_backoff_delays() -> None:
+    """Check that the delays grow exponentially up to the cap and are jittered"""
+    delays = list(itertools.islice(tak_init.backoff_delays(1.0, 8.0), 200))
+    assert all(0 <= delay <= 1.0 for delay in delays[:1])
+    assert all(0 <= delay <= 8.0 for delay in delays)
+    assert max(delays[4:]) > 4.0
+    assert len(set(delays)) > 1
+
+
+@pytest.mark.asyncio
+async def test_phases_retry_and_ready(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that failing phase is retried, waiters time out until ready and then pass"""
+    calls: Dict[str, int] = {"mgmt": 0, "defaults": 0, "load": 0}
+    release = asyncio.Event()
+
+    async def flaky_mgmt() -> None:
+        """Fail twice"""
+        calls["mgmt"] += 1
+        if calls["mgmt"] < 3:
+            raise ConnectionError("TAK not up")
+        await release.wait()
+
+    async def defaults() -> None:
+        """Fine"""
+        calls["defaults"] += 1
+
+    async def load() -> None:
+        """Fine"""
+        calls["load"] += 1
+
+    monkeypatch.setattr(tak_init, "setup_tak_mgmt_conn", flaky_mgmt)
+    monkeypatch.setattr(tak_init, "setup_tak_defaults", defaults)
+    monkeypatch.setattr(tak_init, "get_tak_defaults", load)
+
+    runner = TAKInitRunner(tmp_path / "init.lock", tmp_path / "init.sock", backoff_base=0.01, backoff_max=0.02)
+    assert not runner.started
+    assert await runner.wait_ready(0.0)
+
+    runner.start()
+    assert not await runner.wait_ready(1.0)
+    assert runner.phase == PHASE_MGMT_CONN
+    assert runner.retries == 2
+    release.set()
+    assert await runner.wait_ready(1.0)
+    assert runner.phase == PHASE_READY
+    assert calls == {"mgmt": 3, "defaults": 1, "load": 1}
+    assert runner.error is None
+    await runner.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_wait_for_tak_api(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that the API is polled with backoff until it responds"""
+    answers: Iterator[bool] = iter([False, False, True])
+    polls: List[bool] = []
+
+    class FakeRest:  # pylint: disable=too-few-public-methods
+        """Fake user list"""
+
+        async def tak_api_user_list(self) -> Dict[str, bool]:
+            """Answer from the list"""
+            _ = self
+            polls.append(True)
+            return {"success": next(answers)}
+
+    monkeypatch.setattr(config, "TAK_INIT_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(config, "TAK_INIT_BACKOFF_MAX", 0.02)
+    assert await tak_init.wait_for_tak_api(cast(RestHelpers, FakeRest()))
+    assert len(polls) == 3
+
+
+@pytest.mark.asyncio
+async def test_leader_and_followers(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that only the leader initialises and followers get the state over the socket"""
+    setups: List[str] = []
+    applied: List[Dict[str, str]] = []
+    release = asyncio.Event()
+
+    async def setup() -> None:
+        """Leader only"""
+        setups.append("setup")
+        await release.wait()
+
+    async def nothing() -> None:
+        """Fine"""
+
+    monkeypatch.setattr(tak_init, "setup_tak_mgmt_conn", setup)
+    monkeypatch.setattr(tak_init, "setup_tak_defaults", nothing)
+    monkeypatch.setattr(tak_init, "get_tak_defaults", nothing)
+    monkeypatch.setattr(tak_init, "shared_state", lambda: {"networkmesh_key": "MESHKEY"})
+    monkeypatch.setattr(tak_init, "apply_shared_state", applied.append)
+
+    def runner() -> TAKInitRunner:
+        """Worker"""
+        return TAKInitRunner(tmp_path / "init.lock", tmp_path / "init.sock", backoff_base=0.01, backoff_max=0.02)
+
+    leader, followers = runner(), [runner(), runner()]
+    leader.start()
+    await asyncio.sleep(0.05)
+    for follower in followers:
+        follower.start()
+    await asyncio.sleep(0.05)
+    assert leader.leader and not any(follower.leader for follower in followers)
+    assert [follower.phase for follower in followers] == [PHASE_FOLLOW, PHASE_FOLLOW]
+    assert stat.S_IMODE((tmp_path / "init.sock").stat().st_mode) == 0o600
+
+    release.set()
+    for worker in [leader] + followers:
+        assert await worker.wait_ready(1.0)
+    assert setups == ["setup"]
+    assert applied == [{"networkmesh_key": "MESHKEY"}] * 2
+
+    for worker in [leader] + followers:
+        await worker.shutdown()
+    assert not (tmp_path / "init.sock").exists()
+    # Lock is free again for the next leader
+    successor = runner()
+    successor.start()
+    assert await successor.wait_ready(1.0)
+    assert successor.leader
+    assert setups == ["setup", "setup"]
+    await successor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_leader_ready_without_socket(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that failing to serve the followers does not keep the leader from getting ready"""
+
+    async def nothing() -> None:
+        """Fine"""
+
+    for name in ("setup_tak_mgmt_conn", "setup_tak_defaults", "get_tak_defaults"):
+        monkeypatch.setattr(tak_init, name, nothing)
+    (tmp_path / "notadir").write_text("x", encoding="utf-8")
+    runner = TAKInitRunner(
+        tmp_path / "init.lock", tmp_path / "notadir" / "init.sock", backoff_base=0.01, backoff_max=0.02
+    )
+    runner.start()
+    assert await runner.wait_ready(1.0)
+    assert runner.leader
+    await runner.shutdown()
+    assert not runner.leader
+
+
+@pytest.mark.parametrize(
+    "method,url",
+    [
+        ("post", "/api/v1/clients/fragment"),
+        ("post", "/api/v2/clients/data"),
+        ("post", "/api/v1/tak-missionpackages/client-zip/default.zip"),
+        ("get", "/api/v1/tak-datapackages/package-list"),
+    ],
+)
+def test_mesh_key_routes_gated(method: str, url: str, mtlsclient: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that routes building packages answer 503 while the init (mesh key) is not done"""
+    monkeypatch.setattr(TAK_INIT, "_ready", asyncio.Event())
+    monkeypatch.setattr(config, "TAK_INIT_READY_TIMEOUT", 0.05)
+    user = create_user_dict("NORPPA11a")
+    if method == "post":
+        resp = mtlsclient.post(url, json=user)
+    else:
+        resp = mtlsclient.get(url)
+    assert resp.status_code == 503
+    assert "Retry-After" in resp.headers
+    # Public routes do not wait
+    assert mtlsclient.get("/api/v1/description/fi").status_code == 200
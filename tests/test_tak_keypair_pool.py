@@ -0,0 +1,75 @@
+"""Test the keypair pool"""
+
+from pathlib import Path
+import asyncio
+import stat
+
+import pytest
+
+from takrmapi.takutils.tak_keypair_pool import TAKKeypairPool
+
+
+@pytest.mark.asyncio
+async def test_pool_fill_and_take(tmp_path: Path) -> None:
+    """Check that the pool fills to high watermark with private files and keys are handed out once"""
+    pool = TAKKeypairPool(tmp_path / "keypool", low=2, high=3, idle=0.0)
+    pool.start()
+    for _ in range(200):
+        if pool.size >= 3:
+            break
+        await asyncio.sleep(0.05)
+    await pool.shutdown()
+    assert pool.size == 3
+    assert stat.S_IMODE(pool.folder.stat().st_mode) == 0o700
+    assert all(stat.S_IMODE(path.stat().st_mode) == 0o600 for path in pool.folder.iterdir())
+    assert not list(pool.folder.glob(".*"))
+
+    userdir = tmp_path / "user"
+    userdir.mkdir()
+    key = await pool.take(userdir / "first.key", userdir / "first.pub")
+    assert key is not None
+    assert (userdir / "first.key").exists() and (userdir / "first.pub").exists()
+    # Above low watermark, no refill yet
+    assert pool.size == 2
+    await pool.take(userdir / "second.key", userdir / "second.pub")
+    await pool.shutdown()
+    assert pool.stats["taken"] == 2
+    assert (userdir / "first.key").read_bytes() != (userdir / "second.key").read_bytes()
+
+
+@pytest.mark.asyncio
+async def test_pool_disabled_and_empty(tmp_path: Path) -> None:
+    """Check that disabled or empty pool returns None"""
+    disabled = TAKKeypairPool(tmp_path / "disabled", low=2, high=0, idle=0.0)
+    assert await disabled.take(tmp_path / "a.key", tmp_path / "a.pub") is None
+    assert not disabled.folder.exists()
+
+    empty = TAKKeypairPool(tmp_path / "empty", low=1, high=1, idle=10.0)
+    assert await empty.take(tmp_path / "b.key", tmp_path / "b.pub") is None
+    assert empty.stats["misses"] == 1
+    # The refill waits for the idle period so nothing gets generated during the burst
+    await asyncio.sleep(0.1)
+    assert empty.size == 0
+    await empty.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_take_rolls_back_half_claim(tmp_path: Path) -> None:
+    """Check that a failed public key move puts the private key back and the take falls back to None"""
+    pool = TAKKeypairPool(tmp_path / "keypool", low=0, high=1, idle=10.0)
+    pool.folder.mkdir()
+    (pool.folder / "pooled.key").write_text("key", encoding="utf-8")
+    (pool.folder / "pooled.pub").write_text("pub", encoding="utf-8")
+
+    # Target folder missing, the .key rename fails before anything moves
+    assert await pool.take(tmp_path / "missing" / "a.key", tmp_path / "missing" / "a.pub") is None
+    # .pub target is a directory, the .key has already moved and has to go back
+    userdir = tmp_path / "user"
+    userdir.mkdir()
+    (userdir / "b.pub").mkdir()
+    (userdir / "b.pub" / "occupied").touch()
+    assert await pool.take(userdir / "b.key", userdir / "b.pub") is None
+    await pool.shutdown()
+    assert sorted(path.name for path in pool.folder.iterdir()) == ["pooled.key", "pooled.pub"]
+    assert not (userdir / "b.key").exists()
+    assert pool.stats["misses"] == 2
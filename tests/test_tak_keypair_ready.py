@@ -0,0 +1,135 @@
+"""Test the keypair readiness waits"""
+
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+from libpvarki.schemas.product import UserCRUDRequest
+
+from takrmapi import config
+from takrmapi.takutils import tak_helpers
+from takrmapi.takutils.tak_keypair_ready import KEYPAIR_READY, TAKKeypairReadiness
+
+
+@pytest.mark.asyncio
+async def test_notify_wakes_waiter(tmp_path: Path) -> None:
+    """Check that notify wakes the waiter right away instead of the next poll"""
+    readiness = TAKKeypairReadiness(tmp_path, poll_interval=10.0)
+    userdata = tmp_path / "user1"
+    userdata.mkdir()
+    paths = (userdata / "USER1.pem", userdata / "USER1.key")
+
+    async def write_later() -> None:
+        """Write the keypair and signal"""
+        await asyncio.sleep(0.05)
+        for path in paths:
+            path.write_text("x", encoding="utf-8")
+        readiness.notify(userdata)
+
+    start = time.monotonic()
+    await asyncio.gather(readiness.wait(userdata, paths), readiness.wait(userdata, paths), write_later())
+    assert time.monotonic() - start < 1.0
+    # Waiter registry is cleaned up
+    assert not readiness._waiters  # pylint: disable=protected-access
+    # Existing files return immediately
+    await asyncio.wait_for(readiness.wait(userdata, paths), timeout=0.1)
+
+
+@pytest.mark.asyncio
+async def test_poll_fallback(tmp_path: Path) -> None:
+    """Check that files written without notify are found by polling"""
+    readiness = TAKKeypairReadiness(tmp_path, poll_interval=0.02)
+    userdata = tmp_path / "user2"
+    userdata.mkdir()
+    path = userdata / "USER2.pem"
+    waiter = asyncio.create_task(readiness.wait(userdata, (path,)))
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+    path.write_text("x", encoding="utf-8")
+    await asyncio.wait_for(waiter, timeout=1.0)
+
+
+@pytest.mark.asyncio
+async def test_watcher_wakes_waiter(tmp_path: Path) -> None:
+    """Check that watching is set only once inotify is armed and writes without notify wake the waiter"""
+    readiness = TAKKeypairReadiness(tmp_path, poll_interval=10.0)
+    watcher = asyncio.create_task(readiness.watch())
+    try:
+        await asyncio.sleep(0)
+        assert not readiness.watching
+        for _ in range(100):
+            if readiness.watching:
+                break
+            await asyncio.sleep(0.05)
+        assert readiness.watching
+
+        userdata = tmp_path / "user3"
+        userdata.mkdir()
+        path = userdata / "USER3.pem"
+        waiter = asyncio.create_task(readiness.wait(userdata, (path,)))
+        await asyncio.sleep(0.05)
+        path.write_text("x", encoding="utf-8")
+        await asyncio.wait_for(waiter, timeout=2.0)
+    finally:
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+    assert not readiness.watching
+
+
+CERT_PEM = "-----BEGIN CERTIFICATE-----\nMIIB\n-----END CERTIFICATE-----\n"
+
+
+class FakeSignResponse:
+    """RASENMAEHER sign_csr response"""
+
+    def raise_for_status(self) -> None:
+        """Always succeeds"""
+
+    async def json(self) -> Dict[str, str]:
+        """Signed cert"""
+        return {"certificate": CERT_PEM}
+
+
+class FakeRMSession:  # pylint: disable=too-few-public-methods
+    """Session that answers every POST with the signed cert"""
+
+    @asynccontextmanager
+    async def post(self, *args: Any, **kwargs: Any) -> AsyncIterator[FakeSignResponse]:
+        """Fake POST"""
+        _ = args, kwargs
+        yield FakeSignResponse()
+
+
+@pytest.mark.asyncio
+async def test_sign_csr_replaces_cert(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that the signed cert is complete when the waiters are notified and written via rename"""
+    monkeypatch.setattr(config, "RMAPI_PERSISTENT_FOLDER", tmp_path)
+
+    @asynccontextmanager
+    async def fake_session() -> AsyncIterator[FakeRMSession]:
+        """Fake shared session"""
+        yield FakeRMSession()
+
+    seen: List[str] = []
+    replaced: List[str] = []
+    real_replace = os.replace
+
+    def spy_replace(src: Any, dst: Any) -> None:
+        """Record atomic replaces"""
+        replaced.append(Path(dst).name)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(tak_helpers, "rm_mtls_session", fake_session)
+    monkeypatch.setattr(os, "replace", spy_replace)
+    user = tak_helpers.UserCRUD(UserCRUDRequest(uuid="signed", callsign="NORPPA14a", x509cert=""))
+    monkeypatch.setattr(KEYPAIR_READY, "notify", lambda userdata: seen.append(user.certpath.read_text("utf-8")))
+    user.userdata.mkdir(parents=True)
+
+    await user.sign_csr("csr")
+    assert seen == [CERT_PEM]
+    assert replaced == [user.certpath.name]
+    assert [path.name for path in user.userdata.iterdir()] == [user.certpath.name]
@@ -0,0 +1,31 @@
+"""Test building the mission package variants"""
+
+from pathlib import Path
+from typing import List
+import io
+import zipfile
+
+import pytest
+from libpvarki.schemas.product import UserCRUDRequest
+
+from takrmapi import config
+from takrmapi.takutils.tak_pkg_helpers import TAKPackageZip
+
+from .conftest import package_user
+
+
+@pytest.mark.asyncio
+async def test_variants_share_secrets(pkcs12_calls: List[str]) -> None:
+    """Check that user PKCS12 is created once for all variants"""
+    user = package_user(UserCRUDRequest(uuid="variants", callsign="NORPPA11a", x509cert=""))
+
+    variants = [Path("atak"), Path("itak"), Path("tak-tracker")]
+    datapackages = await TAKPackageZip(user).create_mission_packages(variants)
+
+    assert pkcs12_calls.count("NORPPA11a") == 1
+    assert [dp.zip_stream.filename for dp in datapackages] == [
+        f"{config.TAK_SERVER_NAME}_{variant}.zip" for variant in variants
+    ]
+    with zipfile.ZipFile(io.BytesIO(datapackages[0].zip_stream.read_all())) as zfile:
+        p12_names = [name for name in zfile.namelist() if name.endswith(".p12")]
+        assert sorted(zfile.read(name) for name in p12_names) == [b"p12-NORPPA11a", b"p12-ca-chains"]
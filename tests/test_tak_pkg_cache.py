@@ -0,0 +1,145 @@
+"""Test the generated package cache"""
+
+from pathlib import Path
+from unittest import mock
+import os
+import time
+
+from takrmapi.takutils.tak_pkg_cache import TAKPackageCache, TAKPackageCacheKey, TAKCachedPackage
+
+
+def make_key(user_uuid: str = "uuid1", variant: str = "atak", cert: str = "cert1") -> TAKPackageCacheKey:
+    """Return cache key for test package"""
+    return TAKPackageCacheKey(
+        user_uuid=user_uuid,
+        callsign="NORPPA11a",
+        package=variant,
+        tree_version="v1",
+        cert_fingerprint=cert,
+        mesh_key_hash="mesh",
+    )
+
+
+def make_package(user_uuid: str = "uuid1", variant: str = "atak", size: int = 10) -> TAKCachedPackage:
+    """Return test package"""
+    return TAKCachedPackage(filename=f"{variant}.zip", data=b"x" * size, user_uuid=user_uuid)
+
+
+def test_hit_miss() -> None:
+    """Check basic get/put and counters"""
+    cache = TAKPackageCache(max_bytes=1000, ttl=60)
+    assert cache.get(make_key()) is None
+    cache.put(make_key(), make_package())
+    hit = cache.get(make_key())
+    assert hit is not None
+    assert hit.filename == "atak.zip"
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+
+
+def test_lru_size_bound() -> None:
+    """Check that least recently used entries are evicted when size is exceeded"""
+    cache = TAKPackageCache(max_bytes=25, ttl=60)
+    cache.put(make_key(variant="atak"), make_package(variant="atak"))
+    cache.put(make_key(variant="itak"), make_package(variant="itak"))
+    assert cache.get(make_key(variant="atak")) is not None
+    cache.put(make_key(variant="wintak"), make_package(variant="wintak"))
+    assert cache.get(make_key(variant="itak")) is None
+    assert cache.get(make_key(variant="atak")) is not None
+    assert cache.size == 20
+    assert cache.stats["evictions"] == 1
+
+
+def test_ttl() -> None:
+    """Check that expired entries are not returned"""
+    cache = TAKPackageCache(max_bytes=1000, ttl=60)
+    cache.put(make_key(), make_package())
+    created = cache._entries[make_key().digest].created  # pylint: disable=protected-access
+    with mock.patch("time.monotonic", return_value=created + 61):
+        assert cache.get(make_key()) is None
+    assert len(cache) == 0
+
+
+def test_cert_change_and_invalidation() -> None:
+    """Check that new cert drops the stale build and user invalidation drops everything"""
+    cache = TAKPackageCache(max_bytes=1000, ttl=60)
+    cache.put(make_key(cert="cert1"), make_package())
+    cache.put(make_key(cert="cert2"), make_package())
+    assert len(cache) == 1
+    assert cache.get(make_key(cert="cert1")) is None
+    cache.put(make_key(variant="itak", cert="cert2"), make_package(variant="itak"))
+    cache.put(make_key(user_uuid="uuid2"), make_package(user_uuid="uuid2"))
+    assert cache.invalidate_user("uuid1") == 2
+    assert len(cache) == 1
+
+
+def test_disabled() -> None:
+    """Check that zero size disables the cache"""
+    cache = TAKPackageCache(max_bytes=0, ttl=60)
+    cache.put(make_key(), make_package())
+    assert cache.get(make_key()) is None
+
+
+def test_shared_folder(tmp_path: Path) -> None:
+    """Check that packages written by one worker are served by another and invalidation removes them"""
+    worker1 = TAKPackageCache(max_bytes=1000, ttl=60, shared_folder=tmp_path)
+    worker2 = TAKPackageCache(max_bytes=1000, ttl=60, shared_folder=tmp_path)
+    worker1.put(make_key(), make_package())
+    assert worker2.get(make_key()) is None
+    loaded = worker2.load(make_key())
+    assert loaded is not None
+    assert (loaded.filename, loaded.data) == ("atak.zip", b"x" * 10)
+    assert worker2.get(make_key()) is not None
+    assert worker2.stats["shared_hits"] == 1
+
+    worker1.put(make_key(cert="cert2"), make_package(size=5))
+    assert worker2.load(make_key(cert="cert1")) is None
+    assert [path.name for path in (tmp_path / "uuid1").iterdir()] == [make_key(cert="cert2").digest]
+
+    worker2.invalidate_user("uuid1")
+    assert worker1.load(make_key(cert="cert2")) is None
+    assert not (tmp_path / "uuid1").exists()
+
+
+def test_shared_ttl(tmp_path: Path) -> None:
+    """Check that expired packages in the shared folder are not returned"""
+    cache = TAKPackageCache(max_bytes=1000, ttl=60, shared_folder=tmp_path)
+    cache.put(make_key(), make_package())
+    path = tmp_path / "uuid1" / make_key().digest / "atak.zip"
+    expired = time.time() - 61
+    os.utime(path, (expired, expired))
+    assert cache.load(make_key()) is None
+    assert not path.exists()
+
+
+def test_shared_private(tmp_path: Path) -> None:
+    """Check that shared packages are only readable by the service"""
+    cache = TAKPackageCache(max_bytes=1000, ttl=60, shared_folder=tmp_path / "package_cache")
+    cache.put(make_key(), make_package())
+    path = tmp_path / "package_cache" / "uuid1" / make_key().digest / "atak.zip"
+    assert path.stat().st_mode & 0o777 == 0o600
+    for folder in (path.parent, path.parent.parent, tmp_path / "package_cache"):
+        assert folder.stat().st_mode & 0o777 == 0o700
+
+
+def test_build_started_before_invalidation(tmp_path: Path) -> None:
+    """Check that a build that was running when the user was invalidated is not stored"""
+    cache = TAKPackageCache(max_bytes=1000, ttl=60, shared_folder=tmp_path)
+    package = make_package()
+    cache.invalidate_user("uuid1")
+    cache.put(make_key(), package)
+    assert cache.get(make_key()) is None
+    assert not (tmp_path / "uuid1").exists()
+
+    cache.put(make_key(), make_package())
+    assert cache.get(make_key()) is not None
+
+
+def test_entry_limit() -> None:
+    """Check that archives over the entry limit are not cached"""
+    cache = TAKPackageCache(max_bytes=1000, ttl=60, max_entry_bytes=10)
+    cache.put(make_key(variant="itak"), make_package(variant="itak", size=11))
+    assert cache.get(make_key(variant="itak")) is None
+    cache.put(make_key(), make_package(size=10))
+    assert cache.get(make_key()) is not None
+    assert TAKPackageCache(max_bytes=100, ttl=60, max_entry_bytes=1000).max_entry_bytes == 100
@@ -0,0 +1,124 @@
+"""Test the in-memory template tree index"""
+
+from pathlib import Path
+from typing import Any, List
+import os
+import threading
+
+import pytest
+
+from takrmapi.takutils.tak_pkg_catalog import TAKTemplateCatalog, TAKTemplateTree
+
+
+def _make_tree(root: Path) -> None:
+    """Create default and addon package templates"""
+    (root / "default" / "atak" / "MANIFEST").mkdir(parents=True)
+    (root / "default" / "atak" / "MANIFEST" / "manifest.xml.tpl").write_text("<default/>", encoding="utf-8")
+    (root / "default" / "atak" / "maps.xml").write_text("<maps/>", encoding="utf-8")
+    (root / "addon" / "atak" / "MANIFEST").mkdir(parents=True)
+    (root / "addon" / "atak" / "MANIFEST" / "manifest.xml.tpl").write_text("<addon/>", encoding="utf-8")
+    (root / "addon" / "atak" / "extra.pref").write_text("<preferences/>", encoding="utf-8")
+
+
+def test_package_files_override(tmp_path: Path) -> None:
+    """Check that addon files override the defaults by relative path"""
+    _make_tree(tmp_path)
+    catalog = TAKTemplateCatalog(roots=[tmp_path], recheck_interval=0.0)
+
+    assert catalog.is_dir(tmp_path / "default" / "atak")
+    assert catalog.exists(tmp_path / "default" / "atak" / "maps.xml")
+    assert not catalog.is_dir(tmp_path / "default" / "atak" / "maps.xml")
+    assert not catalog.exists(tmp_path / "default" / "nothere")
+
+    pkg_files = catalog.package_files(tmp_path / "default" / "atak", tmp_path / "addon" / "atak")
+    assert pkg_files == {
+        "MANIFEST/manifest.xml.tpl": tmp_path / "addon" / "atak" / "MANIFEST" / "manifest.xml.tpl",
+        "maps.xml": tmp_path / "default" / "atak" / "maps.xml",
+        "extra.pref": tmp_path / "addon" / "atak" / "extra.pref",
+    }
+    assert catalog.package_files(tmp_path / "default" / "atak", tmp_path / "addon" / "atak") is pkg_files
+    assert catalog.package_files(tmp_path / "default" / "atak", None) == {
+        "MANIFEST/manifest.xml.tpl": tmp_path / "default" / "atak" / "MANIFEST" / "manifest.xml.tpl",
+        "maps.xml": tmp_path / "default" / "atak" / "maps.xml",
+    }
+
+
+def test_refresh_on_change(tmp_path: Path) -> None:
+    """Check that added and removed files are picked up"""
+    _make_tree(tmp_path)
+    catalog = TAKTemplateCatalog(roots=[tmp_path], recheck_interval=0.0)
+    before = catalog.package_files(tmp_path / "default" / "atak", None)
+    assert "new.xml" not in before
+
+    newfile = tmp_path / "default" / "atak" / "new.xml"
+    newfile.write_text("<new/>", encoding="utf-8")
+    # Make sure the directory mtime differs even on coarse timestamp filesystems
+    stat = newfile.parent.stat()
+    os.utime(newfile.parent, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    after = catalog.package_files(tmp_path / "default" / "atak", None)
+    assert after["new.xml"] == newfile
+
+    (tmp_path / "default" / "atak" / "maps.xml").unlink()
+    catalog.refresh_path(tmp_path / "default" / "atak" / "maps.xml")
+    assert not catalog.exists(tmp_path / "default" / "atak" / "maps.xml")
+
+
+def test_list_dir(tmp_path: Path) -> None:
+    """Check directory listings and the filesystem fallback outside the roots"""
+    _make_tree(tmp_path)
+    catalog = TAKTemplateCatalog(roots=[tmp_path / "default"], recheck_interval=10.0)
+    assert catalog.list_dir(tmp_path / "default" / "atak") == {"MANIFEST": True, "maps.xml": False}
+    assert catalog.list_dir(tmp_path / "addon" / "atak") == {"MANIFEST": True, "extra.pref": False}
+
+
+def test_refresh_on_content_edit(tmp_path: Path) -> None:
+    """Check that in-place edits of template files are picked up without directory mtime changes"""
+    _make_tree(tmp_path)
+    catalog = TAKTemplateCatalog(roots=[tmp_path], recheck_interval=0.0)
+    tplfile = tmp_path / "default" / "atak" / "MANIFEST" / "manifest.xml.tpl"
+    generation = catalog.generation
+    before = catalog.file_stat(tplfile)
+    assert before is not None
+
+    dir_stat = tplfile.parent.stat()
+    tplfile.write_text("<edited/>", encoding="utf-8")
+    os.utime(tplfile.parent, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+    os.utime(tplfile, ns=(before[0] + 1_000_000_000, before[0] + 1_000_000_000))
+
+    assert catalog.generation != generation
+    assert catalog.file_stat(tplfile) == (before[0] + 1_000_000_000, len("<edited/>"))
+
+
+@pytest.mark.asyncio
+async def test_recheck_off_loop(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that on the event loop the stat recheck runs in a thread at most once per interval"""
+    _make_tree(tmp_path)
+    catalog = TAKTemplateCatalog(roots=[tmp_path], recheck_interval=3600.0)
+    catalog.scan()
+    threads: List[str] = []
+    changed_dirs = TAKTemplateTree.changed_dirs
+
+    def record_thread(self: TAKTemplateTree, *args: Any) -> List[str]:
+        """Record where the stats run"""
+        threads.append(threading.current_thread().name)
+        return changed_dirs(self, *args)
+
+    monkeypatch.setattr(TAKTemplateTree, "changed_dirs", record_thread)
+    newfile = tmp_path / "default" / "atak" / "new.xml"
+    newfile.write_text("<new/>", encoding="utf-8")
+    stat = newfile.parent.stat()
+    os.utime(newfile.parent, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    # Within the interval the index is used as is
+    assert not catalog.exists(newfile)
+    assert catalog.recheck_task is None
+
+    catalog.recheck_interval = 0.0
+    assert not catalog.exists(newfile)
+    task = catalog.recheck_task
+    assert task is not None
+    assert not catalog.exists(newfile)
+    assert catalog.recheck_task is task
+    await task
+    assert catalog.exists(newfile)
+    assert threads and threading.main_thread().name not in threads
@@ -0,0 +1,46 @@
+"""Test the packaging executor"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from takrmapi.takutils.tak_pkg_executor import TAKPackagingExecutor
+
+
+@pytest.mark.asyncio
+async def test_concurrency_cap() -> None:
+    """Check that no more than max_concurrency jobs run at the same time and waits are recorded"""
+    executor = TAKPackagingExecutor(threads=4, processes=0, max_concurrency=2)
+    lock = threading.Lock()
+    active = [0, 0]  # current, peak
+
+    def job(value: int) -> int:
+        """Blocking work"""
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return value * 2
+
+    results = await asyncio.gather(*[executor.run(job, value) for value in range(6)])
+    executor.shutdown()
+
+    assert results == [0, 2, 4, 6, 8, 10]
+    assert active[1] == 2
+    stats = executor.stats
+    assert stats["completed"] == 6
+    assert stats["queued"] == 0
+    assert stats["running"] == 0
+    assert stats["wait_max"] >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_run_cpu_without_processes() -> None:
+    """Check that CPU jobs fall back to threads when process pool is not configured"""
+    executor = TAKPackagingExecutor(threads=1, processes=0, max_concurrency=1)
+    assert await executor.run_cpu(sorted, [3, 1, 2], reverse=True) == [3, 2, 1]
+    executor.shutdown()
@@ -0,0 +1,49 @@
+"""Test the mission package manifest model"""
+
+from pathlib import PurePosixPath
+
+import pytest
+
+from takrmapi.takutils.tak_pkg_manifest import TAKManifest
+
+MANIFEST = """<MissionPackageManifest version="2">
+   <Configuration>
+      <Parameter name="uid" value="0a5e1a4c"/>
+      <Parameter name="name" value="localmaeher"/>
+   </Configuration>
+   <Contents>
+      <Content ignore="false" zipEntry="server.pref"/>
+      <Content ignore="false" zipEntry="rasenmaeher_ca-public.p12"/>
+      <!-- <Content ignore="false" zipEntry="OLD.p12"/> -->
+      <Content ignore="false"
+               zipEntry="cert/NORPPA11a.p12"/>
+      <Content ignore="true">legacy/FOO.P12</Content>
+   </Contents>
+</MissionPackageManifest>
+"""
+
+
+def test_parse_manifest() -> None:
+    """Check that comments are skipped and multi-line and element text entries are parsed"""
+    manifest = TAKManifest.parse(MANIFEST)
+    assert manifest.version == "2"
+    assert manifest.parameters == {"uid": "0a5e1a4c", "name": "localmaeher"}
+    assert [content.zip_entry for content in manifest.contents] == [
+        "server.pref",
+        "rasenmaeher_ca-public.p12",
+        "cert/NORPPA11a.p12",
+        "legacy/FOO.P12",
+    ]
+    pkcs12 = manifest.pkcs12_contents
+    assert [(content.folder, content.name) for content in pkcs12] == [
+        (PurePosixPath("."), "rasenmaeher_ca-public.p12"),
+        (PurePosixPath("cert"), "NORPPA11a.p12"),
+        (PurePosixPath("legacy"), "FOO.P12"),
+    ]
+    assert pkcs12[2].ignore
+
+
+def test_invalid_manifest() -> None:
+    """Check that broken manifest raises ValueError"""
+    with pytest.raises(ValueError):
+        TAKManifest.parse("<MissionPackageManifest><Contents>")
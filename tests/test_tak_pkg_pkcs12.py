@@ -0,0 +1,95 @@
+"""Test the PKCS12 caches"""
+
+from pathlib import Path
+from typing import Any, List, Union
+import os
+
+import pytest
+from libadvian.binpackers import ensure_utf8
+
+from takrmapi.takutils import tak_pkg_pkcs12
+from takrmapi.takutils.tak_pkg_pkcs12 import TAKCABundle, TAKUserPKCS12Cache
+
+
+@pytest.fixture
+def pem_calls(monkeypatch: pytest.MonkeyPatch) -> List[bytes]:
+    """Replace the PKCS12 conversion with recorder"""
+    calls: List[bytes] = []
+
+    def fake_pkcs12(pemdata: Union[str, bytes], *args: Any) -> bytes:
+        """Record the calls"""
+        _ = args
+        calls.append(ensure_utf8(pemdata))
+        return b"p12:" + ensure_utf8(pemdata)
+
+    monkeypatch.setattr(tak_pkg_pkcs12, "convert_pem_to_pkcs12", fake_pkcs12)
+    return calls
+
+
+def test_ca_bundle_rebuild(tmp_path: Path, pem_calls: List[bytes]) -> None:  # pylint: disable=redefined-outer-name
+    """Check that CA bundle is rebuilt only when the sources change and is shared via the persisted copy"""
+    fullchain = tmp_path / "fullchain.pem"
+    fullchain.write_bytes(b"chain\n")
+    pem_folder = tmp_path / "templates"
+    pem_folder.mkdir()
+    (pem_folder / "1_root.pem").write_bytes(b"root\n")
+    persist_path = tmp_path / "persistent" / "ca.p12"
+
+    bundle = TAKCABundle(fullchain, pem_folder, persist_path, recheck_interval=0.0)
+    assert bundle.get() == b"p12:chain\nroot\n"
+    assert bundle.get() == b"p12:chain\nroot\n"
+    assert bundle.stats == {"hits": 1, "rebuilds": 1, "loads": 0}
+
+    (pem_folder / "1_root.pem").write_bytes(b"newroot\n")
+    stat = (pem_folder / "1_root.pem").stat()
+    os.utime(pem_folder / "1_root.pem", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert bundle.get() == b"p12:chain\nnewroot\n"
+    assert bundle.rebuilds == 2
+
+    other_worker = TAKCABundle(fullchain, pem_folder, persist_path, recheck_interval=0.0)
+    assert other_worker.get() == b"p12:chain\nnewroot\n"
+    assert other_worker.stats == {"hits": 0, "rebuilds": 0, "loads": 1}
+    assert len(pem_calls) == 2
+
+
+def test_ca_bundle_persisted_version(  # pylint: disable=redefined-outer-name
+    tmp_path: Path, pem_calls: List[bytes]
+) -> None:
+    """Check that the persisted bundle carries its own version and is used only when it matches the sources"""
+    fullchain = tmp_path / "fullchain.pem"
+    fullchain.write_bytes(b"chain\n")
+    pem_folder = tmp_path / "templates"
+    pem_folder.mkdir()
+    persist_path = tmp_path / "persistent" / "ca.p12"
+
+    bundle = TAKCABundle(fullchain, pem_folder, persist_path, recheck_interval=0.0)
+    assert bundle.get() == b"p12:chain\n"
+    _, version = bundle.source_version()
+    assert persist_path.read_bytes() == version.encode("utf-8") + b"\np12:chain\n"
+    assert list(persist_path.parent.iterdir()) == [persist_path]
+
+    # Bundle of another source version, e.g. written by a worker that saw older PEMs
+    persist_path.write_bytes(b"otherversion\np12:stale\n")
+    other_worker = TAKCABundle(fullchain, pem_folder, persist_path, recheck_interval=0.0)
+    assert other_worker.get() == b"p12:chain\n"
+    assert other_worker.stats == {"hits": 0, "rebuilds": 1, "loads": 0}
+    assert persist_path.read_bytes() == version.encode("utf-8") + b"\np12:chain\n"
+    assert len(pem_calls) == 2
+
+
+def test_user_pkcs12_cache() -> None:
+    """Check that user PKCS12 is re-used only for the same user until the cert changes or the user is invalidated"""
+    cache = TAKUserPKCS12Cache(max_entries=2)
+    assert cache.get("u1", "cert1", "key1", "NORPPA11a") is None
+    cache.put("u1", "cert1", "key1", "NORPPA11a", b"p12-1")
+    assert cache.get("u1", "cert1", "key1", "NORPPA11a") == b"p12-1"
+    assert cache.get("u1", "cert1", "key1", "NORPPA12a") is None
+    assert cache.get("u2", "cert1", "key1", "NORPPA11a") is None
+
+    cache.put("u1", "cert2", "key2", "NORPPA11a", b"p12-2")
+    cache.put("u2", "cert3", "key3", "NORPPA12a", b"p12-3")
+    assert cache.stats == {"hits": 1, "misses": 3, "evictions": 1, "entries": 2}
+
+    assert cache.invalidate_user("u1") == 1
+    assert cache.get("u1", "cert2", "key2", "NORPPA11a") is None
+    assert cache.get("u2", "cert3", "key3", "NORPPA12a") == b"p12-3"
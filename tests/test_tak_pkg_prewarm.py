@@ -0,0 +1,98 @@
+"""Test the background package builds"""
+
+from pathlib import Path
+from typing import Any, List
+import asyncio
+
+import pytest
+from libpvarki.schemas.product import UserCRUDRequest
+
+from takrmapi.api import usercrud
+from takrmapi.takutils.tak_helpers import Helpers, UserCRUD
+from takrmapi.takutils.tak_pkg_cache import PACKAGE_CACHE
+from takrmapi.takutils.tak_pkg_helpers import TAKPackageZip
+from takrmapi.takutils.tak_pkg_prewarm import PACKAGE_PREWARMER, TAKPackagePrewarmer
+
+from .conftest import package_user
+
+
+@pytest.mark.asyncio
+async def test_prewarm_fills_cache(pkcs12_calls: List[str]) -> None:
+    """Check that prewarmed packages are served from the cache shared by the workers"""
+    request = UserCRUDRequest(uuid="prewarm", callsign="NORPPA12a", x509cert="")
+    user = package_user(request)
+
+    variants = [Path("atak"), Path("itak")]
+    prewarmer = TAKPackagePrewarmer(variants, max_concurrency=1)
+    task = prewarmer.schedule(request)
+    assert task is not None
+    await task
+    assert prewarmer.stats == {"scheduled": 1, "pending": 0, "completed": 1, "failed": 0, "cancelled": 0}
+    assert len(PACKAGE_CACHE) == 2
+
+    # The download lands on another worker
+    PACKAGE_CACHE.clear()
+    shared_hits = PACKAGE_CACHE.shared_hits
+    await TAKPackageZip(user).create_mission_packages(variants)
+    assert PACKAGE_CACHE.shared_hits == shared_hits + 2
+    assert pkcs12_calls.count("NORPPA12a") == 1
+
+
+@pytest.mark.asyncio
+async def test_prewarm_concurrency(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that only max_concurrency users are warmed at a time and newer request replaces pending one"""
+    monkeypatch.setattr(PACKAGE_CACHE, "shared_folder", tmp_path)
+    running: List[str] = []
+    peak: List[int] = []
+
+    async def fake_create(self: Any, variants: Any) -> List[Any]:
+        """Track concurrent builds"""
+        _ = variants
+        running.append(self.user.user.uuid)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(self.user.user.uuid)
+        return []
+
+    monkeypatch.setattr(TAKPackageZip, "create_mission_packages", fake_create)
+    prewarmer = TAKPackagePrewarmer([Path("atak")], max_concurrency=2)
+    for idx in range(5):
+        prewarmer.schedule(UserCRUDRequest(uuid=f"user{idx}", callsign=f"USER{idx}", x509cert=""))
+    prewarmer.schedule(UserCRUDRequest(uuid="user4", callsign="USER4", x509cert=""))
+    await asyncio.sleep(0.1)
+
+    assert max(peak) == 2
+    assert prewarmer.stats == {"scheduled": 6, "pending": 0, "completed": 5, "failed": 0, "cancelled": 1}
+    await prewarmer.shutdown()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("enabled", [True, False])
+async def test_prewarm_only_enabled_users(enabled: bool, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that users/created prewarms only when TAK enabled the user"""
+    scheduled: List[str] = []
+
+    async def noop(*args: Any) -> bool:
+        """Skip the key generation and cert checks"""
+        _ = args
+        return True
+
+    async def fake_enable(*args: Any) -> bool:
+        """Enable script result"""
+        _ = args
+        return enabled
+
+    monkeypatch.setattr(UserCRUD, "create_user_dir_and_files", noop)
+    monkeypatch.setattr(Helpers, "user_cert_write", noop)
+    monkeypatch.setattr(Helpers, "user_cert_validate", noop)
+    monkeypatch.setattr(Helpers, "add_user_to_tak_with_cert", fake_enable)
+    monkeypatch.setattr(PACKAGE_PREWARMER, "schedule", lambda user: scheduled.append(user.uuid))
+
+    await usercrud.user_created(UserCRUDRequest(uuid="created", callsign="NORPPA13a", x509cert=""))
+    assert scheduled == (["created"] if enabled else [])
+
+
+def test_prewarm_needs_shared_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that prewarming is off while the package cache is not shared between the workers"""
+    monkeypatch.setattr(PACKAGE_CACHE, "shared_folder", None)
+    assert not TAKPackagePrewarmer([Path("atak")], max_concurrency=1).enabled
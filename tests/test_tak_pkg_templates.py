@@ -0,0 +1,52 @@
+"""Test the shared template environment"""
+
+from pathlib import Path
+from typing import Generator
+
+import pytest
+from jinja2 import Template
+
+from takrmapi import config
+from takrmapi.takutils.tak_pkg_templates import TEMPLATE_ENV
+from takrmapi.takutils.tak_pkg_vars import TAKDataPackagePathVars
+
+
+@pytest.fixture
+def template_env(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Generator[Path, None, None]:
+    """Use temporary addon folder and bytecode cache location"""
+    addon = tmp_path / "addon"
+    monkeypatch.setattr(TAKDataPackagePathVars, "missionpkg_extra_folder", addon)
+    monkeypatch.setattr(config, "RMAPI_PERSISTENT_FOLDER", tmp_path / "persistent")
+    TEMPLATE_ENV.reset()
+    yield addon
+    TEMPLATE_ENV.reset()
+
+
+def test_render_matches_plain_template(template_env: Path) -> None:  # pylint: disable=redefined-outer-name
+    """Check that shared environment renders the same as standalone template and caches the compile"""
+    _ = template_env
+    tpl_path = TAKDataPackagePathVars.missionpkg_default_folder / "atak" / "server.pref.tpl"
+    assert TEMPLATE_ENV.template_name(tpl_path) == "missionpkg/atak/server.pref.tpl"
+
+    context = {"v": {"client_cert_name": "NORPPA11a", "tak_server_public_address": "tak.example.com"}}
+    expected = Template(tpl_path.read_text(encoding="utf-8")).render(**context)
+    assert TEMPLATE_ENV.render_file(tpl_path, **context) == expected
+    assert TEMPLATE_ENV.get_template_file(tpl_path) is TEMPLATE_ENV.get_template_file(tpl_path)
+    assert list((config.RMAPI_PERSISTENT_FOLDER / "jinja_cache").iterdir())
+
+
+def test_addon_overrides_default(template_env: Path) -> None:  # pylint: disable=redefined-outer-name
+    """Check that addon template is used instead of default one"""
+    (template_env / "atak").mkdir(parents=True)
+    (template_env / "atak" / "server.pref.tpl").write_text("addon {{ v.client_cert_name }}", encoding="utf-8")
+    tpl_path = TAKDataPackagePathVars.missionpkg_default_folder / "atak" / "server.pref.tpl"
+    assert TEMPLATE_ENV.render_file(tpl_path, v={"client_cert_name": "NORPPA11a"}) == "addon NORPPA11a"
+
+
+def test_html_is_escaped(template_env: Path) -> None:  # pylint: disable=redefined-outer-name
+    """Check that autoescape is on for html and off for package templates"""
+    (template_env / "esc").mkdir(parents=True)
+    (template_env / "esc" / "page.html").write_text("{{ x }}", encoding="utf-8")
+    (template_env / "esc" / "page.xml.tpl").write_text("{{ x }}", encoding="utf-8")
+    assert TEMPLATE_ENV.get_template("missionpkg/esc/page.html").render(x="<b>") == "&lt;b&gt;"
+    assert TEMPLATE_ENV.get_template("missionpkg/esc/page.xml.tpl").render(x="<b>") == "<b>"
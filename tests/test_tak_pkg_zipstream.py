@@ -0,0 +1,164 @@
+"""Test the streaming package archive assembly"""
+
+from pathlib import Path
+from typing import List
+import io
+import os
+import time
+import zipfile
+
+from takrmapi.takutils.tak_pkg_compression import TAKCompressionPolicy, get_compressor, parse_extensions
+from takrmapi.takutils.tak_pkg_zipstream import TAKZipStream, precompress_file
+from takrmapi.takutils.tak_pkg_skeleton import TAKZipSkeleton
+
+
+def test_stream_roundtrip(tmp_path: Path) -> None:
+    """Check that streamed archive can be read back with zipfile"""
+    srcfile = tmp_path / "Google_Hybrid.xml"
+    srcfile.write_bytes(os.urandom(200000))
+
+    zstream = TAKZipStream(filename="test.zip")
+    zstream.add_bytes("MANIFEST/manifest.xml", b"<MissionPackageManifest/>")
+    zstream.add_file("maps/Google_Hybrid.xml", srcfile)
+    zstream.add_bytes("cert/NÄÄTÄ01.p12", b"\x00\x01\x02")
+    assert zstream.arcnames == [
+        "MANIFEST/",
+        "MANIFEST/manifest.xml",
+        "maps/",
+        "maps/Google_Hybrid.xml",
+        "cert/",
+        "cert/NÄÄTÄ01.p12",
+    ]
+
+    chunks = list(zstream.iter_chunks(chunk_size=1024))
+    assert len(chunks) > 1
+    data = b"".join(chunks)
+    assert data == zstream.read_all()
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.namelist() == zstream.arcnames
+        assert zfile.read("maps/Google_Hybrid.xml") == srcfile.read_bytes()
+        assert zfile.read("MANIFEST/manifest.xml") == b"<MissionPackageManifest/>"
+        assert zfile.read("cert/NÄÄTÄ01.p12") == b"\x00\x01\x02"
+
+
+def test_write_to(tmp_path: Path) -> None:
+    """Check writing the archive to file"""
+    zstream = TAKZipStream(filename="test.zip")
+    zstream.add_bytes("server.pref", b"<preferences/>")
+    zpath = tmp_path / zstream.filename
+    zstream.write_to(zpath)
+    with zipfile.ZipFile(zpath) as zfile:
+        assert zfile.namelist() == ["server.pref"]
+
+
+def test_fixed_timestamp() -> None:
+    """Check that generated members get the stream timestamp so rebuilds give identical bytes"""
+    zstream = TAKZipStream(filename="test.zip")
+    zstream.add_bytes("MANIFEST/manifest.xml", b"<MissionPackageManifest/>")
+    with zipfile.ZipFile(io.BytesIO(zstream.read_all())) as zfile:
+        assert zfile.getinfo("MANIFEST/manifest.xml").date_time == (1980, 1, 1, 0, 0, 0)
+
+    zstream.timestamp = time.mktime((2024, 5, 17, 12, 30, 0, 0, 0, -1))
+    with zipfile.ZipFile(io.BytesIO(zstream.read_all())) as zfile:
+        assert zfile.getinfo("MANIFEST/").date_time == (2024, 5, 17, 12, 30, 0)
+        assert zfile.getinfo("MANIFEST/manifest.xml").date_time == (2024, 5, 17, 12, 30, 0)
+
+
+def test_on_complete_limit(tmp_path: Path) -> None:
+    """Check that archives over complete_max_bytes are streamed without collecting them for the callbacks"""
+    srcfile = tmp_path / "tiles.sqlite"
+    srcfile.write_bytes(os.urandom(200000))
+    completed: List[bytes] = []
+
+    small = TAKZipStream(filename="small.zip")
+    small.add_bytes("server.pref", b"<preferences/>")
+    small.complete_max_bytes = 1024
+    small.on_complete.append(completed.append)
+    assert completed == [b"".join(small.iter_chunks(chunk_size=64))]
+
+    big = TAKZipStream(filename="big.zip")
+    big.add_file("tiles.sqlite", srcfile)
+    big.complete_max_bytes = 1024
+    big.on_complete.append(completed.append)
+    assert len(b"".join(big.iter_chunks(chunk_size=1024))) > 200000
+    assert len(completed) == 1
+
+
+def test_precompressed_members(tmp_path: Path) -> None:
+    """Check that pre-compressed members are spliced correctly, both deflated and stored"""
+    textfile = tmp_path / "TAK_defaults.pref"
+    textfile.write_bytes(b"<preferences></preferences>\n" * 100)
+    randfile = tmp_path / "icon.png"
+    randfile.write_bytes(os.urandom(4096))
+
+    zstream = TAKZipStream(filename="test.zip")
+    zstream.add_precompressed("TAK_defaults.pref", precompress_file(textfile))
+    zstream.add_precompressed("icons/icon.png", precompress_file(randfile))
+    zstream.add_bytes("server.pref", b"<preferences/>")
+
+    with zipfile.ZipFile(io.BytesIO(zstream.read_all())) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.getinfo("TAK_defaults.pref").compress_type == zipfile.ZIP_DEFLATED
+        assert zfile.getinfo("icons/icon.png").compress_type == zipfile.ZIP_STORED
+        assert zfile.read("TAK_defaults.pref") == textfile.read_bytes()
+        assert zfile.read("icons/icon.png") == randfile.read_bytes()
+
+    stored = precompress_file(textfile, policy=TAKCompressionPolicy(level=0))
+    fast = precompress_file(textfile, policy=TAKCompressionPolicy(level=1))
+    assert stored.data == textfile.read_bytes()
+    assert fast.data != precompress_file(textfile, policy=TAKCompressionPolicy(level=9)).data
+
+
+def test_skeleton_versioning(tmp_path: Path) -> None:
+    """Check that skeleton is reused until the template catalog generation or file contents change"""
+    TAKZipSkeleton.clear()
+    static = tmp_path / "Google_Hybrid.xml"
+    static.write_text("<customMapSource/>", encoding="utf-8")
+    template = tmp_path / "server.pref.tpl"
+    template.write_text("{{ v.client_cert_name }}", encoding="utf-8")
+    package_files = {"Google_Hybrid.xml": static, "server.pref.tpl": template}
+
+    skeleton = TAKZipSkeleton._get_current("test", package_files, (1,))  # pylint: disable=protected-access
+    assert list(skeleton.members) == ["Google_Hybrid.xml"]
+    assert TAKZipSkeleton._get_current("test", package_files, (1,)) is skeleton  # pylint: disable=protected-access
+
+    static.write_text("<customMapSource>changed</customMapSource>", encoding="utf-8")
+    rebuilt = TAKZipSkeleton._get_current("test", package_files, (2,))  # pylint: disable=protected-access
+    assert rebuilt is not skeleton
+    assert rebuilt.version != skeleton.version
+    assert rebuilt.members["Google_Hybrid.xml"].file_size == static.stat().st_size
+
+    # Content edits change the version even when the catalog generation does not
+    static.write_text("<customMapSource>edited in place</customMapSource>", encoding="utf-8")
+    edited = TAKZipSkeleton._get_current("test", package_files, (2,))  # pylint: disable=protected-access
+    assert edited.version != rebuilt.version
+    assert edited.members["Google_Hybrid.xml"].file_size == static.stat().st_size
+
+
+def test_compression_policy(tmp_path: Path) -> None:
+    """Check that policy stores already compressed and tiny members, including streamed files"""
+    tiles = tmp_path / "tiles.mbtiles"
+    tiles.write_bytes(os.urandom(150000))
+    pref = tmp_path / "big.pref"
+    pref.write_bytes(b"<entry/>\n" * 20000)
+    policy = TAKCompressionPolicy(
+        level=6, store_extensions=parse_extensions("mbtiles, .P12"), min_deflate_size=64, compressor=get_compressor()
+    )
+
+    zstream = TAKZipStream(filename="test.zip", policy=policy)
+    zstream.add_file("Maps/tiles.mbtiles", tiles)
+    zstream.add_file("big.pref", pref)
+    zstream.add_bytes("cert/NORPPA11a.p12", b"\x01" * 1000)
+    zstream.add_bytes("tiny.txt", b"x" * 10)
+
+    with zipfile.ZipFile(io.BytesIO(zstream.read_all())) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.getinfo("Maps/tiles.mbtiles").compress_type == zipfile.ZIP_STORED
+        assert zfile.getinfo("big.pref").compress_type == zipfile.ZIP_DEFLATED
+        assert zfile.getinfo("cert/NORPPA11a.p12").compress_type == zipfile.ZIP_STORED
+        assert zfile.getinfo("tiny.txt").compress_type == zipfile.ZIP_STORED
+        assert zfile.read("Maps/tiles.mbtiles") == tiles.read_bytes()
+        assert zfile.read("big.pref") == pref.read_bytes()
+    assert get_compressor("no-such-backend").name == "zlib"
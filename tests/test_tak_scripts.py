@@ -0,0 +1,126 @@
+"""Test the coalescing TAK script queue"""
+
+from pathlib import Path
+from unittest import mock
+import asyncio
+
+import pytest
+
+from takrmapi.takutils import tak_scripts
+from takrmapi.takutils.tak_scripts import TAKScriptQueue, run_tak_script
+
+# Every run waits until BARRIER runs have started, so a batch only succeeds if its jobs run in parallel
+STUB_SCRIPT = """#!/bin/sh
+folder="$(dirname "$0")"
+echo "$(basename "$0") $USER_CERT_NAME" >> "$folder/calls.log"
+if [ -f "$folder/barrier" ]; then
+    i=0
+    while [ "$(wc -l < "$folder/calls.log")" -lt "$(cat "$folder/barrier")" ]; do
+        i=$((i + 1))
+        test $i -lt 200 || exit 2
+        sleep 0.05
+    done
+fi
+test "$USER_CERT_NAME" != "SLOW" || sleep 30
+test "$USER_CERT_NAME" != "BROKEN"
+"""
+
+
+@pytest.fixture
+def scripts_folder(tmp_path: Path) -> Path:
+    """Folder with stub enable_user.sh and delete_user.sh"""
+    for name in ("enable_user.sh", "delete_user.sh"):
+        script = tmp_path / name
+        script.write_text(STUB_SCRIPT, encoding="utf-8")
+        script.chmod(0o755)
+    return tmp_path
+
+
+def read_calls(folder: Path) -> list[str]:
+    """Script runs in start order"""
+    return (folder / "calls.log").read_text(encoding="utf-8").splitlines()
+
+
+@pytest.mark.asyncio
+async def test_coalesced_batch(scripts_folder: Path) -> None:  # pylint: disable=redefined-outer-name
+    """Check that concurrent operations run as parallel jobs of one batch and results fan out to the callers"""
+    (scripts_folder / "barrier").write_text("4", encoding="utf-8")
+    queue = TAKScriptQueue(scripts_folder, window=0.05, max_batch=8, timeout=15.0)
+    names = ["NORPPA11a", "NORPPA11a_rm", "BROKEN", "NORPPA12a", "NORPPA11a"]
+    results = await asyncio.gather(*[queue.submit("enable_user.sh", "USER_CERT_NAME", name) for name in names])
+    await queue.shutdown()
+
+    assert results == [True, True, False, True, True]
+    assert sorted(read_calls(scripts_folder)) == [
+        "enable_user.sh BROKEN",
+        "enable_user.sh NORPPA11a",
+        "enable_user.sh NORPPA11a_rm",
+        "enable_user.sh NORPPA12a",
+    ]
+    stats = queue.stats
+    assert (stats["batches"], stats["operations"], stats["coalesced"], stats["failures"]) == (1, 4, 1, 1)
+    assert (stats["batch_size_max"], stats["batch_size_avg"]) == (4, 4.0)
+    assert 0.0 < stats["latency_avg"] <= stats["latency_max"]
+
+
+@pytest.mark.asyncio
+async def test_batch_size_limit(scripts_folder: Path) -> None:  # pylint: disable=redefined-outer-name
+    """Check that the operations are split into batches of max_batch"""
+    queue = TAKScriptQueue(scripts_folder, window=0.01, max_batch=2, timeout=15.0)
+    results = await asyncio.gather(
+        *[queue.submit("enable_user.sh", "USER_CERT_NAME", f"USER{idx}") for idx in range(5)]
+    )
+    await queue.shutdown()
+    assert all(results)
+    assert queue.stats["batches"] == 3
+    assert queue.stats["batch_size_max"] == 2
+    assert len(read_calls(scripts_folder)) == 5
+
+
+@pytest.mark.asyncio
+async def test_same_certname_in_order(scripts_folder: Path) -> None:  # pylint: disable=redefined-outer-name
+    """Check that operations on the same cert name run one after another in submit order"""
+    queue = TAKScriptQueue(scripts_folder, window=0.01, max_batch=8, timeout=15.0)
+    results = await asyncio.gather(
+        queue.submit("enable_user.sh", "USER_CERT_NAME", "NORPPA11a"),
+        queue.submit("delete_user.sh", "USER_CERT_NAME", "NORPPA11a"),
+        queue.submit("enable_user.sh", "USER_CERT_NAME", "NORPPA11a"),
+    )
+    await queue.shutdown()
+    assert list(results) == [True, True, True]
+    assert read_calls(scripts_folder) == [
+        "enable_user.sh NORPPA11a",
+        "delete_user.sh NORPPA11a",
+        "enable_user.sh NORPPA11a",
+    ]
+    assert queue.stats["batches"] == 3
+
+
+@pytest.mark.asyncio
+async def test_job_timeout(scripts_folder: Path) -> None:  # pylint: disable=redefined-outer-name
+    """Check that a hanging run fails only its own cert name"""
+    queue = TAKScriptQueue(scripts_folder, window=0.01, max_batch=8, timeout=0.5)
+    results = await asyncio.gather(
+        queue.submit("enable_user.sh", "USER_CERT_NAME", "SLOW"),
+        queue.submit("enable_user.sh", "USER_CERT_NAME", "NORPPA11a"),
+    )
+    await queue.shutdown()
+    assert list(results) == [False, True]
+    assert queue.stats["batches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_run_tak_script(scripts_folder: Path) -> None:  # pylint: disable=redefined-outer-name
+    """Check the helper and that a script that can not be run fails the call"""
+    queue = TAKScriptQueue(scripts_folder, window=0.01, max_batch=8, timeout=15.0)
+    with mock.patch.object(tak_scripts, "SCRIPT_QUEUE", queue):
+        assert await run_tak_script("enable_user.sh", "USER_CERT_NAME", ["NORPPA11a", "NORPPA11a_rm"])
+        assert not await run_tak_script("enable_user.sh", "USER_CERT_NAME", ["NORPPA11a", "BROKEN"])
+        assert not await run_tak_script("missing.sh", "USER_CERT_NAME", ["NORPPA11a"])
+    await queue.shutdown()
+    assert sorted(read_calls(scripts_folder)) == [
+        "enable_user.sh BROKEN",
+        "enable_user.sh NORPPA11a",
+        "enable_user.sh NORPPA11a",
+        "enable_user.sh NORPPA11a_rm",
+    ]
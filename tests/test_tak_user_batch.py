@@ -0,0 +1,58 @@
+"""Test the batch user provisioning"""
+
+from typing import Any, Dict, List
+import asyncio
+
+import pytest
+from libpvarki.schemas.product import UserCRUDRequest
+
+from takrmapi.takutils.tak_helpers import Helpers, UserCRUD
+from takrmapi.takutils.tak_user_batch import TAKUserProvisioner
+
+
+@pytest.mark.asyncio
+async def test_provision_stage_limits(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that stages overlap across users within their caps and failures are reported per user"""
+    running: Dict[str, int] = {"keygen": 0, "sign": 0, "enable": 0}
+    peaks: Dict[str, int] = dict(running)
+
+    async def track(stage: str) -> None:
+        """Record concurrency of the stage"""
+        running[stage] += 1
+        peaks[stage] = max(peaks[stage], running[stage])
+        await asyncio.sleep(0.01)
+        running[stage] -= 1
+
+    async def fake_keygen(self: UserCRUD) -> str:
+        """Fake keypair and CSR"""
+        await track("keygen")
+        return f"csr-{self.callsign}"
+
+    async def fake_sign(self: UserCRUD, csrpem: str) -> None:
+        """Fake signing, fail for one user"""
+        _ = self
+        await track("sign")
+        if csrpem == "csr-BROKEN":
+            raise ValueError("sign_csr refused")
+
+    async def fake_enable(self: Helpers) -> bool:
+        """Fake enable script"""
+        _ = self
+        await track("enable")
+        return True
+
+    monkeypatch.setattr(UserCRUD, "create_keypair_and_csr", fake_keygen)
+    monkeypatch.setattr(UserCRUD, "sign_csr", fake_sign)
+    monkeypatch.setattr(Helpers, "add_user_to_tak_with_cert", fake_enable)
+
+    users = [UserCRUDRequest(uuid=f"uuid{idx}", callsign=f"USER{idx}", x509cert="") for idx in range(10)]
+    users[3] = UserCRUDRequest(uuid="uuid3", callsign="BROKEN", x509cert="")
+    provisioner = TAKUserProvisioner(keygen_concurrency=3, sign_concurrency=2, enable_concurrency=1)
+    results = await provisioner.provision(users)
+
+    assert peaks == {"keygen": 3, "sign": 2, "enable": 1}
+    assert [result.uuid for result in results] == [user.uuid for user in users]
+    failed: List[Any] = [result for result in results if not result.success]
+    assert len(failed) == 1
+    assert (failed[0].callsign, failed[0].failed_stage, failed[0].error) == ("BROKEN", "sign", "sign_csr refused")
+    assert all(result.failed_stage is None for result in results if result.success)
@@ -7,12 +7,14 @@ from secrets import token_bytes
 from unittest import mock
 
 import pytest
+from fastapi import HTTPException
 
 from takrmapi import __version__
 from takrmapi.api.tak_missionpackage import (
     generate_encrypted_ephemeral_url_fragment,
     parse_encrypted_ephemeral_url_fragment,
 )
+from takrmapi.takutils.tak_ephemeral_token import issue_token, verify_token
 from takrmapi.takutils.tak_pkg_helpers import TAKDataPackage
 
 
@@ -42,6 +44,45 @@ def test_ephemeral_link_generation() -> None:
     assert gotten_uuid == uuid
     assert gotten_variant == "testvariant"
 
+    with pytest.raises(HTTPException):
+        parse_encrypted_ephemeral_url_fragment(encrypted_url[:-2] + ("AA" if encrypted_url[-2:] != "AA" else "BA"))
+    with pytest.raises(HTTPException):
+        parse_encrypted_ephemeral_url_fragment(
+            generate_encrypted_ephemeral_url_fragment(callsign, uuid, "x", now - 301)
+        )
+
+
+def test_ephemeral_token() -> None:
+    """Verify the compact token format"""
+    key = token_bytes(32)
+    token = issue_token(key, "NÄÄTÄ01", "12345678-1234-5678-1234-567812345678", "tak-tracker", issued=1000)
+    # 6 byte header, 12 byte nonce, 16 byte tag and 59 bytes of payload
+    assert len(token) == 124
+    assert token.isascii() and "=" not in token and "+" not in token and "/" not in token
+
+    payload = verify_token(key, token, ttl=300, now=1200)
+    assert (payload.callsign, payload.user_uuid, payload.variant, payload.issued) == (
+        "NÄÄTÄ01",
+        "12345678-1234-5678-1234-567812345678",
+        "tak-tracker",
+        1000,
+    )
+
+    with pytest.raises(ValueError, match="expired"):
+        verify_token(key, token, ttl=300, now=1301)
+    with pytest.raises(ValueError, match="expired"):
+        verify_token(key, token, ttl=300, now=900)
+    with pytest.raises(ValueError):
+        verify_token(bytes(32) if key != bytes(32) else b"\1" * 32, token, ttl=300, now=1200)
+    # Header is authenticated, moving the issue time forward breaks the tag
+    raw = bytearray(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    raw[5] ^= 0x40
+    forged = base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode("ascii")
+    with pytest.raises(ValueError, match="authentication"):
+        verify_token(key, forged, ttl=300, now=1200)
+    with pytest.raises(ValueError):
+        verify_token(key, "not a token!", ttl=300, now=1200)
+
 
 EXAMPLE_KEY = "zyygdR6MGvmCe+Dm5hDMdQqTJa7VNc451SyQrirUXUI="  # pragma: allowlist secret
 